@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+textual inversion token lookup micro-benchmark
+compares sorted-list scan used previously with token trie over synthetic embeddings and prompts
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from types import SimpleNamespace
+from util import log
+
+
+script_dir = os.path.dirname(__file__)
+
+
+class ListLookup:
+    """previous implementation: candidates per first token re-sorted on every registration and scanned at every offset"""
+    def __init__(self):
+        self.ids_lookup = {}
+
+    def add(self, ids, embedding):
+        first_id = ids[0]
+        if first_id not in self.ids_lookup:
+            self.ids_lookup[first_id] = []
+        self.ids_lookup[first_id] = sorted(self.ids_lookup[first_id] + [(ids, embedding)], key=lambda x: len(x[0]), reverse=True)
+
+    def match(self, tokens, offset):
+        possible_matches = self.ids_lookup.get(tokens[offset], None)
+        if possible_matches is None:
+            return None
+        for ids, embedding in possible_matches:
+            if tokens[offset:offset + len(ids)] == ids:
+                return embedding, len(ids)
+        return None
+
+    def search(self, tokens):
+        return [self.match(tokens, i) for i in range(len(tokens))]
+
+
+def synthetic(count: int, vocab: int, max_length: int):
+    embeddings = []
+    for i in range(count):
+        length = random.randint(1, max_length)
+        ids = [random.randint(0, vocab - 1) for _j in range(length)]
+        embeddings.append((ids, SimpleNamespace(name=f'embedding-{i}')))
+    return embeddings
+
+
+def prompts(count: int, length: int, vocab: int, embeddings: list, density: float):
+    res = []
+    for _i in range(count):
+        tokens = []
+        while len(tokens) < length:
+            if random.random() < density:
+                tokens += random.choice(embeddings)[0]
+            else:
+                tokens.append(random.randint(0, vocab - 1))
+        res.append(tokens[:length])
+    return res
+
+
+def walk(lookup, tokens):
+    """same traversal as tokenize_line: skip over matched embeddings"""
+    matches = lookup.search(tokens)
+    found = []
+    position = 0
+    while position < len(tokens):
+        match = matches[position]
+        if match is None:
+            position += 1
+        else:
+            found.append((position, match[0].name))
+            position += match[1]
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'embedding lookup benchmark')
+    parser.add_argument('--embeddings', type = int, default = 5000, required = False, help = 'number of registered embeddings')
+    parser.add_argument('--prompts', type = int, default = 200, required = False, help = 'number of prompts')
+    parser.add_argument('--length', type = int, default = 225, required = False, help = 'prompt length in tokens')
+    parser.add_argument('--vocab', type = int, default = 49408, required = False, help = 'tokenizer vocabulary size')
+    parser.add_argument('--tokens', type = int, default = 4, required = False, help = 'maximum tokens per embedding name')
+    parser.add_argument('--density', type = float, default = 0.05, required = False, help = 'probability of embedding at each prompt position')
+    args = parser.parse_args()
+    sys.argv = sys.argv[:1]
+    sys.path.insert(0, os.path.join(script_dir, '..'))
+    from modules.textual_inversion.textual_inversion import EmbeddingTrie # pylint: disable=wrong-import-position
+
+    random.seed(42)
+    data = synthetic(args.embeddings, args.vocab, args.tokens)
+    corpus = prompts(args.prompts, args.length, args.vocab, data, args.density)
+    log.info(f'corpus: embeddings={len(data)} prompts={len(corpus)} length={args.length} density={args.density}')
+    results = {}
+    for name, cls in [('list', ListLookup), ('trie', EmbeddingTrie)]:
+        lookup = cls()
+        t0 = time.perf_counter()
+        for ids, embedding in data:
+            lookup.add(ids, embedding)
+        t1 = time.perf_counter()
+        results[name] = [walk(lookup, tokens) for tokens in corpus]
+        t2 = time.perf_counter()
+        log.info(f'lookup: type={name} register={1000 * (t1 - t0):.1f}ms search={1000 * (t2 - t1) / len(corpus):.3f}ms per-prompt matches={sum(len(r) for r in results[name])}')
+    mismatch = sum(1 for a, b in zip(results['list'], results['trie']) if a != b)
+    log.info(f'verify: mismatch={mismatch}')
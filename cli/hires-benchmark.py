@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+sd api hires benchmark
+compares latent upscale hires pass with vae decode/encode round trip against latent resident hires pass
+"""
+import json
+import time
+import argparse
+import sdapi
+from util import Map, log
+
+
+def run(options: Map):
+    t0 = time.perf_counter()
+    data = sdapi.postsync('/sdapi/v1/txt2img', options)
+    t1 = time.perf_counter()
+    if 'info' not in data:
+        log.error({ 'txt2img': data })
+        return None, {}
+    info = json.loads(data['info'])
+    stages = {}
+    for stage in info.get('trace', {}).get('stages', []):
+        stages[stage['name']] = stages.get(stage['name'], 0) + stage['time']
+    return t1 - t0, stages
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'hires-benchmark')
+    parser.add_argument("--steps", type=int, default=20, required=False, help="steps")
+    parser.add_argument("--upscaler", type=str, default='Latent Bicubic antialias', required=False, help="latent upscaler")
+    parser.add_argument("--scale", type=float, default=2.0, required=False, help="hires scale")
+    parser.add_argument("--strength", type=float, default=0.5, required=False, help="hires denoising strength")
+    parser.add_argument("--width", type=int, default=512, required=False, help="width")
+    parser.add_argument("--height", type=int, default=512, required=False, help="height")
+    parser.add_argument("--batch", type=int, default=1, required=False, help="batch size")
+    parser.add_argument("--repeats", type=int, default=3, required=False, help="runs per mode")
+    parser.add_argument("--prompt", type=str, default='photo of two dice on a table', required=False, help="prompt")
+    args = parser.parse_args()
+    options = Map({
+        "prompt": args.prompt,
+        "steps": args.steps,
+        "width": args.width,
+        "height": args.height,
+        "batch_size": args.batch,
+        "seed": 42,
+        "enable_hr": True,
+        "hr_upscaler": args.upscaler,
+        "hr_scale": args.scale,
+        "hr_second_pass_steps": args.steps,
+        "denoising_strength": args.strength,
+        "send_images": False,
+        "save_images": False,
+    })
+    original = sdapi.getsync('/sdapi/v1/options').get('hires_latent_resident', True)
+    log.info({ 'hires-benchmark': { 'upscaler': args.upscaler, 'size': f'{args.width}x{args.height}', 'scale': args.scale, 'batch': args.batch } })
+    results = {}
+    for resident in [False, True]:
+        sdapi.postsync('/sdapi/v1/options', { 'hires_latent_resident': resident })
+        run(options) # warmup
+        times, totals = [], {}
+        for _i in range(args.repeats):
+            t, stages = run(options)
+            if t is None:
+                break
+            times.append(t)
+            for k, v in stages.items():
+                totals[k] = totals.get(k, 0) + v
+        if len(times) == 0:
+            continue
+        results[resident] = sum(times) / len(times)
+        log.info({ 'mode': 'latent-resident' if resident else 'decode-encode', 'wall': round(results[resident], 3), 'stages': { k: round(v / len(times), 3) for k, v in totals.items() } })
+    sdapi.postsync('/sdapi/v1/options', { 'hires_latent_resident': original })
+    if len(results) == 2 and results[True] > 0:
+        log.info({ 'speedup': round(results[False] / results[True], 3) })
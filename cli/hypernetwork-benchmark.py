@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+hypernetwork per-step cost micro-benchmark
+simulates attention context transforms of one sampling step with 0, 1 and 3 active hypernetworks and compares per-call application with cached contexts
+self-attention and cross-attention calls are interleaved as in unet transformer blocks, self-attention context is hidden state and is never cached
+"""
+import os
+import sys
+import time
+import argparse
+from util import log
+
+
+script_dir = os.path.dirname(__file__)
+
+
+def apply_uncached(hypernetwork, hypernetworks, context, cache=True): # pylint: disable=unused-argument
+    """previous implementation: every attention layer runs all hypernetwork modules"""
+    context_k, context_v = context, context
+    for h in hypernetworks:
+        context_k, context_v = hypernetwork.apply_single_hypernetwork(h, context_k, context_v)
+    return context_k, context_v
+
+
+def step(fn, hypernetworks, cond, uncond, hidden, layers: int):
+    context = torch.cat([cond, uncond]) # samplers build new context tensor on every step
+    for _i in range(layers):
+        x = hidden + 0 # each block produces new hidden state
+        fn(hypernetworks, x, cache=False) # attn1: context defaults to hidden state
+        context_k, context_v = fn(hypernetworks, context, cache=True) # attn2: cross-attention with conditioning
+    return context_k, context_v
+
+
+def measure(fn, steps: int):
+    fn() # warmup, also populates cache
+    devices.torch_gc()
+    if devices.device.type == 'cuda':
+        torch.cuda.synchronize()
+    t0 = time.perf_counter()
+    for _i in range(steps):
+        fn()
+    if devices.device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - t0) / steps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'hypernetwork benchmark')
+    parser.add_argument('--dim', type = int, default = 768, required = False, help = 'context dimension')
+    parser.add_argument('--tokens', type = int, default = 77, required = False, help = 'context tokens')
+    parser.add_argument('--batch', type = int, default = 1, required = False, help = 'batch size')
+    parser.add_argument('--layers', type = int, default = 16, required = False, help = 'transformer blocks per unet pass, each with self-attention and cross-attention')
+    parser.add_argument('--hidden', type = int, default = 768, required = False, help = 'self-attention hidden dimension, same as context dimension is worst case for cache lookups')
+    parser.add_argument('--pixels', type = int, default = 1024, required = False, help = 'self-attention tokens')
+    parser.add_argument('--steps', type = int, default = 20, required = False, help = 'sampling steps')
+    args = parser.parse_args()
+    sys.argv = sys.argv[:1]
+    sys.path.insert(0, os.path.join(script_dir, '..'))
+    import torch # pylint: disable=wrong-import-position
+    from modules import devices # pylint: disable=wrong-import-position
+    from modules.hypernetworks import hypernetwork # pylint: disable=wrong-import-position
+
+    available = [hypernetwork.Hypernetwork(name=f'benchmark-{i}', enable_sizes=sorted({args.dim, args.hidden}), layer_structure=[1, 2, 1]) for i in range(3)]
+    cond = torch.randn((args.batch, args.tokens, args.dim), device=devices.device, dtype=devices.dtype)
+    uncond = torch.randn((args.batch, args.tokens, args.dim), device=devices.device, dtype=devices.dtype)
+    hidden = torch.randn((2 * args.batch, args.pixels, args.hidden), device=devices.device, dtype=devices.dtype)
+    log.info(f'hypernetwork: device={devices.device} dtype={devices.dtype} context={list(cond.shape)} hidden={list(hidden.shape)} layers={args.layers} steps={args.steps}')
+    transforms = { 'cond': 0 }
+    apply_single = hypernetwork.apply_single_hypernetwork
+
+    def apply_counted(h, context_k, context_v, layer=None):
+        if context_k.shape[1] == args.tokens:
+            transforms['cond'] += 1
+        return apply_single(h, context_k, context_v, layer)
+
+    hypernetwork.apply_single_hypernetwork = apply_counted
+    with devices.inference_context():
+        for count in [0, 1, 3]:
+            active = available[:count]
+            hypernetwork.contexts.clear()
+            t_uncached = measure(lambda active=active: step(lambda h, c, cache: apply_uncached(hypernetwork, h, c), active, cond, uncond, hidden, args.layers), args.steps)
+            transforms['cond'] = 0
+            t_cached = measure(lambda active=active: step(hypernetwork.apply_hypernetworks, active, cond, uncond, hidden, args.layers), args.steps)
+            recomputed = transforms['cond'] // max(count, 1)
+            k_uncached, v_uncached = step(lambda h, c, cache: apply_uncached(hypernetwork, h, c), active, cond, uncond, hidden, 1)
+            k_cached, v_cached = step(hypernetwork.apply_hypernetworks, active, cond, uncond, hidden, 1)
+            match = torch.equal(k_uncached, k_cached) and torch.equal(v_uncached, v_cached)
+            log.info(f'hypernetwork: active={count} uncached={1000 * t_uncached:.3f}ms/step cached={1000 * t_cached:.3f}ms/step speedup={t_uncached / max(t_cached, 1e-9):.1f} cond-transforms={recomputed} steps={args.steps + 1} match={match}')
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+infotext parser round-trip check and throughput benchmark
+verifies that join_infotext -> parse_generation_parameters returns original values and compares parser speed with previous regex sanitize implementation over synthetic infotexts and images in output folders
+"""
+import os
+import re
+import sys
+import time
+import json
+import random
+import argparse
+from PIL import Image
+from util import log
+
+
+script_dir = os.path.dirname(__file__)
+prompts = [
+    'a cat',
+    'photo of a (cat, dog:1.2), <lora:detail:0.8>, {red|blue} sky, masterpiece',
+    'first line\nsecond line: with colon, and comma',
+    'Steps in prompt: 5, blue sky',
+    'quoted "word", [tag], (nested (brackets:1.1):0.9)',
+    '',
+]
+negatives = ['', 'ugly, blurry', 'bad (hands:1.3)\nsecond line']
+params = [
+    { 'Steps': 20, 'Seed': 12345, 'Sampler': 'Euler a', 'CFG scale': 7.5, 'Size': '512x768', 'Model': 'sd15', 'Model hash': 'abcd1234', 'Backend': 'Diffusers', 'App': 'SD.Next', 'Operations': 'txt2img; hires' },
+    { 'Steps': 30, 'Seed': 1, 'Styles': 'a; b', 'Comment': 'hello, world: "quoted"', 'Denoising strength': 0.45, 'Second pass': True, 'Tiling': None, 'Prompt2': 'multi\nline, prompt', 'VAE': 'TAESD', 'Hires fix': 'Hires fix' },
+]
+words = ['masterpiece', '(best quality:1.2)', '<lora:style:0.5>', '1girl', 'blue sky', 'detail: high', '{day|night}', '[from:to:0.5]']
+
+
+def unquote(text):
+    if len(text) == 0 or text[0] != '"' or text[-1] != '"':
+        return text
+    try:
+        return json.loads(text)
+    except Exception:
+        return text
+
+
+def parse_legacy(infotext):
+    """previous implementation: sanitize brackets with regex substitutions and search whole text for params"""
+    if not isinstance(infotext, str):
+        return {}
+    re_param = re.compile(r'\s*([\w ]+):\s*("(?:\\"[^,]|\\"|\\|[^\"])+"|[^,]*)(?:,|$)') # multi-word: value
+    re_size = re.compile(r"^(\d+)x(\d+)$") # int x int
+    sanitized = infotext.replace('prompt:', 'Prompt:').replace('negative prompt:', 'Negative prompt:').replace('Negative Prompt', 'Negative prompt') # cleanup everything in brackets so re_params can work
+    sanitized = re.sub(r'<[^>]*>', lambda match: ' ' * len(match.group()), sanitized)
+    sanitized = re.sub(r'\([^)]*\)', lambda match: ' ' * len(match.group()), sanitized)
+    sanitized = re.sub(r'\{[^}]*\}', lambda match: ' ' * len(match.group()), sanitized)
+    params = dict(re_param.findall(sanitized))
+    params = { k.strip():params[k].strip() for k in params if k.lower() not in ['hashes', 'lora', 'embeddings', 'prompt', 'negative prompt']} # remove some keys
+    first_param = next(iter(params)) if params else None
+    params_idx = sanitized.find(f'{first_param}:') if first_param else -1
+    negative_idx = infotext.find("Negative prompt:")
+    prompt = infotext[:params_idx] if negative_idx == -1 else infotext[:negative_idx] # prompt can be with or without negative prompt
+    negative = infotext[negative_idx:params_idx] if negative_idx >= 0 else ''
+    for k, v in params.copy().items(): # avoid dict-has-changed
+        if len(v) > 0 and v[0] == '"' and v[-1] == '"':
+            v = unquote(v)
+        m = re_size.match(v)
+        if v.replace('.', '', 1).isdigit():
+            params[k] = float(v) if '.' in v else int(v)
+        elif v == "True":
+            params[k] = True
+        elif v == "False":
+            params[k] = False
+        elif m is not None:
+            params[f"{k}-1"] = int(m.group(1))
+            params[f"{k}-2"] = int(m.group(2))
+        elif k == 'VAE' and v == 'TAESD':
+            params["Full quality"] = False
+        else:
+            params[k] = v
+    params["Prompt"] = prompt.replace('Prompt:', '').strip()
+    params["Negative prompt"] = negative.replace('Negative prompt:', '').strip()
+    return params
+
+
+def round_trip(copypaste):
+    failed = 0
+    total = 0
+    for prompt in prompts:
+        for negative in negatives:
+            for args in params:
+                total += 1
+                infotext = copypaste.join_infotext(prompt, negative, args)
+                parsed = copypaste.parse_generation_parameters(infotext)
+                expected = { 'Prompt': prompt.strip(), 'Negative prompt': negative.strip(), **{ k: v for k, v in args.items() if v is not None } }
+                mismatch = { k: (v, parsed.get(k, None)) for k, v in expected.items() if parsed.get(k, None) != v }
+                if len(mismatch) > 0:
+                    failed += 1
+                    log.error(f'round-trip: infotext={json.dumps(infotext)} mismatch={mismatch}')
+    return total, failed
+
+
+def synthetic(copypaste, count: int, length: int):
+    rng = random.Random(42)
+    texts = []
+    for i in range(count):
+        prompt = ', '.join(rng.choice(words) for _i in range(length))
+        texts.append(copypaste.join_infotext(prompt, rng.choice(negatives), params[i % len(params)]))
+    return texts
+
+
+def folder(images, path: str, limit: int):
+    texts = []
+    for root, _dirs, files in os.walk(path):
+        for f in files:
+            if len(texts) >= limit:
+                return texts
+            if os.path.splitext(f)[1].lower() not in ['.png', '.jpg', '.jpeg', '.webp']:
+                continue
+            try:
+                with Image.open(os.path.join(root, f)) as image:
+                    geninfo, _items = images.read_info_from_image(image)
+                if geninfo is not None and len(geninfo) > 0:
+                    texts.append(geninfo)
+            except Exception as e:
+                log.warning(f'folder: file="{f}" {e}')
+    return texts
+
+
+def measure(fn, texts: list, repeats: int):
+    t0 = time.perf_counter()
+    for _i in range(repeats):
+        for text in texts:
+            fn(text)
+    return (time.perf_counter() - t0) / (repeats * max(len(texts), 1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'infotext parser benchmark')
+    parser.add_argument('--folder', type = str, default = None, required = False, help = 'output folder to scan for images with infotext')
+    parser.add_argument('--limit', type = int, default = 10000, required = False, help = 'maximum number of images to read from folder')
+    parser.add_argument('--count', type = int, default = 1000, required = False, help = 'synthetic infotexts')
+    parser.add_argument('--repeats', type = int, default = 3, required = False, help = 'runs per measurement')
+    args = parser.parse_args()
+    sys.argv = sys.argv[:1]
+    sys.path.insert(0, os.path.join(script_dir, '..'))
+    from modules import generation_parameters_copypaste, images # pylint: disable=wrong-import-position
+
+    total, failed = round_trip(generation_parameters_copypaste)
+    log.info(f'round-trip: infotexts={total} failed={failed}')
+    datasets = { 'short': synthetic(generation_parameters_copypaste, args.count, 8), 'long': synthetic(generation_parameters_copypaste, args.count, 80) }
+    if args.folder is not None:
+        datasets['folder'] = folder(images, args.folder, args.limit)
+    for name, texts in datasets.items():
+        t_legacy = measure(parse_legacy, texts, args.repeats)
+        t_parser = measure(generation_parameters_copypaste.parse_generation_parameters, texts, args.repeats)
+        changed = sum(1 for text in texts if parse_legacy(text) != generation_parameters_copypaste.parse_generation_parameters(text))
+        log.info(f'parse: data={name} infotexts={len(texts)} legacy={1e6 * t_legacy:.1f}us parser={1e6 * t_parser:.1f}us speedup={t_legacy / max(t_parser, 1e-9):.1f} changed={changed}')
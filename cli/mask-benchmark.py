@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+mask preprocessing parity check and micro-benchmark
+compares previous loop-based crop region, pil blur fill and segment mask combine with vectorized implementations in modules.masking
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import cv2
+from PIL import Image, ImageFilter, ImageOps
+from util import log
+
+
+script_dir = os.path.dirname(__file__)
+
+
+def crop_region_loops(mask, pad=0):
+    """previous implementation: per-column and per-row scans"""
+    h, w = mask.shape
+    crop_left = 0
+    for i in range(w):
+        if not (mask[:, i] == 0).all():
+            break
+        crop_left += 1
+    crop_right = 0
+    for i in reversed(range(w)):
+        if not (mask[:, i] == 0).all():
+            break
+        crop_right += 1
+    crop_top = 0
+    for i in range(h):
+        if not (mask[i] == 0).all():
+            break
+        crop_top += 1
+    crop_bottom = 0
+    for i in reversed(range(h)):
+        if not (mask[i] == 0).all():
+            break
+        crop_bottom += 1
+    x1 = max(crop_left - pad, 0)
+    y1 = max(crop_top - pad, 0)
+    x2 = max(w - crop_right + pad, 0)
+    y2 = max(h - crop_bottom + pad, 0)
+    if x2 < x1:
+        x1, x2 = x2, x1
+    if y2 < y1:
+        y1, y2 = y2, y1
+    return (int(min(x1, w)), int(min(y1, h)), int(min(x2, w)), int(min(y2, h)))
+
+
+def fill_pil(image, mask):
+    """previous implementation: six full resolution pil gaussian blurs"""
+    image_mod = Image.new('RGBA', (image.width, image.height))
+    image_masked = Image.new('RGBa', (image.width, image.height))
+    image_masked.paste(image.convert("RGBA").convert("RGBa"), mask=ImageOps.invert(mask.convert('L')))
+    image_masked = image_masked.convert('RGBa')
+    for radius, repeats in [(256, 1), (64, 1), (16, 2), (4, 4), (2, 2), (0, 1)]:
+        blurred = image_masked.filter(ImageFilter.GaussianBlur(radius)).convert('RGBA')
+        for _ in range(repeats):
+            image_mod.alpha_composite(blurred)
+    return image_mod.convert("RGB")
+
+
+def combine_loops(outputs, input_mask, topk):
+    """previous implementation: per-candidate resize, overlap and accumulate"""
+    i = 1
+    combined_mask = np.zeros(input_mask.shape, dtype='uint8')
+    input_mask_size = np.count_nonzero(input_mask)
+    for mask in outputs['masks']:
+        mask = mask.astype('uint8')
+        if np.count_nonzero(mask) == 0:
+            continue
+        if input_mask_size > 0:
+            if mask.shape != input_mask.shape:
+                mask = cv2.resize(mask, (input_mask.shape[1], input_mask.shape[0]), interpolation=cv2.INTER_CUBIC)
+            if np.count_nonzero(cv2.bitwise_and(mask, input_mask)) == 0:
+                continue
+        mask = (topk + 1 - i) * mask * (255 // topk)
+        combined_mask = combined_mask + mask
+        i += 1
+        if i > topk:
+            break
+    return combined_mask
+
+
+def candidates(size: int, count: int, seed: int):
+    """synthetic sam output with circular candidate masks, some empty"""
+    rng = np.random.default_rng(seed)
+    masks = []
+    for i in range(count):
+        mask = np.zeros((size, size), np.uint8)
+        if i % 7 != 0:
+            center = tuple(int(v) for v in rng.integers(0, size, 2))
+            cv2.circle(mask, center, int(rng.integers(size // 100 + 1, size // 5)), 1, -1)
+        masks.append(mask.astype(bool))
+    return { 'masks': masks, 'scores': np.ones(count) }
+
+
+def synthetic(size: int, seed: int):
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size]
+    image = np.stack([xx * 255 / size, yy * 255 / size, (xx + yy) * 127 / size], axis=-1) + rng.normal(0, 10, (size, size, 3))
+    mask = np.zeros((size, size), np.uint8)
+    for _i in range(rng.integers(1, 4)):
+        center = tuple(int(v) for v in rng.integers(size // 8, size - size // 8, 2))
+        cv2.circle(mask, center, int(rng.integers(size // 16, size // 4)), 255, -1)
+    mask = cv2.GaussianBlur(mask, (0, 0), 4)
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8)), Image.fromarray(mask)
+
+
+def timed(fn, repeats: int):
+    t0 = time.perf_counter()
+    for _i in range(repeats):
+        res = fn()
+    return res, 1000 * (time.perf_counter() - t0) / repeats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'mask preprocessing benchmark')
+    parser.add_argument('--sizes', type = str, default = '512,1024,2048', required = False, help = 'comma separated image sizes')
+    parser.add_argument('--batch', type = int, default = 4, required = False, help = 'masks per batch')
+    parser.add_argument('--repeats', type = int, default = 3, required = False, help = 'runs per measurement')
+    parser.add_argument('--candidates', type = int, default = 120, required = False, help = 'segment candidate masks per image')
+    args = parser.parse_args()
+    sys.argv = sys.argv[:1]
+    sys.path.insert(0, os.path.join(script_dir, '..'))
+    from modules import masking # pylint: disable=wrong-import-position
+
+    for size in [int(s) for s in args.sizes.split(',')]:
+        data = [synthetic(size, seed) for seed in range(args.batch)]
+        arrays = [np.array(mask) for _image, mask in data] + [np.zeros((size, size), np.uint8)] # include empty mask edge case
+        regions_old, t_old = timed(lambda: [crop_region_loops(m, 32) for m in arrays], args.repeats)
+        regions_new, t_new = timed(lambda: [masking.get_crop_region(m, 32) for m in arrays], args.repeats)
+        mismatch = sum(1 for a, b in zip(regions_old, regions_new) if a != b)
+        log.info(f'crop: size={size} masks={len(arrays)} loops={t_old:.2f}ms vectorized={t_new:.2f}ms mismatch={mismatch}')
+
+        filled_old, t_old = timed(lambda: [fill_pil(image, mask) for image, mask in data], args.repeats)
+        filled_new, t_new = timed(lambda: [masking.fill(image, mask) for image, mask in data], args.repeats)
+        filled_batch, t_batch = timed(lambda: masking.fill([image for image, _mask in data], [mask for _image, mask in data]), args.repeats)
+        diff = [np.abs(np.array(a, dtype=np.int16) - np.array(b, dtype=np.int16)) for a, b in zip(filled_old, filled_new)]
+        masked = [np.array(mask) > 0 for _image, mask in data]
+        batch_mismatch = sum(1 for a, b in zip(filled_new, filled_batch) if not np.array_equal(np.array(a), np.array(b)))
+        unmasked = max(int(d[~m].max()) if (~m).any() else 0 for d, m in zip(diff, masked))
+        log.info(f'fill: size={size} images={len(data)} pil={t_old:.1f}ms pyramid={t_new:.1f}ms batch={t_batch:.1f}ms max-diff={max(int(d.max()) for d in diff)} mean-diff-masked={np.mean([d[m].mean() for d, m in zip(diff, masked)]):.2f} unmasked-diff={unmasked} batch-mismatch={batch_mismatch}')
+
+        masking.opts.mask_erode, masking.opts.mask_dilate, masking.opts.mask_blur = 0.01, 0.01, 0.01
+        single, t_single = timed(lambda: [masking.process_mask(np.array(mask), size) for _image, mask in data], args.repeats)
+        stacked, t_stacked = timed(lambda: masking.process_mask(np.stack([np.array(mask) for _image, mask in data], axis=-1), size), args.repeats)
+        mismatch = sum(1 for i, m in enumerate(single) if not np.array_equal(m, stacked[:, :, i]))
+        log.info(f'process: size={size} masks={len(data)} single={t_single:.1f}ms stacked={t_stacked:.1f}ms mismatch={mismatch}')
+
+        image, mask = data[0]
+        outputs = candidates(size, args.candidates, size)
+        for topk in [3, 10, 50]:
+            masking.opts.seg_topK = topk
+            for name, input_mask in [('masked', np.array(mask)), ('empty', np.zeros((size, size), np.uint8))]:
+                combined_old, t_old = timed(lambda input_mask=input_mask: combine_loops(outputs, input_mask, topk), args.repeats)
+                combined_new, t_new = timed(lambda input_mask=input_mask: masking.combine_masks(outputs, image, input_mask), args.repeats)
+                log.info(f'segment: size={size} candidates={args.candidates} topk={topk} input={name} loops={t_old:.1f}ms vectorized={t_new:.1f}ms mismatch={not np.array_equal(combined_old, combined_new)}')
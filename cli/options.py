@@ -118,6 +118,9 @@ process = Map({
     'blur_samplesize': 60, # sample size to use for blur detection
     'similarity_score': 0.8, # maximum similarity score before image is discarded
     'similarity_size': 64, # base similarity detection on reduced images
+    'similarity_hash': 8, # perceptual hash size used to find similarity candidates, hash has size^2 bits
+    'similarity_distance': 12, # max hamming distance between hashes for image to be considered a candidate
+    'similarity_candidates': 8, # max number of closest candidates verified using ssim
     'range_score': 0.15, # min score for face color dynamicrange detection
     # face processing settings
     'face_score': 0.7, # min face detection score
@@ -17,7 +17,7 @@ import options
 face_model = None
 body_model = None
 segmentation_model = None
-all_images = []
+all_images = None
 all_images_by_type = {}
 
 
@@ -69,16 +69,56 @@ def detect_dynamicrange(image: Image):
     return round(res, 2)
 
 
+class SimilarityIndex():
+    """near-duplicate index: perceptual hashes of accepted images are kept in a packed numpy array and searched with vectorized hamming distance, ssim is only run on closest candidates"""
+    popcount = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def __init__(self, capacity: int = 1024):
+        self.count = 0
+        self.hashes = np.zeros((capacity, (options.process.similarity_hash ** 2 + 7) // 8), dtype=np.uint8) # packbits pads to whole bytes
+        self.images = np.zeros((capacity, options.process.similarity_size, options.process.similarity_size), dtype=np.uint8)
+
+    def features(self, image: Image):
+        gray = ImageOps.grayscale(image)
+        hash_size = options.process.similarity_hash
+        small = np.asarray(gray.resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS), dtype=np.int16)
+        dhash = np.packbits((small[:, 1:] > small[:, :-1]).flatten()) # difference hash is robust to scaling and brightness changes
+        data = np.asarray(gray.resize((options.process.similarity_size, options.process.similarity_size)), dtype=np.uint8)
+        return dhash, data
+
+    def grow(self):
+        self.hashes = np.concatenate([self.hashes, np.zeros_like(self.hashes)])
+        self.images = np.concatenate([self.images, np.zeros_like(self.images)])
+
+    def search(self, dhash: np.ndarray, data: np.ndarray):
+        if self.count == 0:
+            return 0
+        distance = self.popcount[np.bitwise_xor(self.hashes[:self.count], dhash)].sum(axis=1, dtype=np.int32)
+        candidates = np.flatnonzero(distance <= options.process.similarity_distance)
+        if len(candidates) > options.process.similarity_candidates:
+            candidates = candidates[np.argsort(distance[candidates], kind='stable')[:options.process.similarity_candidates]]
+        similarity = 0
+        for i in candidates:
+            val = ssim(data, self.images[i], data_range=255, channel_axis=None, gradient=False, full=False)
+            if val > similarity:
+                similarity = val
+        return similarity
+
+    def add(self, dhash: np.ndarray, data: np.ndarray):
+        if self.count == len(self.hashes):
+            self.grow()
+        self.hashes[self.count] = dhash
+        self.images[self.count] = data
+        self.count += 1
+
+
 def detect_simmilar(image: Image):
-    img = image.resize((options.process.similarity_size, options.process.similarity_size))
-    img = ImageOps.grayscale(img)
-    data = np.array(img)
-    similarity = 0
-    for i in all_images:
-        val = ssim(data, i, data_range=255, channel_axis=None, gradient=False, full=False)
-        if val > similarity:
-            similarity = val
-    all_images.append(data)
+    global all_images
+    if all_images is None:
+        all_images = SimilarityIndex()
+    dhash, data = all_images.features(image)
+    similarity = all_images.search(dhash, data)
+    all_images.add(dhash, data)
     return similarity
 
 
@@ -123,7 +163,7 @@ def reset():
     global all_images_by_type
     all_images_by_type = {}
     global all_images
-    all_images = []
+    all_images = None
 
 
 def upscale_restore_image(res: Result, upscale: bool = False, restore: bool = False):
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+prompt schedule and attention parser micro-benchmark
+compares earley and lalr schedule grammars with and without cache over a corpus of prompts
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from util import log
+
+
+script_dir = os.path.dirname(__file__)
+samples = [
+    'fantasy landscape with a [mountain:lake:0.25] and [an oak:a christmas tree:0.75][ in foreground::0.6][ in background:0.25] [shoddy:masterful:0.5]',
+    'a (((house:1.3)) [on] a (hill:0.5), sun, (((sky))).',
+    'score_9, score_8_up, score_7_up, 1girl, solo, (masterpiece:1.2), (best quality:1.2), [red|blue] hair, looking at viewer',
+    'photo of (woman:1.1) wearing [dress|skirt] in [forest:city:0.5], 8k, (((detailed))), (sharp focus:1.15), [blurry::0.2]',
+    '[black] [[grey]] (white) ((gray)) ((orange:1.1) yellow) ((purple) and [dark] red:1.1) [mouse:0.2] [(cat:1.1):0.5]',
+]
+
+
+def corpus(count: int, filename: str = None):
+    prompts = list(samples)
+    if filename is not None:
+        with open(filename, 'r', encoding='utf8') as f:
+            prompts += [line.strip() for line in f.readlines() if len(line.strip()) > 0]
+    with open(os.path.join(script_dir, '..', 'html', 'art-styles.json'), 'r', encoding='utf8') as f:
+        styles = [style['prompt'] for style in json.load(f) if '{prompt}' in style.get('prompt', '')]
+    with open(os.path.join(script_dir, 'random.json'), 'r', encoding='utf8') as f:
+        words = json.load(f)
+    random.seed(42)
+    while len(prompts) < count:
+        subject = f"{random.choice(words['embeddings'])} {random.choice(words['places'])}, by {random.choice(words['artists'])}"
+        subject = random.choice([subject, f'({subject}:{random.uniform(0.5, 1.5):.2f})', f'[{subject}:{random.choice(words["artists"])}:{random.uniform(0.1, 0.9):.2f}]'])
+        prompts.append(random.choice(styles).replace('{prompt}', subject) + ', ' + random.choice(samples))
+    return prompts
+
+
+def measure(fn, prompts, repeats):
+    t0 = time.perf_counter()
+    for _i in range(repeats):
+        for prompt in prompts:
+            fn(prompt)
+    return 1000 * (time.perf_counter() - t0) / (repeats * len(prompts))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'prompt parser benchmark')
+    parser.add_argument('--count', type = int, default = 200, required = False, help = 'number of prompts in corpus')
+    parser.add_argument('--repeats', type = int, default = 3, required = False, help = 'number of passes over corpus')
+    parser.add_argument('--steps', type = int, default = 20, required = False, help = 'sampling steps used for schedules')
+    parser.add_argument('--file', type = str, default = None, required = False, help = 'optional file with one prompt per line')
+    args = parser.parse_args()
+    sys.argv = sys.argv[:1]
+    sys.path.insert(0, os.path.join(script_dir, '..'))
+    from modules import prompt_parser, shared # pylint: disable=wrong-import-position
+
+    data = corpus(args.count, args.file)
+    log.info(f'corpus: prompts={len(data)} avg-length={sum(len(p) for p in data) / len(data):.0f} steps={args.steps}')
+    reference = {}
+    for grammar in ['Earley', 'LALR']:
+        shared.opts.data['prompt_schedule_parser'] = grammar
+        prompt_parser.cache_clear()
+        cold = measure(lambda p: prompt_parser.get_learned_conditioning_prompt_schedules([p], args.steps), data, 1)
+        warm = measure(lambda p: prompt_parser.get_learned_conditioning_prompt_schedules([p], args.steps), data, args.repeats)
+        schedules = {p: prompt_parser.get_learned_conditioning_prompt_schedules([p], args.steps)[0] for p in data}
+        mismatch = sum(1 for p in data if p in reference and reference[p] != schedules[p])
+        reference = reference or schedules
+        log.info(f'schedule: grammar={grammar} uncached={cold:.3f}ms cached={warm:.4f}ms per-prompt mismatch={mismatch}')
+    for attention in ['Full parser', 'A1111 parser']:
+        shared.opts.data['prompt_attention'] = attention
+        prompt_parser.cache_clear()
+        cold = measure(prompt_parser.parse_prompt_attention, data, 1)
+        warm = measure(prompt_parser.parse_prompt_attention, data, args.repeats)
+        log.info(f'attention: parser={attention} uncached={cold:.3f}ms cached={warm:.4f}ms per-prompt')
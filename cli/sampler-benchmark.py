@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+diffusers sampler setup micro-benchmark
+measures per-request scheduler construction and set_timesteps for all registered samplers with and without scheduler cache
+"""
+import os
+import sys
+import time
+import argparse
+from types import SimpleNamespace
+from util import log
+
+
+script_dir = os.path.dirname(__file__)
+
+
+def setup(sd_samplers, name: str, scheduler_cls, steps: int, device):
+    model = SimpleNamespace(scheduler=scheduler_cls.from_config(base_config)) # fresh model so previous sampler does not become model default
+    sampler = sd_samplers.create_sampler(name, model)
+    sampler.set_timesteps(steps, device=device)
+    return sampler
+
+
+def measure(fn, repeats: int):
+    fn() # warmup, also populates cache
+    t0 = time.perf_counter()
+    for _i in range(repeats):
+        fn()
+    return (time.perf_counter() - t0) / repeats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'sampler setup benchmark')
+    parser.add_argument('--steps', type = int, default = 20, required = False, help = 'inference steps')
+    parser.add_argument('--repeats', type = int, default = 20, required = False, help = 'setups per sampler and mode')
+    parser.add_argument('--device', type = str, default = 'cpu', required = False, help = 'device for timestep tables')
+    args = parser.parse_args()
+    sys.argv = sys.argv[:1]
+    sys.path.insert(0, os.path.join(script_dir, '..'))
+    import torch # pylint: disable=wrong-import-position
+    from diffusers import DDIMScheduler # pylint: disable=wrong-import-position
+    from modules import shared, sd_samplers # pylint: disable=wrong-import-position
+
+    base_config = DDIMScheduler(beta_start=0.00085, beta_end=0.012, beta_schedule='scaled_linear').config # sd15 scheduler defaults
+    device = torch.device(args.device)
+    sd_samplers.list_samplers(shared.Backend.DIFFUSERS)
+    shared.log.setLevel('WARNING') # create_sampler logs every call
+    totals = { False: 0, True: 0 }
+    for data in sd_samplers.all_samplers:
+        if data.constructor is None:
+            continue
+        results = {}
+        for cached in [False, True]:
+            shared.opts.data['schedulers_cache'] = cached
+            try:
+                results[cached] = measure(lambda name=data.name: setup(sd_samplers, name, DDIMScheduler, args.steps, device), args.repeats)
+            except Exception as e:
+                log.error(f'sampler: name="{data.name}" cached={cached} {e}')
+                results[cached] = None
+        if None in results.values():
+            continue
+        totals[False] += results[False]
+        totals[True] += results[True]
+        log.info(f'sampler: name="{data.name}" uncached={1000 * results[False]:.3f}ms cached={1000 * results[True]:.3f}ms speedup={results[False] / max(results[True], 1e-9):.1f}')
+    log.info(f'total: steps={args.steps} device={device} uncached={1000 * totals[False]:.3f}ms cached={1000 * totals[True]:.3f}ms speedup={totals[False] / max(totals[True], 1e-9):.1f}')
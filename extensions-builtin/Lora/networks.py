@@ -16,7 +16,7 @@ import network_glora
 import lora_convert
 import torch
 import diffusers.models.lora
-from modules import shared, devices, sd_models, sd_models_compile, errors, scripts, files_cache
+from modules import shared, devices, sd_models, sd_models_compile, errors, scripts, files_cache, metrics
 
 
 debug = os.environ.get('SD_LORA_DEBUG', None) is not None
@@ -26,6 +26,7 @@ available_networks = {}
 available_network_aliases = {}
 loaded_networks: List[network.Network] = []
 timer = { 'load': 0, 'apply': 0, 'restore': 0 }
+metric_timer = { k: metrics.counter('sd_lora_seconds_total', 'LoRA time by operation', op=k) for k in timer }
 # networks_in_memory = {}
 lora_cache = {}
 available_network_hash_lookup = {}
@@ -94,6 +95,7 @@ def load_diffusers(name, network_on_disk, lora_scale=1.0) -> network.Network:
     lora_cache[name] = net
     t1 = time.time()
     timer['load'] += t1 - t0
+    metric_timer['load'].inc(t1 - t0)
     return net
 
 
@@ -149,6 +151,7 @@ def load_network(name, network_on_disk) -> network.Network:
     lora_cache[name] = net
     t1 = time.time()
     timer['load'] += t1 - t0
+    metric_timer['load'].inc(t1 - t0)
     return net
 
 
@@ -263,6 +266,7 @@ def network_restore_weights_from_backup(self: Union[torch.nn.Conv2d, torch.nn.Li
             self.bias = None
     t1 = time.time()
     timer['restore'] += t1 - t0
+    metric_timer['restore'].inc(t1 - t0)
 
 
 def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn.GroupNorm, torch.nn.LayerNorm, torch.nn.MultiheadAttention, diffusers.models.lora.LoRACompatibleLinear, diffusers.models.lora.LoRACompatibleConv]):
@@ -354,6 +358,7 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
         self.network_current_names = wanted_names
     t1 = time.time()
     timer['apply'] += t1 - t0
+    metric_timer['apply'].inc(t1 - t0)
 
 
 def network_forward(module, input, original_forward): # pylint: disable=W0622
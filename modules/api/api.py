@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from threading import Lock
 from secrets import compare_digest
 from fastapi import FastAPI, APIRouter, Depends, Request
@@ -46,6 +46,10 @@ class Api:
         self.add_api_route("/sdapi/v1/options", server.set_config, methods=["POST"])
         self.add_api_route("/sdapi/v1/cmd-flags", server.get_cmd_flags, methods=["GET"], response_model=models.FlagsModel)
         self.add_api_route("/sdapi/v1/nvml", nvml.get_nvml, methods=["GET"], response_model=List[models.ResNVML])
+        self.add_api_route("/sdapi/v1/trace", endpoints.get_trace_metrics, methods=["GET"], response_model=List[dict])
+        self.add_api_route("/metrics", endpoints.get_metrics, methods=["GET"], include_in_schema=False)
+        self.add_api_route("/sdapi/v1/autotune", endpoints.get_autotune, methods=["GET"], response_model=List[dict])
+        self.add_api_route("/sdapi/v1/autotune", self.post_autotune, methods=["POST"], response_model=List[dict])
 
         # core api using locking
         self.add_api_route("/sdapi/v1/txt2img", self.generate.post_text2img, methods=["POST"], response_model=models.ResTxt2Img)
@@ -55,10 +59,12 @@ class Api:
         self.add_api_route("/sdapi/v1/extra-batch-images", self.extras_batch_images_api, methods=["POST"], response_model=models.ResProcessBatch)
         self.add_api_route("/sdapi/v1/preprocess", self.process.post_preprocess, methods=["POST"])
         self.add_api_route("/sdapi/v1/mask", self.process.post_mask, methods=["POST"])
+        self.add_api_route("/sdapi/v1/mask/batch", self.process.post_mask_batch, methods=["POST"], response_model=process.ResMaskBatch)
 
         # api dealing with optional scripts
         self.add_api_route("/sdapi/v1/scripts", script.get_scripts_list, methods=["GET"], response_model=models.ResScripts)
         self.add_api_route("/sdapi/v1/script-info", script.get_script_info, methods=["GET"], response_model=List[models.ItemScript])
+        self.add_api_route("/sdapi/v1/script-timers", endpoints.get_script_timers, methods=["GET"], response_model=Dict[str, float])
 
         # enumerator api
         self.add_api_route("/sdapi/v1/preprocessors", self.process.get_preprocess, methods=["GET"], response_model=List[process.ItemPreprocess])
@@ -150,6 +156,11 @@ class Api:
             result = postprocessing.run_extras(extras_mode=1, image_folder=image_folder, image="", input_dir="", output_dir="", save_output=False, **reqDict)
         return models.ResProcessBatch(images=list(map(helpers.encode_pil_to_base64, result[0])), html_info=result[1])
 
+    def post_autotune(self, req: models.ReqAutotune):
+        from modules import sd_autotune
+        with self.queue_lock:
+            return sd_autotune.sweep(req.resolutions, req.batch_size)
+
     def launch(self):
         config = {
             "listen": shared.cmd_opts.listen,
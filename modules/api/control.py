@@ -1,7 +1,7 @@
 from typing import Optional, List
 from threading import Lock
 from pydantic import BaseModel, Field # pylint: disable=no-name-in-module
-from modules import errors, shared, scripts, ui
+from modules import errors, shared, scripts
 from modules.api import script, helpers
 from modules.processing import StableDiffusionProcessingControl
 from modules.control import run as run_control
@@ -80,7 +80,7 @@ class APIControl():
         script_runner = scripts.scripts_control
         if not script_runner.scripts:
             script_runner.initialize_scripts(False)
-            ui.create_ui(None)
+            script_runner.setup_api('control')
         if not self.default_script_arg:
             self.default_script_arg = script.init_default_script_args(script_runner)
 
@@ -29,6 +29,23 @@ def get_face_restorers():
 def get_prompt_styles():
     return [{ 'name': v.name, 'prompt': v.prompt, 'negative_prompt': v.negative_prompt, 'extra': v.extra, 'filename': v.filename, 'preview': v.preview} for v in shared.prompt_styles.styles.values()]
 
+def get_script_timers():
+    from modules import script_callbacks
+    return { k: round(v, 4) for k, v in sorted(script_callbacks.timers.items(), key=lambda x: x[1], reverse=True) }
+
+def get_trace_metrics():
+    from modules import metrics
+    return [h.dict() for h in sorted(metrics.histograms.values(), key=lambda h: (h.name, str(h.labels)))]
+
+def get_metrics():
+    from fastapi.responses import PlainTextResponse
+    from modules import metrics
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+def get_autotune():
+    from modules import sd_autotune
+    return [{'key': k, **v} for k, v in sd_autotune.get_plans().items()]
+
 def get_embeddings():
     from modules import sd_hijack
     db = sd_hijack.model_hijack.embedding_db
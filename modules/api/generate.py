@@ -1,6 +1,6 @@
 from threading import Lock
 from fastapi.responses import JSONResponse
-from modules import errors, shared, scripts, ui
+from modules import errors, shared, scripts, tracing
 from modules.api import models, script, helpers
 from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images
 
@@ -66,7 +66,7 @@ class APIGenerate():
         script_runner = scripts.scripts_txt2img
         if not script_runner.scripts:
             script_runner.initialize_scripts(False)
-            ui.create_ui(None)
+            script_runner.setup_api('txt2img')
         if not self.default_script_arg_txt2img:
             self.default_script_arg_txt2img = script.init_default_script_args(script_runner)
         selectable_scripts, selectable_script_idx = script.get_selectable_script(txt2imgreq.script_name, script_runner)
@@ -79,7 +79,8 @@ class APIGenerate():
             populate.sampler_index = None  # prevent a warning later on
         args = self.sanitize_args(populate)
         send_images = args.pop('send_images', True)
-        with self.queue_lock:
+        trace = tracing.begin()
+        with tracing.queued(self.queue_lock):
             p = StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)
             p.scripts = script_runner
             p.outpath_grids = shared.opts.outdir_grids or shared.opts.outdir_txt2img_grids
@@ -94,7 +95,8 @@ class APIGenerate():
             shared.state.end(api=False)
         b64images = list(map(helpers.encode_pil_to_base64, processed.images)) if send_images else []
         self.sanitize_b64(txt2imgreq)
-        return models.ResTxt2Img(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
+        tracing.finish()
+        return models.ResTxt2Img(images=b64images, parameters=vars(txt2imgreq), info=tracing.attach(processed.js(), trace))
 
     def post_img2img(self, img2imgreq: models.ReqImg2Img):
         self.prepare_face_module(img2imgreq)
@@ -107,7 +109,7 @@ class APIGenerate():
         script_runner = scripts.scripts_img2img
         if not script_runner.scripts:
             script_runner.initialize_scripts(True)
-            ui.create_ui(None)
+            script_runner.setup_api('img2img')
         if not self.default_script_arg_img2img:
             self.default_script_arg_img2img = script.init_default_script_args(script_runner)
         selectable_scripts, selectable_script_idx = script.get_selectable_script(img2imgreq.script_name, script_runner)
@@ -121,7 +123,8 @@ class APIGenerate():
             populate.sampler_index = None  # prevent a warning later on
         args = self.sanitize_args(populate)
         send_images = args.pop('send_images', True)
-        with self.queue_lock:
+        trace = tracing.begin()
+        with tracing.queued(self.queue_lock):
             p = StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)
             p.init_images = [helpers.decode_base64_to_image(x) for x in init_images]
             p.scripts = script_runner
@@ -140,4 +143,5 @@ class APIGenerate():
             img2imgreq.init_images = None
             img2imgreq.mask = None
         self.sanitize_b64(img2imgreq)
-        return models.ResImg2Img(images=b64images, parameters=vars(img2imgreq), info=processed.js())
+        tracing.finish()
+        return models.ResImg2Img(images=b64images, parameters=vars(img2imgreq), info=tracing.attach(processed.js(), trace))
@@ -1,10 +1,18 @@
 import io
 import base64
+import hashlib
+import threading
+from collections import OrderedDict
 from PIL import Image, PngImagePlugin
 import piexif
 import piexif.helper
 from fastapi.exceptions import HTTPException
-from modules import shared, sd_samplers
+from modules import shared, sd_samplers, tracing, metrics
+
+
+image_cache = OrderedDict() # payload digest -> decoded image, clients often resend identical masks and reference images
+image_cache_size = 0
+image_cache_lock = threading.Lock()
 
 
 def validate_sampler_name(name):
@@ -14,17 +22,66 @@ def validate_sampler_name(name):
     return name
 
 
+def image_size(image):
+    return image.width * image.height * len(image.getbands())
+
+
+def image_cache_put(key: str, image: Image.Image):
+    global image_cache_size # pylint: disable=global-statement
+    budget = shared.opts.api_image_cache_size * 1024 * 1024
+    size = image_size(image)
+    if size > budget:
+        return
+    with image_cache_lock:
+        if key in image_cache:
+            return
+        image_cache[key] = image
+        image_cache_size += size
+        while image_cache_size > budget and len(image_cache) > 0:
+            _key, evicted = image_cache.popitem(last=False)
+            image_cache_size -= image_size(evicted)
+
+
+def image_cache_clear():
+    global image_cache_size # pylint: disable=global-statement
+    with image_cache_lock:
+        image_cache.clear()
+        image_cache_size = 0
+
+
+def image_copy(image: Image.Image):
+    """copy keeps info but not format since copy is no longer backed by a file, format is restored so callers see the same image on cache hit and miss"""
+    res = image.copy()
+    res.format = image.format
+    return res
+
+
 def decode_base64_to_image(encoding):
     if encoding.startswith("data:image/"):
         encoding = encoding.split(";")[1].split(",")[1]
+    key = None
+    if shared.opts.api_image_cache_size > 0: # hash of encoded payload is much cheaper than base64 and image decode
+        key = hashlib.blake2b(encoding.encode('utf-8'), digest_size=16).hexdigest()
+        with image_cache_lock:
+            image = image_cache.get(key, None)
+            if image is not None:
+                image_cache.move_to_end(key)
+        metrics.counter('sd_cache_requests_total', 'Cache lookups', cache='api-image', result='miss' if image is None else 'hit').inc()
+        if image is not None:
+            return image_copy(image) # callers may modify image in place
     try:
         image = Image.open(io.BytesIO(base64.b64decode(encoding)))
+        if key is not None and getattr(image, 'n_frames', 1) == 1: # copy keeps only the current frame so animated images are never cached
+            image.load()
+            image_cache_put(key, image_copy(image))
+            return image_copy(image)
         return image
     except Exception as e:
         shared.log.warning(f'API cannot decode image: {e}')
         raise HTTPException(status_code=500, detail="Invalid encoded image") from e
 
 
+@tracing.traced('encode')
 def encode_pil_to_base64(image):
     """
     with io.BytesIO() as output_bytes:
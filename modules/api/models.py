@@ -283,6 +283,10 @@ class ReqLog(BaseModel):
     lines: int = Field(default=100, title="Lines", description="How many lines to return")
     clear: bool = Field(default=False, title="Clear", description="Should the log be cleared after returning the lines?")
 
+class ReqAutotune(BaseModel):
+    resolutions: List[str] = Field(default=["512x512"], title="Resolutions", description="List of resolutions in WIDTHxHEIGHT format to tune using currently loaded model")
+    batch_size: int = Field(default=1, title="Batch size", description="Batch size to tune for")
+
 class ReqProgress(BaseModel):
     skip_current_image: bool = Field(default=False, title="Skip current image", description="Skip current image serialization")
 
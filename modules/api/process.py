@@ -29,6 +29,16 @@ class ReqMask(BaseModel):
 class ResMask(BaseModel):
     mask: str = Field(default='', title="Image", description="The processed image in base64 format")
 
+class ReqMaskBatch(BaseModel):
+    images: List[str] = Field(title="Images", description="List of base64 encoded images")
+    type: str = Field(title="Mask type", description="Type of masking image to return")
+    masks: Optional[List[str]] = Field(title="Masks", description="Optional list of mask images matching images, if not provided auto-masking will be performed")
+    model: Optional[str] = Field(title="Model", description="The model to use for preprocessing")
+    params: Optional[dict] = Field(default={}, title="Settings", description="Preprocessor settings")
+
+class ResMaskBatch(BaseModel):
+    masks: List[str] = Field(default=[], title="Images", description="The processed images in base64 format")
+
 class ItemPreprocess(BaseModel):
     name: str = Field(title="Name")
     params: dict = Field(title="Params")
@@ -74,22 +84,29 @@ class APIProcess():
         from modules import masking
         return ItemMask(models=list(masking.MODELS), colormaps=masking.COLORMAP, params=vars(masking.opts), types=masking.TYPES)
 
-    def post_mask(self, req: ReqMask):
+    def set_mask(self, model: str, mask_type: str, params: dict):
         from modules import masking
-        if req.model:
-            if req.model not in masking.MODELS:
-                return JSONResponse(status_code=400, content={"error": f"Mask model not found: id={req.model}"})
+        if model:
+            if model not in masking.MODELS:
+                return JSONResponse(status_code=400, content={"error": f"Mask model not found: id={model}"})
             else:
-                masking.init_model(req.model)
-        if req.type not in masking.TYPES:
-            return JSONResponse(status_code=400, content={"error": f"Mask type not found: id={req.type}"})
-        image = decode_base64_to_image(req.image)
-        mask = decode_base64_to_image(req.mask) if req.mask else None
-        for k, v in req.params.items():
+                masking.init_model(model)
+        if mask_type not in masking.TYPES:
+            return JSONResponse(status_code=400, content={"error": f"Mask type not found: id={mask_type}"})
+        for k, v in params.items():
             if not hasattr(masking.opts, k):
                 return JSONResponse(status_code=400, content={"error": f"Mask invalid parameter: {k}={v}"})
             else:
                 setattr(masking.opts, k, v)
+        return None
+
+    def post_mask(self, req: ReqMask):
+        from modules import masking
+        err = self.set_mask(req.model, req.type, req.params)
+        if err is not None:
+            return err
+        image = decode_base64_to_image(req.image)
+        mask = decode_base64_to_image(req.mask) if req.mask else None
         shared.state.begin('api-mask', api=True)
         with self.queue_lock:
             processed = masking.run_mask(input_image=image, input_mask=mask, return_type=req.type)
@@ -98,3 +115,20 @@ class APIProcess():
             return JSONResponse(status_code=400, content={"error": "Mask is none"})
         image = encode_pil_to_base64(processed)
         return ResMask(mask=image)
+
+    def post_mask_batch(self, req: ReqMaskBatch):
+        from modules import masking
+        if not req.images:
+            return JSONResponse(status_code=400, content={"error": "No images provided"})
+        if req.masks and len(req.masks) != len(req.images):
+            return JSONResponse(status_code=400, content={"error": f"Mask count mismatch: images={len(req.images)} masks={len(req.masks)}"})
+        err = self.set_mask(req.model, req.type, req.params)
+        if err is not None:
+            return err
+        images = [decode_base64_to_image(image) for image in req.images]
+        masks = [decode_base64_to_image(mask) if mask else None for mask in req.masks] if req.masks else None
+        shared.state.begin('api-mask-batch', api=True)
+        with self.queue_lock:
+            processed = masking.run_mask_batch(input_images=images, input_masks=masks, return_type=req.type)
+        shared.state.end(api=False)
+        return ResMaskBatch(masks=[encode_pil_to_base64(image) if image is not None else '' for image in processed])
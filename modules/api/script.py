@@ -49,10 +49,17 @@ def init_default_script_args(script_runner):
     script_args[0] = 0
 
     # get default values
-    if gr is None:
+    missing = []
+    for script in script_runner.scripts:
+        defaults = getattr(script, 'api_defaults', None)
+        if defaults is not None and len(defaults) == script.args_to - script.args_from:
+            script_args[script.args_from:script.args_to] = defaults # collected during ui or api setup
+        else:
+            missing.append(script)
+    if gr is None or len(missing) == 0:
         return script_args
     with gr.Blocks(): # will throw errors calling ui function without this
-        for script in script_runner.scripts:
+        for script in missing:
             if script.ui(script.is_img2img):
                 ui_default_values = []
                 for elem in script.ui(script.is_img2img):
@@ -1,5 +1,6 @@
 from typing import Any, Dict
 from fastapi import Depends
+from fastapi.responses import JSONResponse
 from modules import shared
 from modules.api import models, helpers
 
@@ -51,11 +52,14 @@ def get_config():
     return options
 
 def set_config(req: Dict[str, Any]):
-    updated = []
-    for k, v in req.items():
-        updated.append({ k: shared.opts.set(k, v) })
-    shared.opts.save(shared.config_filename)
-    return { "updated": updated }
+    changed, failed = shared.opts.set_many(req)
+    if len(changed) == 0 and len(failed) > 0:
+        return JSONResponse(status_code=400, content={ "error": "Invalid settings", "failed": failed })
+    if len(changed) > 0:
+        shared.opts.save(shared.config_filename)
+        shared.log.debug(f'Settings: changed={changed}')
+    updated = [{ k: k in changed } for k in req.keys()]
+    return { "updated": updated, "failed": failed }
 
 def get_cmd_flags():
     return vars(shared.cmd_opts)
@@ -2,7 +2,7 @@ import html
 import threading
 import time
 import cProfile
-from modules import shared, progress, errors
+from modules import shared, progress, errors, tracing
 
 queue_lock = threading.Lock()
 
@@ -24,7 +24,8 @@ def wrap_gradio_gpu_call(func, extra_outputs=None):
             progress.add_task_to_queue(id_task)
         else:
             id_task = None
-        with queue_lock:
+        tracing.begin()
+        with tracing.queued(queue_lock):
             progress.start_task(id_task)
             res = [None, '', '', '']
             try:
@@ -37,6 +38,7 @@ def wrap_gradio_gpu_call(func, extra_outputs=None):
                 res[-1] = f"<div class='error'>{html.escape(str(e))}</div>"
             finally:
                 progress.finish_task(id_task)
+        tracing.finish()
         return res
     return wrap_gradio_call(f, extra_outputs=extra_outputs, add_stats=True, name=name)
 
@@ -75,6 +77,7 @@ def wrap_gradio_call(func, extra_outputs=None, add_stats=False, name=None):
         vram_html = ''
         if not shared.mem_mon.disabled:
             vram = {k: -(v//-(1024*1024)) for k, v in shared.mem_mon.read().items()}
+            vram['active_peak'] = max(vram.get('active_peak', 0), tracing.last_peak()) # traced stages reset torch peak counters
             if vram.get('active_peak', 0) > 0:
                 vram_html = " | <p class='vram'>"
                 vram_html += f"GPU active {max(vram['active_peak'], vram['reserved_peak'])} MB reserved {vram['reserved']} | used {vram['used']} MB free {vram['free']} MB total {vram['total']} MB"
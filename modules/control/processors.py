@@ -1,10 +1,13 @@
 import os
 import time
+import hashlib
+from collections import OrderedDict
+from typing import List, Union
 import numpy as np
 from PIL import Image
-from modules.shared import log
+from modules.shared import log, opts
 from modules.errors import display
-from modules import devices, images
+from modules import devices, images, metrics
 
 from modules.control.proc.hed import HEDdetector
 from modules.control.proc.canny import CannyDetector
@@ -30,6 +33,8 @@ from modules.control.proc.depth_anything import DepthAnythingDetector
 
 models = {}
 cache_dir = 'models/control/processors'
+cache = OrderedDict() # processed results keyed by image hash, processor and params
+cache_size = 0
 debug = log.trace if os.environ.get('SD_CONTROL_DEBUG', None) is not None else lambda *args, **kwargs: None
 debug('Trace: CONTROL')
 config = {
@@ -122,6 +127,34 @@ def update_settings(*settings):
     update(['Depth Anything', 'params', 'color_map'], settings[27])
 
 
+def cache_key(processor_id: str, image: Image.Image, params: dict, resize: bool, mode: str):
+    if opts.control_cache_size <= 0 or not isinstance(image, Image.Image):
+        return None
+    digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+    variant = config.get(processor_id, {}).get('model', '')
+    digest.update(f'{image.mode}:{image.size}:{processor_id}:{variant}:{sorted((params or {}).items())}:{resize}:{mode}'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cache_put(key: str, image: Image.Image):
+    global cache_size # pylint: disable=global-statement
+    budget = opts.control_cache_size * 1024 * 1024
+    size = image.width * image.height * len(image.getbands())
+    if size > budget:
+        return
+    cache[key] = image
+    cache_size += size
+    while cache_size > budget and len(cache) > 0:
+        _key, evicted = cache.popitem(last=False)
+        cache_size -= evicted.width * evicted.height * len(evicted.getbands())
+
+
+def cache_clear():
+    global cache_size # pylint: disable=global-statement
+    cache.clear()
+    cache_size = 0
+
+
 class Processor():
     def __init__(self, processor_id: str = None, resize = True):
         self.model = None
@@ -206,9 +239,11 @@ class Processor():
             display(e, 'Control Processor load')
             return f'Processor load filed: {processor_id}'
 
-    def __call__(self, image_input: Image, mode: str = 'RGB', resize_mode: int = 0, resize_name: str = 'None', scale_tab: int = 1, scale_by: float = 1.0, local_config: dict = {}):
+    def __call__(self, image_input: Union[Image.Image, List[Image.Image]], mode: str = 'RGB', resize_mode: int = 0, resize_name: str = 'None', scale_tab: int = 1, scale_by: float = 1.0, local_config: dict = {}):
         if self.processor_id is None or self.processor_id == 'None':
             return self.override if self.override is not None else image_input
+        batch = isinstance(image_input, list)
+        image_inputs = image_input if batch else [image_input]
         if self.override is not None:
             debug(f'Control Processor: id="{self.processor_id}" override={self.override}')
             image_input = self.override
@@ -217,23 +252,39 @@ class Processor():
                     width_before, height_before = int(image_input.width * scale_by), int(image_input.height * scale_by)
                     debug(f'Control resize: op=before image={image_input} width={width_before} height={height_before} mode={resize_mode} name={resize_name}')
                     image_input = images.resize_image(resize_mode, image_input, width_before, height_before, resize_name)
-        image_process = image_input
-        if image_input is None:
-            # log.error('Control Processor: no input')
-            return image_process
+            image_inputs = [image_input] * len(image_inputs)
         if config[self.processor_id].get('dirty', False):
             processor_id = self.processor_id
             config[processor_id].pop('dirty')
             self.reset()
             self.load(processor_id)
+        kwargs = config.get(self.processor_id, {}).get('params', None)
+        if kwargs:
+            kwargs.update(local_config)
+        t0 = time.time()
+        image_processed = [self.process(image, mode, kwargs) for image in image_inputs]
+        if batch:
+            log.debug(f'Control Processor: id="{self.processor_id}" mode={mode} batch={len(image_inputs)} time={time.time()-t0:.2f}')
+            return image_processed
+        return image_processed[0]
+
+    def process(self, image_input: Image.Image, mode: str, kwargs: dict):
+        image_process = image_input
+        if image_input is None:
+            # log.error('Control Processor: no input')
+            return image_process
         if self.model is None:
             # log.error('Control Processor: model not loaded')
             return image_process
+        key = cache_key(self.processor_id, image_input, kwargs, self.resize, mode)
+        if key is not None:
+            metrics.counter('sd_cache_requests_total', 'Cache lookups', cache='control-processor', result='hit' if key in cache else 'miss').inc()
+        if key is not None and key in cache:
+            cache.move_to_end(key)
+            debug(f'Control Processor: id="{self.processor_id}" cache=hit entries={len(cache)} size={cache_size}')
+            return cache[key].copy()
         try:
             t0 = time.time()
-            kwargs = config.get(self.processor_id, {}).get('params', None)
-            if kwargs:
-                kwargs.update(local_config)
             if self.resize:
                 image_resized = image_input.resize((512, 512), Image.Resampling.LANCZOS)
             else:
@@ -251,8 +302,11 @@ class Processor():
         except Exception as e:
             log.error(f'Control Processor failed: id="{self.processor_id}" error={e}')
             display(e, 'Control Processor')
+            key = None
         if mode != 'RGB':
             image_process = image_process.convert(mode)
+        if key is not None and isinstance(image_process, Image.Image):
+            cache_put(key, image_process.copy())
         return image_process
 
     def preview(self):
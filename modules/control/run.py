@@ -1,12 +1,12 @@
 import os
 import time
 from typing import List, Union
-import cv2
 import numpy as np
 from PIL import Image
 from modules.control import util # helper functions
 from modules.control import unit # control units
 from modules.control import processors # image preprocessors
+from modules.control import video as control_video # threaded video decoder
 from modules.control.units import controlnet # lllyasviel ControlNet
 from modules.control.units import xs # VisLearn ControlNet-XS
 from modules.control.units import lite # Kohya ControlLLLite
@@ -269,8 +269,8 @@ def control_run(units: List[unit.Unit], inputs, inits, mask, unit_type: str, is_
     debug(f'Control pipeline: class={pipe.__class__.__name__} args={vars(p)}')
     t1, t2, t3 = time.time(), 0, 0
     status = True
-    frame = None
     video = None
+    writer = None
     output_filename = None
     index = 0
     frames = 0
@@ -295,26 +295,23 @@ def control_run(units: List[unit.Unit], inputs, inits, mask, unit_type: str, is_
                         shared.log.warning('Control: separate init video not support for video input')
                         input_type = 1
                 try:
-                    video = cv2.VideoCapture(inputs)
-                    if not video.isOpened():
-                        yield terminate(f'Control: video open failed: path={inputs}')
-                        return
-                    frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-                    fps = int(video.get(cv2.CAP_PROP_FPS))
-                    w, h = int(video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                    codec = util.decode_fourcc(video.get(cv2.CAP_PROP_FOURCC))
-                    status, frame = video.read()
-                    if status:
-                        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    shared.log.debug(f'Control: input video: path={inputs} frames={frames} fps={fps} size={w}x{h} codec={codec}')
+                    video = control_video.VideoReader(inputs, skip_frames=video_skip_frames, maxsize=2 * shared.opts.control_video_window)
+                    frames = video.frames
+                    shared.log.debug(f'Control: input video: path={inputs} frames={frames} fps={video.fps} size={video.width}x{video.height} codec={video.codec} skip={video_skip_frames} window={shared.opts.control_video_window}')
                 except Exception as e:
                     yield terminate(f'Control: video open failed: path={inputs} {e}')
                     return
+                if images.VideoWriter.supported(video_type, video_interpolate):
+                    writer = images.VideoWriter(p, video_type=video_type, fps=video.selected / video_duration if video_duration > 0 and video.selected > 0 else video.fps, maxsize=2 * shared.opts.control_video_window)
 
             while status:
                 processed_image = None
-                if frame is not None:
-                    inputs = [Image.fromarray(frame)] # cv2 to pil
+                if video is not None:
+                    window = video.read(shared.opts.control_video_window) # next window of decoded frames
+                    if len(window) == 0:
+                        break
+                    indexes = [w[0] for w in window]
+                    inputs = [w[1] for w in window]
                 for i, input_image in enumerate(inputs):
                     debug(f'Control Control image: {i + 1} of {len(inputs)}')
                     if shared.state.skipped:
@@ -348,9 +345,7 @@ def control_run(units: List[unit.Unit], inputs, inits, mask, unit_type: str, is_
                     else:
                         debug(f'Control Init image: {i % len(inits) + 1} of {len(inits)}')
                         init_image = inits[i % len(inits)]
-                    index += 1
-                    if video is not None and index % (video_skip_frames + 1) != 0:
-                        continue
+                    index = indexes[i] if video is not None else index + 1 # frame skipping is done by decoder
 
                     # resize before
                     if resize_mode_before != 0 and resize_name_before != 'None':
@@ -536,8 +531,12 @@ def control_run(units: List[unit.Unit], inputs, inits, mask, unit_type: str, is_
                                 debug(f'Control resize: op=after image={output_image} width={width_after} height={height_after} mode={resize_mode_after} name={resize_name_after}')
                                 output_image = images.resize_image(resize_mode_after, output_image, width_after, height_after, resize_name_after)
 
-                            output_images.append(output_image)
-                            if shared.opts.include_mask:
+                            if writer is not None: # stream to encoder and keep only latest frame in memory
+                                writer.write(output_image)
+                                output_images = [output_image]
+                            else:
+                                output_images.append(output_image)
+                            if shared.opts.include_mask and writer is None:
                                 if processed_image is not None and isinstance(processed_image, Image.Image):
                                     output_images.append(processed_image)
 
@@ -549,21 +548,24 @@ def control_run(units: List[unit.Unit], inputs, inits, mask, unit_type: str, is_
                                     msg = f'Control output | {index} of {len(inputs)} | Image {image_txt}'
                                 yield (output_image, processed_image, msg) # result is control_output, proces_output
 
-                if video is not None and frame is not None:
-                    status, frame = video.read()
-                    if status:
-                        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    debug(f'Control: video frame={index} frames={frames} status={status} skip={index % (video_skip_frames + 1)} progress={index/frames:.2f}')
+                if video is not None:
+                    debug(f'Control: video frame={index} frames={frames} window={len(inputs)} progress={index/max(frames, 1):.2f}')
                 else:
                     status = False
 
-            if video is not None:
-                video.release()
-
             shared.log.info(f'Control: pipeline units={len(active_model)} process={len(active_process)} time={t3-t0:.2f} init={t1-t0:.2f} proc={t2-t1:.2f} ctrl={t3-t2:.2f} outputs={len(output_images)}')
     except Exception as e:
         shared.log.error(f'Control pipeline failed: type={unit_type} units={len(active_model)} error={e}')
         errors.display(e, 'Control')
+    finally:
+        if video is not None:
+            video.release()
+        if writer is not None:
+            try:
+                output_filename = writer.close() or output_filename
+            except Exception as e:
+                shared.log.error(f'Control video encode failed: {e}')
+                output_filename = None
 
     if len(output_images) == 0:
         output_images = None
@@ -573,7 +575,10 @@ def control_run(units: List[unit.Unit], inputs, inits, mask, unit_type: str, is_
         image_txt = f'| Images {len(output_images)} | Size {" ".join(image_str)}'
         p.init_images = output_images # may be used for hires
 
-    if video_type != 'None' and isinstance(output_images, list):
+    if writer is not None and output_filename is not None:
+        p.do_not_save_grid = True # pylint: disable=attribute-defined-outside-init
+        image_txt = f'| Frames {writer.frames} | Size {output_images[0].width}x{output_images[0].height}' if output_images is not None else image_txt
+    elif video_type != 'None' and isinstance(output_images, list):
         p.do_not_save_grid = True # pylint: disable=attribute-defined-outside-init
         output_filename = images.save_video(p, filename=None, images=output_images, video_type=video_type, duration=video_duration, loop=video_loop, pad=video_pad, interpolate=video_interpolate, sync=True)
         image_txt = f'| Frames {len(output_images)} | Size {output_images[0].width}x{output_images[0].height}'
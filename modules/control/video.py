@@ -0,0 +1,77 @@
+import os
+import queue
+import threading
+import cv2
+from PIL import Image
+from modules import shared
+from modules.control import util
+
+
+debug = shared.log.trace if os.environ.get('SD_CONTROL_DEBUG', None) is not None else lambda *args, **kwargs: None
+
+
+class VideoReader:
+    """Threaded video decoder: frames are decoded ahead of generation into a bounded queue and skipped frames are never decoded"""
+    def __init__(self, path: str, skip_frames: int = 0, maxsize: int = 8):
+        self.path = path
+        self.skip = max(int(skip_frames or 0), 0)
+        self.video = cv2.VideoCapture(path)
+        if not self.video.isOpened():
+            raise RuntimeError(f'video open failed: path={path}')
+        self.frames = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = float(self.video.get(cv2.CAP_PROP_FPS))
+        self.width, self.height = int(self.video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.codec = util.decode_fourcc(self.video.get(cv2.CAP_PROP_FOURCC))
+        self.buffer = queue.Queue(maxsize=maxsize)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.decode, daemon=True)
+        self.thread.start()
+
+    @property
+    def selected(self): # number of frames that will be returned after skipping
+        return self.frames // (self.skip + 1) if self.frames > 0 else 0
+
+    def decode(self):
+        index = 0
+        try:
+            while not self.stopped.is_set():
+                index += 1
+                if index % (self.skip + 1) != 0: # grab advances the stream without decoding the frame
+                    if not self.video.grab():
+                        break
+                    continue
+                status, frame = self.video.read()
+                if not status:
+                    break
+                image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                self.put((index, image))
+                debug(f'Control: video decode frame={index} frames={self.frames} queue={self.buffer.qsize()}')
+        except Exception as e:
+            shared.log.error(f'Control: video decode failed: path={self.path} frame={index} {e}')
+        self.put(None)
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.buffer.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def read(self, count: int = 1):
+        """returns list of up to count (index, image) tuples, empty list when stream is exhausted"""
+        items = []
+        while len(items) < count:
+            if self.stopped.is_set() and self.buffer.empty():
+                break
+            item = self.buffer.get()
+            if item is None:
+                self.stopped.set()
+                break
+            items.append(item)
+        return items
+
+    def release(self):
+        self.stopped.set()
+        self.thread.join(timeout=5)
+        self.video.release()
@@ -1,5 +1,6 @@
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 import torch
 import numpy as np
 from PIL import Image
@@ -46,25 +47,77 @@ class DeepDanbooru:
 
         return res
 
+    def prepare(self, pil_image):
+        if isinstance(pil_image, dict) and 'name' in pil_image:
+            pil_image = Image.open(pil_image['name'])
+        if isinstance(pil_image, str):
+            pil_image = Image.open(pil_image)
+        pic = images.resize_image(2, pil_image.convert("RGB"), 512, 512)
+        return np.array(pic, dtype=np.float32) / 255
+
+    def predict(self, arrays):
+        """run model on list of prepared images, returns tag probabilities per image"""
+        with devices.inference_context(), devices.autocast():
+            x = torch.from_numpy(np.stack(arrays)).to(devices.device)
+            y = self.model(x).detach().float().cpu().numpy()
+        return y
+
     def tag_multi(self, pil_image, force_disable_ranks=False):
+        if isinstance(pil_image, list):
+            return [self.format(y, force_disable_ranks) for y in self.predict([self.prepare(image) for image in pil_image])]
+        return self.format(self.predict([self.prepare(pil_image)])[0], force_disable_ranks)
+
+    def tag_batch(self, items, batch_size=None, force_disable_ranks=False):
+        """
+        tag images or image files keeping model resident for whole job, yields (item, tags) in input order
+        decode and resize run in worker threads while previous batch is on device
+        """
+        batch_size = batch_size or shared.opts.deepbooru_batch_size
+        self.start()
+        try:
+            with ThreadPoolExecutor(max_workers=shared.max_workers) as executor:
+                def prepare(item):
+                    try:
+                        return self.prepare(item)
+                    except Exception as e:
+                        shared.log.error(f'DeepBooru: item={item} {e}')
+                        return None
+                chunks = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+                pending = [executor.submit(prepare, item) for item in chunks[0]] if len(chunks) > 0 else []
+                for i, chunk in enumerate(chunks):
+                    arrays = [f.result() for f in pending]
+                    pending = [executor.submit(prepare, item) for item in chunks[i + 1]] if i + 1 < len(chunks) else []
+                    if shared.state.interrupted:
+                        break
+                    valid = [a for a in arrays if a is not None]
+                    probs = iter(self.predict(valid)) if len(valid) > 0 else iter([])
+                    for item, a in zip(chunk, arrays):
+                        yield item, self.format(next(probs), force_disable_ranks) if a is not None else None
+                for f in pending:
+                    f.cancel()
+        finally:
+            self.stop()
+
+    def tag_files(self, files, write=True, batch_size=None):
+        """tag image files and stream results into caption files next to images, returns list of tags in file order"""
+        res = []
+        shared.log.info(f'DeepBooru batch: images={len(files)} batch={batch_size or shared.opts.deepbooru_batch_size} write={write}')
+        for file, tags in self.tag_batch(files, batch_size=batch_size):
+            if tags is None:
+                continue
+            res.append(tags)
+            if write:
+                with open(os.path.splitext(file)[0] + '.txt', 'w', encoding='utf-8') as f:
+                    f.write(tags)
+        return res
+
+    def format(self, y, force_disable_ranks=False):
         threshold = shared.opts.interrogate_deepbooru_score_threshold
         use_spaces = shared.opts.deepbooru_use_spaces
         use_escape = shared.opts.deepbooru_escape
         alpha_sort = shared.opts.deepbooru_sort_alpha
         include_ranks = shared.opts.interrogate_return_ranks and not force_disable_ranks
 
-        if isinstance(pil_image, list):
-            pil_image = pil_image[0]
-        if isinstance(pil_image, dict) and 'name' in pil_image:
-            pil_image = Image.open(pil_image['name'])
-
-        pic = images.resize_image(2, pil_image.convert("RGB"), 512, 512)
-        a = np.expand_dims(np.array(pic, dtype=np.float32), 0) / 255
-
-        with devices.inference_context(), devices.autocast():
-            x = torch.from_numpy(a).to(devices.device)
-            y = self.model(x)[0].detach().float().cpu().numpy()
-
         probability_dict = {}
 
         for tag, probability in zip(self.model.tags, y):
@@ -351,12 +351,8 @@ def cond_cast_float(tensor):
 
 
 def randn(seed, shape):
-    torch.manual_seed(seed)
-    if backend == 'ipex':
-        torch.xpu.manual_seed_all(seed)
-    if device.type == 'mps':
-        return torch.randn(shape, device=cpu).to(device)
-    return torch.randn(shape, device=device)
+    from modules import rng
+    return rng.randn(seed, shape)
 
 
 def randn_without_seed(shape):
@@ -1,4 +1,4 @@
-from modules import shared
+from modules import shared, tracing
 
 
 class FaceRestoration:
@@ -9,6 +9,7 @@ class FaceRestoration:
         return np_image
 
 
+@tracing.traced('restore')
 def restore_faces(np_image, p=None):
     face_restorers = [x for x in shared.face_restorers if x.name() == shared.opts.face_restoration_model or shared.opts.face_restoration_model is None]
     if len(face_restorers) == 0:
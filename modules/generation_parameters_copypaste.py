@@ -14,6 +14,12 @@ paste_fields = {}
 registered_param_bindings = []
 debug = shared.log.trace if os.environ.get('SD_PASTE_DEBUG', None) is not None else lambda *args, **kwargs: None
 debug('Trace: PASTE')
+re_param = re.compile(r'\s*([\w ]+):\s*("(?:\\.|[^\\"])*"|[^,]*?)\s*(?:,|$)') # multi-word: value where value is json quoted or up to next comma
+re_flag = re.compile(r'\s*([\w ]+?)\s*(?:,|$)') # params where key equals value are written as key only
+re_size = re.compile(r'^(\d+)x(\d+)$') # int x int
+re_number = re.compile(r'^(?:\d+\.?\d*|\.\d+)$', re.ASCII)
+re_separator = re.compile(r'[(<{\[]|[)>}\]]|,') # brackets and top-level commas where params section can start
+skip_params = ['hashes', 'lora', 'embeddings', 'prompt', 'negative prompt']
 
 
 class ParamBinding:
@@ -184,48 +190,86 @@ def send_image_and_dimensions(x):
     return img, w, h
 
 
+def join_infotext(prompt: str, negative_prompt: str, params: dict):
+    """serialize prompt, negative prompt and params into infotext, params are written on single last line"""
+    params_text = ", ".join([k if k == v else f'{k}: {quote(v)}' for k, v in params.items() if v is not None])
+    negative_prompt_text = f"\nNegative prompt: {negative_prompt}" if negative_prompt else ""
+    return f"{prompt}{negative_prompt_text}\n{params_text}".strip()
+
+
+def tokenize_params(line: str, pos: int = 0):
+    """tokenize params from position to end of line, returns none if remaining text is not a complete list of key: value pairs"""
+    params = {}
+    while pos < len(line):
+        m = re_param.match(line, pos)
+        if m is not None and m.end() > pos:
+            params[m.group(1).strip()] = m.group(2)
+        else:
+            m = re_flag.match(line, pos) if len(params) > 0 else None
+            if m is None or m.end() == pos:
+                return None
+            params[m.group(1)] = m.group(1)
+        pos = m.end()
+    return params if len(params) > 0 and next(iter(params)).lower() not in ['prompt', 'negative prompt'] else None
+
+
+def find_params(line: str):
+    """params section is the longest suffix of last line that tokenizes completely, candidate starts are line start and commas outside of brackets"""
+    params = tokenize_params(line)
+    if params is not None:
+        return 0, params
+    depth = 0
+    for m in re_separator.finditer(line):
+        c = m.group()
+        if c in '(<{[':
+            depth += 1
+        elif c in ')>}]':
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            params = tokenize_params(line, m.end())
+            if params is not None:
+                return m.end(), params
+    return len(line), {}
+
+
 def parse_generation_parameters(infotext):
     if not isinstance(infotext, str):
         return {}
     debug(f'Parse infotext: {infotext}')
-    re_param = re.compile(r'\s*([\w ]+):\s*("(?:\\"[^,]|\\"|\\|[^\"])+"|[^,]*)(?:,|$)') # multi-word: value
-    re_size = re.compile(r"^(\d+)x(\d+)$") # int x int
-    sanitized = infotext.replace('prompt:', 'Prompt:').replace('negative prompt:', 'Negative prompt:').replace('Negative Prompt', 'Negative prompt') # cleanup everything in brackets so re_params can work
-    sanitized = re.sub(r'<[^>]*>', lambda match: ' ' * len(match.group()), sanitized)
-    sanitized = re.sub(r'\([^)]*\)', lambda match: ' ' * len(match.group()), sanitized)
-    sanitized = re.sub(r'\{[^}]*\}', lambda match: ' ' * len(match.group()), sanitized)
-
-    params = dict(re_param.findall(sanitized))
+    text = infotext.rstrip()
+    line_idx = text.rfind('\n') + 1
+    params_idx, params = find_params(text[line_idx:])
+    params_idx += line_idx
     debug(f"Parse params: {params}")
-    params = { k.strip():params[k].strip() for k in params if k.lower() not in ['hashes', 'lora', 'embeddings', 'prompt', 'negative prompt']} # remove some keys
-    first_param = next(iter(params)) if params else None
-    params_idx = sanitized.find(f'{first_param}:') if first_param else -1
-    negative_idx = infotext.find("Negative prompt:")
-
-    prompt = infotext[:params_idx] if negative_idx == -1 else infotext[:negative_idx] # prompt can be with or without negative prompt
-    negative = infotext[negative_idx:params_idx] if negative_idx >= 0 else ''
+    negative_idx = text.find("Negative prompt:", 0, params_idx)
+    prompt = text[:params_idx] if negative_idx == -1 else text[:negative_idx] # prompt can be with or without negative prompt
+    negative = text[negative_idx:params_idx] if negative_idx >= 0 else ''
 
-    for k, v in params.copy().items(): # avoid dict-has-changed
+    res = {}
+    for k, v in params.items():
+        if k.lower() in skip_params:
+            continue
         if len(v) > 0 and v[0] == '"' and v[-1] == '"':
             v = unquote(v)
-        m = re_size.match(v)
-        if v.replace('.', '', 1).isdigit():
-            params[k] = float(v) if '.' in v else int(v)
+        if re_number.match(v):
+            res[k] = float(v) if '.' in v else int(v)
         elif v == "True":
-            params[k] = True
+            res[k] = True
         elif v == "False":
-            params[k] = False
-        elif m is not None:
-            params[f"{k}-1"] = int(m.group(1))
-            params[f"{k}-2"] = int(m.group(2))
+            res[k] = False
         elif k == 'VAE' and v == 'TAESD':
-            params["Full quality"] = False
+            res[k] = v
+            res["Full quality"] = False
         else:
-            params[k] = v
-    params["Prompt"] = prompt.replace('Prompt:', '').strip()
-    params["Negative prompt"] = negative.replace('Negative prompt:', '').strip()
-    debug(f"Parse: {params}")
-    return params
+            res[k] = v
+            m = re_size.match(v)
+            if m is not None:
+                res[f"{k}-1"] = int(m.group(1))
+                res[f"{k}-2"] = int(m.group(2))
+    res["Prompt"] = prompt.replace('Prompt:', '').strip()
+    res["Negative prompt"] = negative.replace('Negative prompt:', '').strip()
+    debug(f"Parse: {res}")
+    return res
 
 
 settings_map = {}
@@ -241,6 +285,7 @@ infotext_to_setting_name_mapping = [
     # Samplers
     ('Sampler Eta', 'scheduler_eta'),
     ('Sampler ENSD', 'eta_noise_seed_delta'),
+    ('RNG', 'randn_source'),
     ('Sampler order', 'schedulers_solver_order'),
     # Samplers diffusers
     ('Sampler beta schedule', 'schedulers_beta_schedule'),
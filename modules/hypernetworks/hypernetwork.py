@@ -1,5 +1,6 @@
 import os
 import inspect
+from collections import OrderedDict
 from statistics import stdev, mean
 from rich import progress
 import torch
@@ -7,7 +8,13 @@ from torch import einsum
 from torch.nn.init import normal_, xavier_normal_, xavier_uniform_, kaiming_normal_, kaiming_uniform_, zeros_
 from einops import rearrange, repeat
 from ldm.util import default
-from modules import devices, shared, hashes, errors, files_cache
+from modules import devices, shared, hashes, errors, files_cache, metrics
+
+
+debug = shared.log.trace if os.environ.get('SD_HYPERNET_DEBUG', None) is not None else lambda *args, **kwargs: None
+cache = OrderedDict() # name -> (path, mtime, loaded hypernetwork), lru independent of activation order
+contexts = [] # [context, hypernetworks, context_k, context_v] for recent conditionings, context is constant across sampling steps
+contexts_size = 4
 
 
 class HypernetworkModule(torch.nn.Module):
@@ -294,20 +301,34 @@ def load_hypernetwork(name):
     return hypernetwork
 
 
+def file_stamp(name):
+    path = shared.hypernetworks.get(name, None)
+    try:
+        return path, os.path.getmtime(path) if path is not None else None
+    except OSError:
+        return path, None
+
+
 def load_hypernetworks(names, multipliers=None):
-    already_loaded = {}
-    for hypernetwork in shared.loaded_hypernetworks:
-        if hypernetwork.name in names:
-            already_loaded[hypernetwork.name] = hypernetwork
     shared.loaded_hypernetworks.clear()
+    contexts.clear()
     for i, name in enumerate(names):
-        hypernetwork = already_loaded.get(name, None)
+        path, mtime = file_stamp(name)
+        entry = cache.get(name, None)
+        hypernetwork = entry[2] if entry is not None and entry[0] == path and entry[1] == mtime else None # file replaced on disk or list refreshed with different path
+        metrics.counter('sd_cache_requests_total', 'Cache lookups', cache='hypernetwork', result='hit' if hypernetwork is not None else 'miss').inc()
         if hypernetwork is None:
+            cache.pop(name, None)
             hypernetwork = load_hypernetwork(name)
         if hypernetwork is None:
             continue
+        cache[name] = (path, mtime, hypernetwork)
+        cache.move_to_end(name)
         hypernetwork.set_multiplier(multipliers[i] if multipliers else 1.0)
         shared.loaded_hypernetworks.append(hypernetwork)
+    while len(cache) > max(shared.opts.hypernetwork_in_memory_limit, len(shared.loaded_hypernetworks)): # active hypernetworks are most recent so they are never evicted
+        name, _hypernetwork = cache.popitem(last=False)
+        debug(f'Hypernetwork evict: name={name}')
 
 
 def find_closest_hypernetwork_name(search: str):
@@ -333,19 +354,55 @@ def apply_single_hypernetwork(hypernetwork, context_k, context_v, layer=None):
     return context_k, context_v
 
 
-def apply_hypernetworks(hypernetworks, context, layer=None):
-    context_k = context
-    context_v = context
-    for hypernetwork in hypernetworks:
-        context_k, context_v = apply_single_hypernetwork(hypernetwork, context_k, context_v, layer)
-    return context_k, context_v
+def find_context(hypernetworks, context):
+    for i, entry in enumerate(contexts): # all attention layers within a step receive same context tensor
+        if entry[0] is context and entry[1] == hypernetworks:
+            contexts.insert(0, contexts.pop(i))
+            return entry
+    for i, entry in enumerate(contexts): # samplers concatenate cond and uncond on every step so compare values
+        if entry[1] == hypernetworks and entry[0].shape == context.shape and entry[0].dtype == context.dtype and entry[0].device == context.device and torch.equal(entry[0], context):
+            entry[0] = context
+            contexts.insert(0, contexts.pop(i))
+            return entry
+    return None
+
+
+def apply_hypernetworks(hypernetworks, context, layer=None, cache=True):
+    """cache is only used for cross-attention, self-attention context is hidden state that changes on every call"""
+    if len(hypernetworks) == 0:
+        return context, context
+    if not any(context.shape[2] in hypernetwork.layers for hypernetwork in hypernetworks):
+        return context, context
+    if not cache or torch.is_grad_enabled(): # outputs must stay connected to graph
+        context_k = context
+        context_v = context
+        for hypernetwork in hypernetworks:
+            context_k, context_v = apply_single_hypernetwork(hypernetwork, context_k, context_v, layer)
+        return context_k, context_v
+    entry = find_context(hypernetworks, context)
+    if entry is None:
+        context_k = context
+        context_v = context
+        for hypernetwork in hypernetworks:
+            context_k, context_v = apply_single_hypernetwork(hypernetwork, context_k, context_v)
+        entry = [context, list(hypernetworks), context_k, context_v]
+        contexts.insert(0, entry)
+        del contexts[contexts_size:]
+        debug(f'Hypernetwork context: shape={list(context.shape)} hypernetworks={[h.name for h in hypernetworks]} cached={len(contexts)}')
+    if layer is not None:
+        for hypernetwork in hypernetworks:
+            hypernetwork_layers = hypernetwork.layers.get(context.shape[2], None)
+            if hypernetwork_layers is not None:
+                layer.hyper_k, layer.hyper_v = hypernetwork_layers
+    return entry[2], entry[3]
 
 
 def attention_CrossAttention_forward(self, x, context=None, mask=None):
     h = self.heads
     q = self.to_q(x)
+    cache = context is not None
     context = default(context, x)
-    context_k, context_v = apply_hypernetworks(shared.loaded_hypernetworks, context, self)
+    context_k, context_v = apply_hypernetworks(shared.loaded_hypernetworks, context, self, cache=cache)
     k = self.to_k(context_k)
     v = self.to_v(context_v)
     q, k, v = (rearrange(t, 'b n (h d) -> (b h) n d', h=h) for t in (q, k, v))
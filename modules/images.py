@@ -6,6 +6,7 @@ import math
 import json
 import uuid
 import queue
+import time
 import string
 import random
 import hashlib
@@ -13,11 +14,12 @@ import datetime
 import threading
 from pathlib import Path
 from collections import namedtuple
+from typing import Union
 import numpy as np
 import piexif
 import piexif.helper
 from PIL import Image, ImageFont, ImageDraw, PngImagePlugin, ExifTags
-from modules import sd_samplers, shared, script_callbacks, errors, paths
+from modules import sd_samplers, shared, script_callbacks, errors, paths, tracing, metrics
 
 
 debug = errors.log.trace if os.environ.get('SD_PATH_DEBUG', None) is not None else lambda *args, **kwargs: None
@@ -602,8 +604,10 @@ save_thread = threading.Thread(target=atomically_save_image, daemon=True)
 save_thread.start()
 
 
+@tracing.traced('save')
 def save_image(image, path, basename='', seed=None, prompt=None, extension=shared.opts.samples_format, info=None, short_filename=False, no_prompt=False, grid=False, pnginfo_section_name='parameters', p=None, existing_info=None, forced_filename=None, suffix='', save_to_dirs=None): # pylint: disable=unused-argument
     debug(f'Save: fn={sys._getframe(1).f_code.co_name}') # pylint: disable=protected-access
+    metrics.counter('sd_images_saved_total', 'Images saved').inc()
     if image is None:
         shared.log.warning('Image is none')
         return None, None
@@ -655,29 +659,39 @@ def save_image(image, path, basename='', seed=None, prompt=None, extension=share
 
 def save_video_atomic(images, filename, video_type: str = 'none', duration: float = 2.0, loop: bool = False, interpolate: int = 0, scale: float = 1.0, pad: int = 1, change: float = 0.3):
     try:
-        import cv2
+        import cv2 # pylint: disable=unused-import # noqa: F401
     except Exception as e:
         shared.log.error(f'Save video: cv2: {e}')
         return
     os.makedirs(os.path.dirname(filename), exist_ok=True)
     if video_type.lower() == 'mp4':
-        frames = images
         if interpolate > 0:
+            # fps is set from the estimated frame count since frames are streamed to encoder as they are produced
+            # duplicate input frames are skipped during interpolation so the resulting video can be shorter than requested duration
+            writer = None
             try:
                 import modules.rife
-                frames = modules.rife.interpolate(images, count=interpolate, scale=scale, pad=pad, change=change)
+                modules.rife.load()
+                total = modules.rife.estimate(len(images), count=interpolate, pad=pad)
+                writer = VideoWriter(None, filename=filename, video_type=video_type, fps=total/duration)
+                for frame in modules.rife.interpolate_frames(images, count=interpolate, scale=scale, pad=pad, change=change):
+                    writer.write(frame)
+                writer.close()
+                if writer.frames < total:
+                    shared.log.debug(f'Save video: file="{filename}" frames={writer.frames} estimate={total} duration={writer.frames / writer.fps:.2f}')
+                return
             except Exception as e:
                 shared.log.error(f'RIFE interpolation: {e}')
                 errors.display(e, 'RIFE interpolation')
-        video_frames = [np.array(frame) for frame in frames]
-        fourcc = "mp4v"
-        h, w, _c = video_frames[0].shape
-        video_writer = cv2.VideoWriter(filename, fourcc=cv2.VideoWriter_fourcc(*fourcc), fps=len(frames)/duration, frameSize=(w, h))
-        for i in range(len(video_frames)):
-            img = cv2.cvtColor(video_frames[i], cv2.COLOR_RGB2BGR)
-            video_writer.write(img)
-        size = os.path.getsize(filename)
-        shared.log.info(f'Save video: file="{filename}" frames={len(frames)} duration={duration} fourcc={fourcc} size={size}')
+                if writer is not None:
+                    try:
+                        writer.close() # discard partial output, it is overwritten with original frames below
+                    except Exception:
+                        pass
+        writer = VideoWriter(None, filename=filename, video_type=video_type, fps=len(images)/duration)
+        for frame in images:
+            writer.write(frame)
+        writer.close()
     if video_type.lower() == 'gif' or video_type.lower() == 'png':
         append = images.copy()
         image = append.pop(0)
@@ -696,10 +710,7 @@ def save_video_atomic(images, filename, video_type: str = 'none', duration: floa
         shared.log.info(f'Save video: file="{filename}" frames={len(append) + 1} duration={duration} loop={loop} size={size}')
 
 
-def save_video(p, images, filename = None, video_type: str = 'none', duration: float = 2.0, loop: bool = False, interpolate: int = 0, scale: float = 1.0, pad: int = 1, change: float = 0.3, sync: bool = False):
-    if images is None or len(images) < 2 or video_type is None or video_type.lower() == 'none':
-        return
-    image = images[0]
+def get_video_filename(p, image, filename = None, video_type: str = 'none'):
     if p is not None:
         namegen = FilenameGenerator(p, seed=p.all_seeds[0], prompt=p.all_prompts[0], image=image)
     else:
@@ -714,6 +725,13 @@ def save_video(p, images, filename = None, video_type: str = 'none', duration: f
     if not filename.lower().endswith(video_type.lower()):
         filename += f'.{video_type.lower()}'
     filename = namegen.sanitize(filename)
+    return filename
+
+
+def save_video(p, images, filename = None, video_type: str = 'none', duration: float = 2.0, loop: bool = False, interpolate: int = 0, scale: float = 1.0, pad: int = 1, change: float = 0.3, sync: bool = False):
+    if images is None or len(images) < 2 or video_type is None or video_type.lower() == 'none':
+        return
+    filename = get_video_filename(p, images[0], filename, video_type)
     if not sync:
         threading.Thread(target=save_video_atomic, args=(images, filename, video_type, duration, loop, interpolate, scale, pad, change)).start()
     else:
@@ -721,6 +739,88 @@ def save_video(p, images, filename = None, video_type: str = 'none', duration: f
     return filename
 
 
+class VideoWriter:
+    """Incremental mp4 encoder: frames are queued and written by a background thread so memory stays flat regardless of clip length"""
+    def __init__(self, p, filename: str = None, video_type: str = 'mp4', fps: float = 30.0, maxsize: int = 16):
+        self.p = p
+        self.filename = filename
+        self.video_type = video_type
+        self.fps = max(fps, 1)
+        self.frames = 0
+        self.writer = None
+        self.buffer = queue.Queue(maxsize=maxsize)
+        self.thread = None
+        self.error = None # exception raised by encoder thread, re-raised to producer
+        self.t0 = time.time()
+
+    @staticmethod
+    def supported(video_type: str, interpolate: int = 0):
+        return video_type is not None and video_type.lower() == 'mp4' and interpolate == 0
+
+    def open(self, frame: np.ndarray):
+        import cv2
+        h, w, _c = frame.shape
+        if self.p is not None or self.filename is None:
+            self.filename = get_video_filename(self.p, Image.fromarray(frame), self.filename, self.video_type)
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        fourcc = "mp4v"
+        self.writer = cv2.VideoWriter(self.filename, fourcc=cv2.VideoWriter_fourcc(*fourcc), fps=self.fps, frameSize=(w, h))
+        self.thread = threading.Thread(target=self.encode, daemon=True)
+        self.thread.start()
+        shared.log.debug(f'Save video: file="{self.filename}" fps={self.fps:.2f} size={w}x{h} fourcc={fourcc} stream=True')
+
+    def encode(self):
+        import cv2
+        while True:
+            frame = self.buffer.get()
+            if frame is None:
+                self.buffer.task_done()
+                break
+            try:
+                if self.error is None: # after failure frames are drained so producer never blocks on full queue
+                    self.writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+            except Exception as e:
+                self.error = e
+            self.buffer.task_done()
+
+    def put(self, item):
+        while True:
+            if self.error is not None:
+                raise self.error
+            if not self.thread.is_alive():
+                raise RuntimeError('video encoder thread stopped')
+            try:
+                self.buffer.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def write(self, image: Union[Image.Image, np.ndarray]):
+        if image is None:
+            return
+        frame = np.asarray(image.convert('RGB')) if isinstance(image, Image.Image) else image
+        if self.writer is None:
+            self.open(frame)
+        self.put(frame) # blocks if encoder falls behind
+        self.frames += 1
+
+    def close(self):
+        if self.writer is None:
+            return None
+        try:
+            if self.thread.is_alive(): # encoder drains queue even after failure so sentinel is always accepted
+                self.buffer.put(None)
+                self.thread.join()
+        finally:
+            self.writer.release()
+            self.writer = None
+        if self.error is not None:
+            raise self.error
+        size = os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+        shared.log.info(f'Save video: file="{self.filename}" frames={self.frames} fps={self.fps:.2f} size={size} time={time.time() - self.t0:.2f}')
+        return self.filename
+
+
 def safe_decode_string(s: bytes):
     remove_prefix = lambda text, prefix: text[len(prefix):] if text.startswith(prefix) else text # pylint: disable=unnecessary-lambda-assignment
     for encoding in ['utf-8', 'utf-16', 'ascii', 'latin_1', 'cp1252', 'cp437']: # try different encodings
@@ -296,6 +296,14 @@ def interrogate_batch(batch_files, batch_folder, batch_str, model, mode, write):
     shared.state.begin()
     shared.state.job = 'batch interrogate'
     prompts = []
+    if model.lower() in {'deepbooru', 'deepdanbooru'}:
+        from modules import deepbooru
+        try:
+            prompts = deepbooru.model.tag_files(files, write=write)
+        except Exception as e:
+            shared.log.error(f'Interrogate batch: {e}')
+        shared.state.end()
+        return '\n\n'.join(prompts)
     try:
         if shared.backend == shared.Backend.ORIGINAL and (shared.cmd_opts.lowvram or shared.cmd_opts.medvram):
             lowvram.send_everything_to_cpu()
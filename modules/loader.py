@@ -1,13 +1,55 @@
 from __future__ import annotations
 import re
 import sys
+import time
+import types
 import logging
+import importlib
 import warnings
 import urllib3
 from modules import timer, errors
 
 initialized = False
 errors.install()
+
+
+class LazyModule(types.ModuleType):
+    """Module proxy that defers import until first attribute access and records import time in startup timer"""
+    def __init__(self, name: str, category: str = None, init=None):
+        super().__init__(name)
+        self._lazy_category = category or name.split('.')[0]
+        self._lazy_init = init
+        self._lazy_module = None
+
+    def _lazy_load(self):
+        if self._lazy_module is None:
+            t0 = time.time()
+            module = importlib.import_module(self.__name__)
+            if self._lazy_init is not None:
+                self._lazy_init(module)
+            self._lazy_module = module
+            timer.startup.add(self._lazy_category, time.time() - t0)
+            errors.log.debug(f'Load module: name={self.__name__} time={time.time() - t0:.2f}')
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        return getattr(self._lazy_load(), attr)
+
+    def __dir__(self):
+        return dir(self._lazy_load())
+
+    @property
+    def loaded(self):
+        return self._lazy_module is not None
+
+
+def lazy_import(name: str, category: str = None, init=None):
+    """returns already imported module or proxy that imports it on first use"""
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name, category, init)
+
+
 logging.getLogger("DeepSpeed").disabled = True
 # os.environ.setdefault('OMP_NUM_THREADS', 1)
 # os.environ.setdefault('MKL_NUM_THREADS', 1)
@@ -41,10 +83,6 @@ import onnxruntime
 onnxruntime.set_default_logger_severity(3)
 timer.startup.record("onnx")
 
-from modules.onnx_impl import initialize_olive # pylint: disable=ungrouped-imports
-initialize_olive()
-timer.startup.record("olive")
-
 from fastapi import FastAPI # pylint: disable=W0611,C0411
 import gradio # pylint: disable=W0611,C0411
 timer.startup.record("gradio")
@@ -3,12 +3,14 @@ from typing import List
 import os
 import sys
 import time
+import threading
+from collections import OrderedDict
 import gradio as gr
 import numpy as np
 import cv2
-from PIL import Image, ImageFilter, ImageOps
+from PIL import Image
 from transformers import SamModel, SamImageProcessor, MaskGenerationPipeline
-from modules import shared, errors, devices, ui_components, ui_symbols, paths, sd_models
+from modules import shared, errors, devices, ui_components, ui_symbols, paths, sd_models, metrics
 from modules.memstats import memory_stats
 
 
@@ -20,26 +22,12 @@ def get_crop_region(mask, pad=0):
     """finds a rectangular region that contains all masked ares in an image. Returns (x1, y1, x2, y2) coordinates of the rectangle.
     For example, if a user has painted the top-right part of a 512x512 image", the result may be (256, 0, 512, 256)"""
     h, w = mask.shape
-    crop_left = 0
-    for i in range(w):
-        if not (mask[:, i] == 0).all():
-            break
-        crop_left += 1
-    crop_right = 0
-    for i in reversed(range(w)):
-        if not (mask[:, i] == 0).all():
-            break
-        crop_right += 1
-    crop_top = 0
-    for i in range(h):
-        if not (mask[i] == 0).all():
-            break
-        crop_top += 1
-    crop_bottom = 0
-    for i in reversed(range(h)):
-        if not (mask[i] == 0).all():
-            break
-        crop_bottom += 1
+    cols = np.flatnonzero(mask.any(axis=0))
+    rows = np.flatnonzero(mask.any(axis=1))
+    crop_left = cols[0] if len(cols) > 0 else w
+    crop_right = w - 1 - cols[-1] if len(cols) > 0 else w
+    crop_top = rows[0] if len(rows) > 0 else h
+    crop_bottom = h - 1 - rows[-1] if len(rows) > 0 else h
     x1 = max(crop_left - pad, 0)
     y1 = max(crop_top - pad, 0)
     x2 = max(w - crop_right + pad, 0)
@@ -103,17 +91,51 @@ def expand_crop_region(crop_region, processing_width, processing_height, image_w
     return crop_expand
 
 
+fill_steps = [(256, 1), (64, 1), (16, 2), (4, 4), (2, 2), (0, 1)] # blur radius and number of composites
+
+
+def pyramid_blur(x: np.ndarray, sigma: float):
+    """gaussian blur where large sigmas are applied on downscaled pyramid level and upscaled back"""
+    if sigma <= 0:
+        return x
+    h, w = x.shape[:2]
+    level = 0
+    while sigma / 2 ** level > 2 and min(h, w) // 2 ** (level + 1) >= 16:
+        level += 1
+    small = cv2.resize(x, (max(w >> level, 1), max(h >> level, 1)), interpolation=cv2.INTER_AREA) if level > 0 else x
+    small = cv2.GaussianBlur(small, (0, 0), sigmaX=sigma / 2 ** level, borderType=cv2.BORDER_REPLICATE) # pil blur clamps at image edges
+    return cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR) if level > 0 else small
+
+
 def fill(image, mask):
-    """fills masked regions with colors from image using blur. Not extremely effective."""
-    image_mod = Image.new('RGBA', (image.width, image.height))
-    image_masked = Image.new('RGBa', (image.width, image.height))
-    image_masked.paste(image.convert("RGBA").convert("RGBa"), mask=ImageOps.invert(mask.convert('L')))
-    image_masked = image_masked.convert('RGBa')
-    for radius, repeats in [(256, 1), (64, 1), (16, 2), (4, 4), (2, 2), (0, 1)]:
-        blurred = image_masked.filter(ImageFilter.GaussianBlur(radius)).convert('RGBA')
-        for _ in range(repeats):
-            image_mod.alpha_composite(blurred)
-    return image_mod.convert("RGB")
+    """fills masked regions with colors from image using blur. Not extremely effective.
+    accepts single image and mask or lists of images and masks"""
+    if isinstance(image, list):
+        masks = mask if isinstance(mask, list) else [mask] * len(image)
+        return [fill(i, m) for i, m in zip(image, masks)]
+    rgb = np.asarray(image.convert('RGB'))
+    m = np.asarray(mask.convert('L').resize(image.size) if mask.size != image.size else mask.convert('L'))
+    if not m.any():
+        return image.convert('RGB')
+    h, w = m.shape
+    x1, y1, x2, y2 = get_crop_region(m) # unmasked pixels keep original values so only masked region is composited
+    premultiplied = np.empty((h, w, 4), dtype=np.float32)
+    np.subtract(1, m / np.float32(255), out=premultiplied[:, :, 3])
+    np.multiply(rgb, premultiplied[:, :, 3:], out=premultiplied[:, :, :3])
+    composite = np.zeros((y2 - y1, x2 - x1, 4), dtype=np.float32)
+    for radius, repeats in fill_steps:
+        pad = 3 * radius # gaussian support, pixels further away do not affect masked region
+        py1, px1 = max(y1 - pad, 0), max(x1 - pad, 0)
+        blurred = pyramid_blur(premultiplied[py1:min(y2 + pad, h), px1:min(x2 + pad, w)], radius)
+        blurred = blurred[y1 - py1:y2 - py1, x1 - px1:x2 - px1]
+        transparency = 1 - blurred[:, :, 3:]
+        for _ in range(repeats): # alpha composite of premultiplied colors
+            composite *= transparency
+            composite += blurred
+    color = composite[:, :, :3] / np.maximum(composite[:, :, 3:], 1e-6)
+    rgb = rgb.copy()
+    rgb[y1:y2, x1:x2] = np.clip(color + 0.5, 0, 255).astype(np.uint8)
+    return Image.fromarray(rgb)
 
 
 """
@@ -143,7 +165,9 @@ MODELS = {
 COLORMAP = ['autumn', 'bone', 'jet', 'winter', 'rainbow', 'ocean', 'summer', 'spring', 'cool', 'hsv', 'pink', 'hot', 'parula', 'magma', 'inferno', 'plasma', 'viridis', 'cividis', 'twilight', 'shifted', 'turbo', 'deepgreen']
 TYPES = ['None', 'Opaque', 'Binary', 'Masked', 'Grayscale', 'Color', 'Composite']
 cache_dir = 'models/control/segment'
-generator: MaskGenerationPipeline = None
+sessions = OrderedDict() # model -> [session, last used], keeps sam pipelines and rembg onnx sessions resident between calls
+sessions_lock = threading.Lock()
+sessions_timer: threading.Timer = None
 busy = False
 btn_mask = None
 btn_lama = None
@@ -168,51 +192,160 @@ opts = SimpleNamespace(**{
     'weight_original': 0.5,
     'weight_mask': 0.5,
     'kernel_iterations': 1,
-    'invert': False
+    'invert': False,
+    'session_idle': 600, # seconds before unused segmentation model is unloaded
+    'session_max': 2,
 })
 
 
+def evict_sessions(keep: str = None):
+    """unload sessions not used within idle timeout, callers must look up sessions on every use so no other reference keeps them resident"""
+    with sessions_lock:
+        now = time.time()
+        evicted = [k for k, (_session, used) in sessions.items() if k != keep and now - used > opts.session_idle]
+        for k in evicted:
+            del sessions[k]
+        if len(sessions) > 0:
+            schedule_eviction()
+    if len(evicted) > 0:
+        shared.log.debug(f'Mask segment evict: models={evicted}')
+        devices.torch_gc()
+
+
+def schedule_eviction():
+    global sessions_timer # pylint: disable=global-statement
+    if sessions_timer is not None:
+        sessions_timer.cancel()
+    sessions_timer = threading.Timer(opts.session_idle + 1, evict_sessions)
+    sessions_timer.daemon = True
+    sessions_timer.start()
+
+
+def get_session(name: str, loader):
+    """return resident session for model and mark it as used, unused sessions are evicted after idle timeout and when pool is full"""
+    evict_sessions(keep=name)
+    evicted = []
+    with sessions_lock:
+        item = sessions.get(name, None)
+        metrics.counter('sd_cache_requests_total', 'Cache lookups', cache='mask-session', result='hit' if item is not None else 'miss').inc()
+        if item is None:
+            item = [loader(), time.time()]
+            sessions[name] = item
+        item[1] = time.time()
+        sessions.move_to_end(name)
+        while len(sessions) > max(opts.session_max, 1):
+            evicted.append(sessions.popitem(last=False)[0])
+        schedule_eviction()
+    if len(evicted) > 0:
+        shared.log.debug(f'Mask segment evict: models={evicted}')
+        devices.torch_gc()
+    return item[0]
+
+
+def clear_sessions():
+    global sessions_timer # pylint: disable=global-statement
+    with sessions_lock:
+        sessions.clear()
+        if sessions_timer is not None:
+            sessions_timer.cancel()
+            sessions_timer = None
+    devices.torch_gc()
+
+
+def is_sam():
+    return opts.model is not None and MODELS.get(opts.model, None) is not None and 'Rembg' not in opts.model
+
+
+def get_generator() -> MaskGenerationPipeline:
+    return get_session(opts.model, lambda: load_sam(opts.model))
+
+
+def load_sam(selected_model: str):
+    t0 = time.time()
+    model_path = MODELS[selected_model]
+    shared.log.debug(f'Mask segment loading: model={selected_model} path={model_path}')
+    model = SamModel.from_pretrained(model_path, cache_dir=cache_dir).to(device=devices.device)
+    processor = SamImageProcessor.from_pretrained(model_path, cache_dir=cache_dir)
+    pipeline = MaskGenerationPipeline(
+        model=model,
+        image_processor=processor,
+        device=devices.device,
+        # output_bboxes_mask=False,
+        # output_rle_masks=False,
+    )
+    devices.torch_gc()
+    shared.log.debug(f'Mask segment loaded: model={selected_model} path={model_path} time={time.time()-t0:.2f}s')
+    return pipeline
+
+
+def load_rembg(model_path: str):
+    import rembg
+    if "U2NET_HOME" not in os.environ:
+        os.environ["U2NET_HOME"] = os.path.join(paths.models_path, "Rembg")
+    return rembg.new_session(model_path)
+
+
 def init_model(selected_model: str):
-    global busy, generator # pylint: disable=global-statement
+    global busy # pylint: disable=global-statement
     model_path = MODELS[selected_model]
     if model_path is None: # none
-        if generator is not None:
+        if len(sessions) > 0:
             shared.log.debug('Mask segment unloading model')
         opts.model = None
-        generator = None
-        devices.torch_gc()
+        clear_sessions()
         return selected_model
     if 'Rembg' in selected_model: # rembg
         opts.model = model_path
-        generator = None
         devices.torch_gc()
         return selected_model
-    if opts.model != selected_model or generator is None: # sam pipeline
-        busy = True
-        t0 = time.time()
-        shared.log.debug(f'Mask segment loading: model={selected_model} path={model_path}')
-        model = SamModel.from_pretrained(model_path, cache_dir=cache_dir).to(device=devices.device)
-        processor = SamImageProcessor.from_pretrained(model_path, cache_dir=cache_dir)
-        generator = MaskGenerationPipeline(
-            model=model,
-            image_processor=processor,
-            device=devices.device,
-            # output_bboxes_mask=False,
-            # output_rle_masks=False,
-        )
-        devices.torch_gc()
-        shared.log.debug(f'Mask segment loaded: model={selected_model} path={model_path} time={time.time()-t0:.2f}s')
-        opts.model = selected_model
+    busy = True # sam pipeline is loaded now and looked up in session pool on every use
+    opts.model = selected_model
+    try:
+        get_generator()
+    finally:
         busy = False
     return selected_model
 
 
-def run_segment(input_image: gr.Image, input_mask: np.ndarray):
+def combine_masks(outputs: dict, input_image: Image.Image, input_mask: np.ndarray, chunk: int = 16):
+    """combine top-k candidate masks overlapping input mask into grayscale mask, candidates are scored in stacked chunks until top-k are found"""
+    combined_mask = np.zeros(input_mask.shape, dtype=np.uint8)
+    h, w = input_mask.shape
+    masked = input_mask.any()
+    x1, y1, x2, y2 = get_crop_region(input_mask) if masked else (0, 0, w, h) # overlap can only exist inside input mask bounds
+    region = input_mask[y1:y2, x1:x2] if masked else None
+    weights = ((opts.seg_topK - np.arange(opts.seg_topK)) * (255 // opts.seg_topK)).astype(np.uint8) # set grayscale intensity so we can recolor
+    n, start = 0, 0
+    while start < len(outputs['masks']) and n < opts.seg_topK:
+        size = min(chunk, max(opts.seg_topK - n, 4)) # small top-k does not need to score whole chunk
+        candidates = [np.asarray(mask) for mask in outputs['masks'][start:start+size]]
+        if candidates[0].shape != input_mask.shape: # resize whole chunk in one call using masks as channels
+            stacked = np.stack(candidates, axis=-1).astype(np.uint8)
+            stacked = cv2.resize(stacked, (w, h), interpolation=cv2.INTER_CUBIC).reshape(h, w, -1)
+            candidates = [stacked[:, :, i] for i in range(stacked.shape[-1])]
+        stacked = np.stack([mask[y1:y2, x1:x2] for mask in candidates]) # only masked region is scored
+        stacked = stacked.view(np.uint8) if stacked.dtype == bool else stacked.astype(np.uint8)
+        if region is not None:
+            stacked = np.bitwise_and(stacked, region)
+        selected = np.flatnonzero(stacked.reshape(len(stacked), -1).any(axis=1))[:opts.seg_topK - n]
+        if len(selected) > 0:
+            masks = np.stack([candidates[i] for i in selected])
+            masks = masks.view(np.uint8) if masks.dtype == bool else masks.astype(np.uint8)
+            combined_mask += np.einsum('k,khw->hw', weights[n:n+len(selected)], masks, dtype=np.uint8) # weighted sum with same uint8 wrap-around as sequential accumulation
+        for i in selected:
+            n += 1
+            debug(f'Segment mask: i={n} candidate={start + i} size={input_image.width}x{input_image.height} score={outputs["scores"][start + i]:.2f}')
+        start += size
+    return combined_mask
+
+
+def segment_batch(input_images: List[Image.Image], input_masks: List[np.ndarray]):
+    """run sam on all images in single pipeline call and combine candidate masks per image"""
     outputs = None
     with devices.inference_context():
         try:
-            outputs = generator(
-                input_image,
+            outputs = get_generator()(
+                list(input_images),
                 points_per_batch=opts.seg_points_per_batch,
                 pred_iou_thresh=opts.seg_iou_thresh,
                 stability_score_thresh=opts.seg_score_thresh,
@@ -224,42 +357,25 @@ def run_segment(input_image: gr.Image, input_mask: np.ndarray):
         except Exception as e:
             shared.log.error(f'Mask segment error: {e}')
             errors.display(e, 'Mask segment')
-            return outputs
+            return [None] * len(input_images)
     devices.torch_gc()
-    i = 1
-    combined_mask = np.zeros(input_mask.shape, dtype='uint8')
-    input_mask_size = np.count_nonzero(input_mask)
-    debug(f'Segment SAM: {vars(opts)}')
-    for mask in outputs['masks']:
-        mask = mask.astype('uint8')
-        mask_size = np.count_nonzero(mask)
-        if mask_size == 0:
-            continue
-        overlap = 0
-        if input_mask_size > 0:
-            if mask.shape != input_mask.shape:
-                mask = cv2.resize(mask, (input_mask.shape[1], input_mask.shape[0]), interpolation=cv2.INTER_CUBIC)
-            overlap = cv2.bitwise_and(mask, input_mask)
-            overlap = np.count_nonzero(overlap)
-            if overlap == 0:
-                continue
-        mask = (opts.seg_topK + 1 - i) * mask * (255 // opts.seg_topK) # set grayscale intensity so we can recolor
-        combined_mask = combined_mask + mask
-        debug(f'Segment mask: i={i} size={input_image.width}x{input_image.height} masked={mask_size}px overlap={overlap} score={outputs["scores"][i-1]:.2f}')
-        i += 1
-        if i > opts.seg_topK:
-            break
-    return combined_mask
+    if isinstance(outputs, dict):
+        outputs = [outputs]
+    debug(f'Segment SAM: images={len(input_images)} {vars(opts)}')
+    return [combine_masks(output, image, mask) for output, image, mask in zip(outputs, input_images, input_masks)]
+
+
+def run_segment(input_image: gr.Image, input_mask: np.ndarray):
+    return segment_batch([input_image], [input_mask])[0]
 
 
 def run_rembg(input_image: Image, input_mask: np.ndarray):
     try:
         import rembg
+        session = get_session(opts.model, lambda: load_rembg(opts.model))
     except Exception as e:
         shared.log.error(f'Mask Rembg load failed: {e}')
         return input_mask
-    if "U2NET_HOME" not in os.environ:
-        os.environ["U2NET_HOME"] = os.path.join(paths.models_path, "Rembg")
     args = {
         'data': input_image,
         'only_mask': True,
@@ -269,7 +385,7 @@ def run_rembg(input_image: Image, input_mask: np.ndarray):
         'alpha_matting_foreground_threshold': 240,
         'alpha_matting_background_threshold': 10,
         'alpha_matting_erode_size': int(opts.mask_erode * 40),
-        'session': rembg.new_session(opts.model),
+        'session': session,
     }
     mask = rembg.remove(**args)
     mask = np.array(mask)
@@ -371,43 +487,8 @@ def outpaint(input_image: Image.Image, outpaint_type: str = 'Edge'):
     return image, mask
 
 
-def run_mask(input_image: Image.Image, input_mask: Image.Image = None, return_type: str = None, mask_blur: int = None, mask_padding: int = None, segment_enable=True, invert=None):
-    debug(f'Run mask: fn={sys._getframe(1).f_code.co_name}') # pylint: disable=protected-access
-
-    if input_image is None:
-        return input_mask
-    if isinstance(input_image, list):
-        input_image = input_image[0]
-    if isinstance(input_image, dict):
-        input_mask = input_image.get('mask', None)
-        input_image = input_image.get('image', None)
-    if input_image is None:
-        return input_mask
-
-    t0 = time.time()
-    input_mask = get_mask(input_image, input_mask) # perform optional auto-masking
-    if input_mask is None:
-        return None
-
-    size = min(input_image.width, input_image.height)
-    if mask_blur is not None or mask_padding is not None:
-        debug(f'Mask args legacy: blur={mask_blur} padding={mask_padding}')
-    if invert is not None:
-        opts.invert = invert
-    if mask_blur is not None: # compatibility with old img2img values which uses px values
-        opts.mask_blur = round(4 * mask_blur / size, 3)
-    if mask_padding is not None: # compatibility with old img2img values which uses px values
-        opts.mask_dilate = 4 * mask_padding / size
-
-    if opts.model is None or not segment_enable:
-        mask = input_mask
-    elif generator is None:
-        mask = run_rembg(input_image, input_mask)
-    else:
-        mask = run_segment(input_image, input_mask)
-    mask = cv2.resize(mask, (input_image.width, input_image.height), interpolation=cv2.INTER_LINEAR)
-
-    debug(f'Mask shape={mask.shape} opts={opts}')
+def process_mask(mask: np.ndarray, size: int):
+    """erode, dilate, blur and invert mask, mask can be (h, w) or same-size masks stacked as (h, w, n) which are processed in single call"""
     if opts.mask_erode > 0:
         try:
             kernel = np.ones((int(opts.mask_erode * size / 4) + 1, int(opts.mask_erode * size / 4) + 1), np.uint8)
@@ -431,15 +512,10 @@ def run_mask(input_image: Image.Image, input_mask: Image.Image = None, return_ty
             shared.log.error(f'Mask blur: {e}')
     if opts.invert:
         mask = np.invert(mask)
+    return mask
 
-    mask_size = np.count_nonzero(mask)
-    total_size = np.prod(mask.shape)
-    area_size = np.count_nonzero(mask)
-    t1 = time.time()
 
-    return_type = return_type or opts.preview_type
-
-    shared.log.debug(f'Mask: size={input_image.width}x{input_image.height} masked={mask_size}px area={area_size/total_size:.2f} auto={opts.auto_mask} blur={opts.mask_blur} erode={opts.mask_erode} dilate={opts.mask_dilate} type={return_type} time={t1-t0:.2f}')
+def output_mask(input_image: Image.Image, input_mask, mask: np.ndarray, return_type: str):
     if return_type == 'None':
         return input_mask
     elif return_type == 'Opaque':
@@ -468,6 +544,76 @@ def run_mask(input_image: Image.Image, input_mask: Image.Image = None, return_ty
     return input_mask
 
 
+def run_mask(input_image: Image.Image, input_mask: Image.Image = None, return_type: str = None, mask_blur: int = None, mask_padding: int = None, segment_enable=True, invert=None):
+    debug(f'Run mask: fn={sys._getframe(1).f_code.co_name}') # pylint: disable=protected-access
+
+    if input_image is None:
+        return input_mask
+    if isinstance(input_image, list):
+        input_image = input_image[0]
+    if isinstance(input_image, dict):
+        input_mask = input_image.get('mask', None)
+        input_image = input_image.get('image', None)
+    if input_image is None:
+        return input_mask
+    return run_mask_batch([input_image], [input_mask], return_type=return_type, mask_blur=mask_blur, mask_padding=mask_padding, segment_enable=segment_enable, invert=invert)[0]
+
+
+def run_mask_batch(input_images: List[Image.Image], input_masks: List[Image.Image] = None, return_type: str = None, mask_blur: int = None, mask_padding: int = None, segment_enable=True, invert=None):
+    """process masks for list of images, masks of same size are eroded, dilated and blurred together in one call"""
+    if input_images is None or len(input_images) == 0:
+        return []
+    t0 = time.time()
+    input_masks = input_masks or [None] * len(input_images)
+    masks = [get_mask(image, mask) for image, mask in zip(input_images, input_masks)] # perform optional auto-masking
+    size = min(input_images[0].width, input_images[0].height)
+    if mask_blur is not None or mask_padding is not None:
+        debug(f'Mask args legacy: blur={mask_blur} padding={mask_padding}')
+    if invert is not None:
+        opts.invert = invert
+    if mask_blur is not None: # compatibility with old img2img values which uses px values
+        opts.mask_blur = round(4 * mask_blur / size, 3)
+    if mask_padding is not None: # compatibility with old img2img values which uses px values
+        opts.mask_dilate = 4 * mask_padding / size
+
+    indices = [i for i, mask in enumerate(masks) if mask is not None]
+    if opts.model is None or not segment_enable or len(indices) == 0:
+        pass
+    elif not is_sam():
+        for i in indices:
+            masks[i] = run_rembg(input_images[i], masks[i])
+    else:
+        segmented = segment_batch([input_images[i] for i in indices], [masks[i] for i in indices])
+        for i, mask in zip(indices, segmented):
+            masks[i] = mask if mask is not None else masks[i]
+    groups = {}
+    for i in indices:
+        image = input_images[i]
+        masks[i] = cv2.resize(masks[i], (image.width, image.height), interpolation=cv2.INTER_LINEAR)
+        groups.setdefault((image.width, image.height), []).append(i)
+    for (width, height), indices in groups.items():
+        debug(f'Mask shape={(height, width)} batch={len(indices)} opts={opts}')
+        if len(indices) == 1:
+            masks[indices[0]] = process_mask(masks[indices[0]], min(width, height))
+        else:
+            processed = process_mask(np.stack([masks[i] for i in indices], axis=-1), min(width, height))
+            for j, i in enumerate(indices):
+                masks[i] = np.ascontiguousarray(processed[:, :, j])
+    t1 = time.time()
+
+    return_type = return_type or opts.preview_type
+    res = []
+    for image, input_mask, mask in zip(input_images, input_masks, masks):
+        if mask is None:
+            res.append(None)
+            continue
+        total_size = np.prod(mask.shape)
+        area_size = np.count_nonzero(mask)
+        shared.log.debug(f'Mask: size={image.width}x{image.height} masked={area_size}px area={area_size/total_size:.2f} auto={opts.auto_mask} blur={opts.mask_blur} erode={opts.mask_erode} dilate={opts.mask_dilate} type={return_type} time={t1-t0:.2f}')
+        res.append(output_mask(image, input_mask, mask, return_type))
+    return res
+
+
 def run_lama(input_image: gr.Image, input_mask: gr.Image = None):
     global lama_model # pylint: disable=global-statement
     if isinstance(input_image, dict):
@@ -0,0 +1,141 @@
+import threading
+
+
+lock = threading.Lock()
+histograms = {}
+counters = {}
+gauges = {} # name -> (description, callable) evaluated only when metrics are scraped
+time_buckets = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120, 300]
+memory_buckets = [256, 512, 1024, 2048, 4096, 6144, 8192, 12288, 16384, 24576, 32768, 49152, 65536, 81920] # MB
+
+
+class Histogram:
+    """cumulative histogram with fixed upper bounds, last bucket counts everything above largest bound"""
+    def __init__(self, name: str, description: str = '', buckets: list = None, labels: dict = None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.buckets = list(buckets or time_buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        with lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def dict(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ['+Inf'], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return { 'name': self.name, 'labels': self.labels, 'count': self.count, 'sum': round(self.sum, 4), 'buckets': buckets }
+
+
+class Counter:
+    """monotonic counter, increment is a single locked add so it is cheap enough for hot paths"""
+    def __init__(self, name: str, description: str = '', labels: dict = None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        with lock:
+            self.value += amount
+
+
+def counter(name: str, description: str = '', **labels) -> Counter:
+    key = (name, tuple(sorted(labels.items())))
+    c = counters.get(key, None)
+    if c is None:
+        with lock:
+            c = counters.setdefault(key, Counter(name, description, labels))
+    return c
+
+
+def gauge(name: str, description: str, fn):
+    """register callable returning value or dict of {labels-dict-as-tuple: value}, called only on scrape"""
+    gauges[name] = (description, fn)
+
+
+def histogram(name: str, description: str = '', buckets: list = None, **labels) -> Histogram:
+    key = (name, tuple(sorted(labels.items())))
+    h = histograms.get(key, None)
+    if h is None:
+        with lock:
+            h = histograms.setdefault(key, Histogram(name, description, buckets, labels))
+    return h
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels: dict, extra: dict = None):
+    items = list(labels.items()) + list((extra or {}).items())
+    if len(items) == 0:
+        return ''
+    values = ','.join(f'{k}="{escape(v)}"' for k, v in items)
+    return '{' + values + '}'
+
+
+def render():
+    """export all metrics in prometheus text exposition format"""
+    lines = []
+    described = set()
+    def describe(name, description, typ):
+        if name not in described:
+            described.add(name)
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {typ}')
+    for c in sorted(list(counters.values()), key=lambda x: x.name):
+        describe(c.name, c.description, 'counter')
+        lines.append(f'{c.name}{format_labels(c.labels)} {c.value}')
+    for name, (description, fn) in sorted(gauges.items()):
+        try:
+            value = fn()
+        except Exception:
+            continue
+        if value is None:
+            continue
+        describe(name, description, 'gauge')
+        if isinstance(value, dict):
+            for labels, v in value.items():
+                lines.append(f'{name}{format_labels(dict(labels))} {v}')
+        else:
+            lines.append(f'{name} {value}')
+    for h in sorted(list(histograms.values()), key=lambda x: x.name):
+        describe(h.name, h.description, 'histogram')
+        cumulative = 0
+        for bound, count in zip(h.buckets + ['+Inf'], h.counts):
+            cumulative += count
+            lines.append(f'{h.name}_bucket{format_labels(h.labels, {"le": bound})} {cumulative}')
+        lines.append(f'{h.name}_sum{format_labels(h.labels)} {h.sum}')
+        lines.append(f'{h.name}_count{format_labels(h.labels)} {h.count}')
+    return '\n'.join(lines) + '\n'
+
+
+def memory():
+    from modules import shared
+    data = shared.mem_mon.read() if shared.mem_mon is not None else {}
+    return { (('type', k),): v for k, v in data.items() if k in ['free', 'total', 'used', 'reserved', 'active_peak', 'reserved_peak'] } or None # active is a block count, exported separately
+
+
+def cuda_counter(key):
+    def fn():
+        from modules import shared
+        return shared.mem_mon.read().get(key, None) if shared.mem_mon is not None else None
+    return fn
+
+
+gauge('sd_memory_bytes', 'GPU memory by type', memory)
+gauge('sd_cuda_active_blocks', 'Active CUDA allocator memory blocks', cuda_counter('active'))
+gauge('sd_cuda_alloc_retries', 'CUDA allocator retries after cache flush', cuda_counter('retries'))
+gauge('sd_cuda_ooms', 'CUDA out-of-memory errors', cuda_counter('oom'))
@@ -8,6 +8,7 @@ import optimum.onnxruntime
 
 
 initialized = False
+olive_initialized = False
 run_olive_workflow = None
 
 
@@ -243,12 +244,19 @@ def initialize_onnx():
 
 
 def initialize_olive():
-    global run_olive_workflow # pylint: disable=global-statement
+    """loads olive-ai on first use instead of at startup, returns workflow runner or None if unavailable"""
+    global run_olive_workflow, olive_initialized # pylint: disable=global-statement
+    if olive_initialized:
+        return run_olive_workflow
+    olive_initialized = True
     from installer import installed, log
     if not installed('olive-ai', quiet=True) or not installed('onnx', quiet=True):
-        return
+        return None
     import sys
+    import time
     import importlib
+    from modules import timer
+    t0 = time.time()
     orig_sys_path = sys.path
     venv_dir = os.environ.get("VENV_DIR", os.path.join(os.getcwd(), 'venv'))
     try:
@@ -262,6 +270,8 @@ def initialize_olive():
         run_olive_workflow = None
         log.error(f'Olive: Failed to load olive-ai: {e}')
     sys.path = orig_sys_path
+    timer.startup.add('olive', time.time() - t0)
+    return run_olive_workflow
 
 
 def install_olive():
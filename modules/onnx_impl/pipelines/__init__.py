@@ -15,7 +15,7 @@ from modules.paths import sd_configs_path, models_path
 from modules.sd_models import CheckpointInfo
 from modules.processing import StableDiffusionProcessing
 from modules.olive_script import config
-from modules.onnx_impl import DynamicSessionOptions, TorchCompatibleModule, VAE, run_olive_workflow
+from modules.onnx_impl import DynamicSessionOptions, TorchCompatibleModule, VAE, initialize_olive
 from modules.onnx_impl.utils import extract_device, move_inference_session, check_diffusers_cache, check_pipeline_sdxl, check_cache_onnx, load_init_dict, load_submodel, load_submodels, patch_kwargs, load_pipeline, get_base_constructor, get_io_config
 from modules.onnx_impl.execution_providers import ExecutionProvider, EP_TO_NAME, get_provider
 
@@ -255,7 +255,7 @@ class OnnxRawPipeline(PipelineBase):
                         if float16:
                             olive_config["passes"][pass_key]["config"]["keep_io_types"] = False
 
-            run_olive_workflow(olive_config)
+            initialize_olive()(olive_config)
 
             with open(os.path.join("footprints", f"{submodel}_{EP_TO_NAME[shared.opts.onnx_execution_provider]}_footprints.json"), "r", encoding="utf-8") as footprint_file:
                 footprints = json.load(footprint_file)
@@ -367,7 +367,7 @@ class OnnxRawPipeline(PipelineBase):
         in_dir = out_dir
 
         if shared.opts.cuda_compile_backend == "olive-ai":
-            if run_olive_workflow is None:
+            if initialize_olive() is None:
                 log.warning('Olive: Skipping model compilation because olive-ai was loaded unsuccessfully.')
             else:
                 submodels_for_olive = []
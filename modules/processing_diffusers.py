@@ -8,7 +8,7 @@ import numpy as np
 import torch
 import torchvision.transforms.functional as TF
 import diffusers
-from modules import shared, devices, processing, sd_samplers, sd_models, images, errors, prompt_parser_diffusers, sd_hijack_hypertile, processing_correction, processing_vae, sd_models_compile, extra_networks
+from modules import shared, devices, processing, sd_samplers, sd_models, images, errors, prompt_parser_diffusers, sd_hijack_hypertile, processing_correction, processing_vae, sd_models_compile, extra_networks, tracing
 from modules.processing_helpers import resize_init_images, resize_hires, fix_prompts, calculate_base_steps, calculate_hires_steps, calculate_refiner_steps
 from modules.onnx_impl import preprocess_pipeline as preprocess_onnx_pipeline, check_parameters_changed as olive_check_parameters_changed
 
@@ -51,6 +51,7 @@ def process_diffusers(p: processing.StableDiffusionProcessing):
             latents = torch.from_numpy(latents)
         shared.state.sampling_step = step
         shared.state.current_latent = latents
+        tracing.step()
         latents = processing_correction.correction_callback(p, timestep, {'latents': latents})
         if shared.state.interrupted or shared.state.skipped:
             raise AssertionError('Interrupted...')
@@ -65,6 +66,7 @@ def process_diffusers(p: processing.StableDiffusionProcessing):
         latents = kwargs.get('latents', None)
         debug_callback(f'Callback: step={step} timestep={timestep} latents={latents.shape if latents is not None else None} kwargs={list(kwargs)}')
         shared.state.sampling_step = step
+        tracing.step()
         if shared.state.interrupted or shared.state.skipped:
             raise AssertionError('Interrupted...')
         if shared.state.paused:
@@ -198,7 +200,8 @@ def process_diffusers(p: processing.StableDiffusionProcessing):
         steps = kwargs.get("num_inference_steps", 1)
         if shared.opts.prompt_attention != 'Fixed attention' and 'StableDiffusion' in model.__class__.__name__ and 'Onnx' not in model.__class__.__name__:
             try:
-                prompt_parser_diffusers.encode_prompts(model, p, prompts, negative_prompts, steps=steps, clip_skip=clip_skip)
+                with tracing.stage('prompt'):
+                    prompt_parser_diffusers.encode_prompts(model, p, prompts, negative_prompts, steps=steps, clip_skip=clip_skip)
                 parser = shared.opts.prompt_attention
             except Exception as e:
                 shared.log.error(f'Prompt parser encode: {e}')
@@ -423,7 +426,8 @@ def process_diffusers(p: processing.StableDiffusionProcessing):
         t0 = time.time()
         sd_models_compile.check_deepcache(enable=True)
         sd_models.move_model(shared.sd_model, devices.device)
-        output = shared.sd_model(**base_args) # pylint: disable=not-callable
+        with tracing.stage('denoise-base'):
+            output = shared.sd_model(**base_args) # pylint: disable=not-callable
         if isinstance(output, dict):
             output = SimpleNamespace(**output)
         sd_models_compile.openvino_post_compile(op="base") # only executes on compiled vino models
@@ -476,7 +480,8 @@ def process_diffusers(p: processing.StableDiffusionProcessing):
             if shared.opts.save and not p.do_not_save_samples and shared.opts.save_images_before_highres_fix and hasattr(shared.sd_model, 'vae'):
                 save_intermediate(latents=output.images, suffix="-before-hires")
             shared.state.job = 'upscale'
-            output.images = resize_hires(p, latents=output.images)
+            with tracing.stage('hires-upscale'):
+                output.images = resize_hires(p, latents=output.images)
             sd_hijack_hypertile.hypertile_set(p, hr=True)
 
         latent_upscale = shared.latent_upscale_modes.get(p.hr_upscaler, None)
@@ -520,7 +525,8 @@ def process_diffusers(p: processing.StableDiffusionProcessing):
             shared.state.sampling_steps = hires_args['num_inference_steps']
             try:
                 sd_models_compile.check_deepcache(enable=True)
-                output = shared.sd_model(**hires_args) # pylint: disable=not-callable
+                with tracing.stage('denoise-hires'):
+                    output = shared.sd_model(**hires_args) # pylint: disable=not-callable
                 if isinstance(output, dict):
                     output = SimpleNamespace(**output)
                 sd_models_compile.check_deepcache(enable=False)
@@ -585,7 +591,8 @@ def process_diffusers(p: processing.StableDiffusionProcessing):
             try:
                 if 'requires_aesthetics_score' in shared.sd_refiner.config: # sdxl-model needs false and sdxl-refiner needs true
                     shared.sd_refiner.register_to_config(requires_aesthetics_score = getattr(shared.sd_refiner, 'tokenizer', None) is None)
-                refiner_output = shared.sd_refiner(**refiner_args) # pylint: disable=not-callable
+                with tracing.stage('denoise-refiner'):
+                    refiner_output = shared.sd_refiner(**refiner_args) # pylint: disable=not-callable
                 if isinstance(refiner_output, dict):
                     refiner_output = SimpleNamespace(**refiner_output)
                 sd_models_compile.openvino_post_compile(op="refiner")
@@ -9,7 +9,7 @@ import cv2
 from PIL import Image
 from skimage import exposure
 from blendmodes.blend import blendLayers, BlendType
-from modules import shared, devices, images, sd_models, sd_samplers, sd_hijack_hypertile, processing_vae
+from modules import shared, devices, images, sd_models, sd_samplers, sd_hijack_hypertile, processing_vae, tracing, rng
 
 
 debug = shared.log.trace if os.environ.get('SD_PROCESS_DEBUG', None) is not None else lambda *args, **kwargs: None
@@ -105,7 +105,6 @@ def slerp(val, low, high): # from https://discuss.pytorch.org/t/help-regarding-s
 
 def create_random_tensors(shape, seeds, subseeds=None, subseed_strength=0.0, seed_resize_from_h=0, seed_resize_from_w=0, p=None):
     eta_noise_seed_delta = shared.opts.eta_noise_seed_delta or 0
-    xs = []
     # if we have multiple seeds, this means we are working with batch size>1; this then
     # enables the generation of additional tensors with noise that the sampler will use during its processing.
     # Using those pre-generated tensors instead of simple torch.randn allows a batch with seeds [100, 101] to
@@ -114,44 +113,39 @@ def create_random_tensors(shape, seeds, subseeds=None, subseed_strength=0.0, see
         sampler_noises = [[] for _ in range(p.sampler.number_of_needed_noises(p))]
     else:
         sampler_noises = None
-    for i, seed in enumerate(seeds):
-        noise_shape = shape if seed_resize_from_h <= 0 or seed_resize_from_w <= 0 else (shape[0], seed_resize_from_h//8, seed_resize_from_w//8)
-        subnoise = None
-        if subseeds is not None:
-            subseed = 0 if i >= len(subseeds) else subseeds[i]
-            subnoise = devices.randn(subseed, noise_shape)
-        # randn results depend on device; gpu and cpu get different results for same seed;
-        # the way I see it, it's better to do this on CPU, so that everyone gets same result;
-        # but the original script had it like this, so I do not dare change it for now because
-        # it will break everyone's seeds.
-        noise = devices.randn(seed, noise_shape)
-        if subnoise is not None:
-            noise = slerp(subseed_strength, noise, subnoise)
-        if noise_shape != shape:
-            x = devices.randn(seed, shape)
-            dx = (shape[2] - noise_shape[2]) // 2
-            dy = (shape[1] - noise_shape[1]) // 2
-            w = noise_shape[2] if dx >= 0 else noise_shape[2] + 2 * dx
-            h = noise_shape[1] if dy >= 0 else noise_shape[1] + 2 * dy
-            tx = 0 if dx < 0 else dx
-            ty = 0 if dy < 0 else dy
-            dx = max(-dx, 0)
-            dy = max(-dy, 0)
-            x[:, ty:ty+h, tx:tx+w] = noise[:, dy:dy+h, dx:dx+w]
-            noise = x
-        if sampler_noises is not None:
-            cnt = p.sampler.number_of_needed_noises(p)
-            if eta_noise_seed_delta > 0:
-                torch.manual_seed(seed + eta_noise_seed_delta)
-            for j in range(cnt):
-                sampler_noises[j].append(devices.randn_without_seed(tuple(noise_shape)))
-        xs.append(noise)
+    noise_shape = shape if seed_resize_from_h <= 0 or seed_resize_from_w <= 0 else (shape[0], seed_resize_from_h//8, seed_resize_from_w//8)
+    # noise is drawn from per-request generators so concurrent requests do not share global rng state
+    noises = rng.ImageRNG(noise_shape, seeds)
+    noise = noises.next()
+    if subseeds is not None:
+        subnoise = rng.randn_batch([0 if i >= len(subseeds) else subseeds[i] for i in range(len(seeds))], noise_shape)
+        noise = torch.stack([slerp(subseed_strength, n, s) for n, s in zip(noise, subnoise)])
+    if noise_shape != shape:
+        noises = rng.ImageRNG(shape, seeds) # reseeded for full size noise, sampler noises continue from it
+        x = noises.next()
+        dx = (shape[2] - noise_shape[2]) // 2
+        dy = (shape[1] - noise_shape[1]) // 2
+        w = noise_shape[2] if dx >= 0 else noise_shape[2] + 2 * dx
+        h = noise_shape[1] if dy >= 0 else noise_shape[1] + 2 * dy
+        tx = 0 if dx < 0 else dx
+        ty = 0 if dy < 0 else dy
+        dx = max(-dx, 0)
+        dy = max(-dy, 0)
+        x[:, :, ty:ty+h, tx:tx+w] = noise[:, :, dy:dy+h, dx:dx+w]
+        noise = x
     if sampler_noises is not None:
-        p.sampler.sampler_noises = [torch.stack(n).to(shared.device) for n in sampler_noises]
-    x = torch.stack(xs).to(shared.device)
-    return x
-
-
+        cnt = p.sampler.number_of_needed_noises(p)
+        if eta_noise_seed_delta > 0:
+            noises = rng.ImageRNG(noise_shape, [seed + eta_noise_seed_delta for seed in seeds])
+        for j in range(cnt):
+            sampler_noises[j] = noises.next(noise_shape)
+        p.sampler.sampler_noises = [n.to(shared.device) for n in sampler_noises]
+    if p is not None and p.sampler is not None: # any further sampler noise continues from request generators same as it did from reseeded global rng
+        p.sampler.sampler_rng = noises
+    return noise.to(shared.device)
+
+
+@tracing.traced('vae')
 def decode_first_stage(model, x, full_quality=True):
     if not shared.opts.keep_incomplete and (shared.state.skipped or shared.state.interrupted):
         shared.log.debug(f'Decode VAE: skipped={shared.state.skipped} interrupted={shared.state.interrupted}')
@@ -346,7 +340,7 @@ def resize_init_images(p):
     return p.width, p.height
 
 
-def resize_hires(p, latents): # input=latents output=pil
+def resize_hires(p, latents): # input=latents output=pil, or latents when latent upscaler is used and latent resident hires is enabled
     if not torch.is_tensor(latents):
         shared.log.warning('Hires: input is not tensor')
         first_pass_images = processing_vae.vae_decode(latents=latents, model=shared.sd_model, full_quality=p.full_quality, output_type='pil')
@@ -355,6 +349,8 @@ def resize_hires(p, latents): # input=latents output=pil
     # shared.log.info(f'Hires: upscaler={p.hr_upscaler} width={p.hr_upscale_to_x} height={p.hr_upscale_to_y} images={latents.shape[0]}')
     if latent_upscaler is not None:
         latents = torch.nn.functional.interpolate(latents, size=(p.hr_upscale_to_y // 8, p.hr_upscale_to_x // 8), mode=latent_upscaler["mode"], antialias=latent_upscaler["antialias"])
+        if shared.opts.hires_latent_resident and hasattr(shared.sd_model, 'vae') and shared.sd_model.__class__.__name__ != "OnnxRawPipeline":
+            return latents # img2img pipelines use 4-channel image input as initial latents so decode happens only once at the end
     first_pass_images = processing_vae.vae_decode(latents=latents, model=shared.sd_model, full_quality=p.full_quality, output_type='pil')
     resized_images = []
     for img in first_pass_images:
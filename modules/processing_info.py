@@ -109,6 +109,7 @@ def create_infotext(p: StableDiffusionProcessing, all_prompts=None, all_seeds=No
         args["Embeddings"] = ', '.join(sd_hijack.model_hijack.embedding_db.embeddings_used)
     # samplers
     args["Sampler ENSD"] = shared.opts.eta_noise_seed_delta if shared.opts.eta_noise_seed_delta != 0 and sd_samplers_common.is_sampler_using_eta_noise_seed_delta(p) else None
+    args["RNG"] = shared.opts.randn_source if shared.opts.randn_source != 'GPU' and shared.backend == shared.Backend.ORIGINAL else None
     args["Sampler ENSM"] = p.initial_noise_multiplier if getattr(p, 'initial_noise_multiplier', 1.0) != 1.0 else None
     args['Sampler order'] = shared.opts.schedulers_solver_order if shared.opts.schedulers_solver_order != shared.opts.data_labels.get('schedulers_solver_order').default else None
     if shared.backend == shared.Backend.DIFFUSERS:
@@ -137,7 +138,5 @@ def create_infotext(p: StableDiffusionProcessing, all_prompts=None, all_seeds=No
     args['ToMe hires'] = token_merging_ratio_hr if token_merging_ratio_hr != 0 else None
 
     args.update(p.extra_generation_params)
-    params_text = ", ".join([k if k == v else f'{k}: {generation_parameters_copypaste.quote(v)}' for k, v in args.items() if v is not None])
-    negative_prompt_text = f"\nNegative prompt: {all_negative_prompts[index]}" if all_negative_prompts[index] else ""
-    infotext = f"{all_prompts[index]}{negative_prompt_text}\n{params_text}".strip()
+    infotext = generation_parameters_copypaste.join_infotext(all_prompts[index], all_negative_prompts[index], args)
     return infotext
@@ -1,7 +1,7 @@
 import torch
 import numpy as np
 from PIL import Image
-from modules import shared, devices, processing, images, sd_models, sd_vae, sd_samplers, processing_helpers, prompt_parser
+from modules import shared, devices, processing, images, sd_models, sd_vae, sd_samplers, processing_helpers, prompt_parser, tracing
 from modules.sd_hijack_hypertile import hypertile_set
 
 
@@ -33,8 +33,9 @@ def process_original(p: processing.StableDiffusionProcessing):
     cached_c = [None, None]
     sampler_config = sd_samplers.find_sampler_config(p.sampler_name)
     step_multiplier = 2 if sampler_config and sampler_config.options.get("second_order", False) else 1
-    uc = get_conds_with_caching(prompt_parser.get_learned_conditioning, p.negative_prompts, p.steps * step_multiplier, cached_uc)
-    c = get_conds_with_caching(prompt_parser.get_multicond_learned_conditioning, p.prompts, p.steps * step_multiplier, cached_c)
+    with tracing.stage('prompt'):
+        uc = get_conds_with_caching(prompt_parser.get_learned_conditioning, p.negative_prompts, p.steps * step_multiplier, cached_uc)
+        c = get_conds_with_caching(prompt_parser.get_multicond_learned_conditioning, p.prompts, p.steps * step_multiplier, cached_c)
     with devices.without_autocast() if devices.unet_needs_upcast else devices.autocast():
         samples_ddim = p.sample(conditioning=c, unconditional_conditioning=uc, seeds=p.seeds, subseeds=p.subseeds, subseed_strength=p.subseed_strength, prompts=p.prompts)
     x_samples_ddim = [processing.decode_first_stage(p.sd_model, samples_ddim[i:i+1].to(dtype=devices.dtype_vae), p.full_quality)[0].cpu() for i in range(samples_ddim.size(0))]
@@ -73,7 +74,8 @@ def sample_txt2img(p: processing.StableDiffusionProcessingTxt2Img, conditioning,
     if hasattr(p.sampler, "initialize"):
         p.sampler.initialize(p)
     x = create_random_tensors([4, p.height // 8, p.width // 8], seeds=seeds, subseeds=subseeds, subseed_strength=p.subseed_strength, seed_resize_from_h=p.seed_resize_from_h, seed_resize_from_w=p.seed_resize_from_w, p=p)
-    samples = p.sampler.sample(p, x, conditioning, unconditional_conditioning, image_conditioning=txt2img_image_conditioning(p, x))
+    with tracing.stage('denoise-base'):
+        samples = p.sampler.sample(p, x, conditioning, unconditional_conditioning, image_conditioning=txt2img_image_conditioning(p, x))
     shared.state.nextjob()
     if not p.enable_hr or shared.state.interrupted or shared.state.skipped:
         return samples
@@ -137,7 +139,8 @@ def sample_txt2img(p: processing.StableDiffusionProcessingTxt2Img, conditioning,
                 noise = create_random_tensors(samples.shape[1:], seeds=seeds, subseeds=subseeds, subseed_strength=subseed_strength, p=p)
                 sd_models.apply_token_merging(p.sd_model, p.get_token_merging_ratio(for_hr=True))
                 hypertile_set(p, hr=True)
-                samples = p.sampler.sample_img2img(p, samples, noise, conditioning, unconditional_conditioning, steps=p.hr_second_pass_steps or p.steps, image_conditioning=image_conditioning)
+                with tracing.stage('denoise-hires'):
+                    samples = p.sampler.sample_img2img(p, samples, noise, conditioning, unconditional_conditioning, steps=p.hr_second_pass_steps or p.steps, image_conditioning=image_conditioning)
                 sd_models.apply_token_merging(p.sd_model, p.get_token_merging_ratio())
             else:
                 p.ops.append('upscale')
@@ -153,7 +156,8 @@ def sample_img2img(p, conditioning, unconditional_conditioning, seeds, subseeds,
     hypertile_set(p)
     x = create_random_tensors([4, p.height // 8, p.width // 8], seeds=seeds, subseeds=subseeds, subseed_strength=p.subseed_strength, seed_resize_from_h=p.seed_resize_from_h, seed_resize_from_w=p.seed_resize_from_w, p=p)
     x *= p.initial_noise_multiplier
-    samples = p.sampler.sample_img2img(p, p.init_latent, x, conditioning, unconditional_conditioning, image_conditioning=p.image_conditioning)
+    with tracing.stage('denoise-base'):
+        samples = p.sampler.sample_img2img(p, p.init_latent, x, conditioning, unconditional_conditioning, image_conditioning=p.image_conditioning)
     if p.mask is not None:
         samples = samples * p.nmask + p.init_latent * p.mask
     del x
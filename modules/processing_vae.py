@@ -2,7 +2,7 @@ import os
 import time
 import torch
 import torchvision.transforms.functional as TF
-from modules import shared, devices, sd_models, sd_vae, sd_vae_taesd
+from modules import shared, devices, sd_models, sd_vae, sd_vae_taesd, tracing, metrics
 
 
 debug = shared.log.trace if os.environ.get('SD_VAE_DEBUG', None) is not None else lambda *args, **kwargs: None
@@ -106,6 +106,7 @@ def taesd_vae_encode(image):
     return encoded
 
 
+@tracing.traced('vae')
 def vae_decode(latents, model, output_type='np', full_quality=True):
     t0 = time.time()
     prev_job = shared.state.job
@@ -137,8 +138,10 @@ def vae_decode(latents, model, output_type='np', full_quality=True):
         image_processor = diffusers.image_processor.VaeImageProcessor()
         imgs = image_processor.postprocess(decoded, output_type=output_type)
     shared.state.job = prev_job
+    t1 = time.time()
+    metrics.counter('sd_vae_decode_total', 'VAE decode calls').inc()
+    metrics.counter('sd_vae_decode_seconds_total', 'VAE decode time').inc(t1 - t0)
     if shared.cmd_opts.profile:
-        t1 = time.time()
         shared.log.debug(f'Profile: VAE decode: {t1-t0:.2f}')
     return imgs
 
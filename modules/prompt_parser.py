@@ -9,11 +9,12 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 import os
 import re
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from typing import List
 import lark
 import torch
 from compel import Compel
+from modules import metrics
 from modules.shared import opts, log, backend, Backend
 
 # a prompt like this: "fantasy landscape with a [mountain:lake:0.25] and [an oak:a christmas tree:0.75][ in foreground::0.6][ in background:0.25] [shoddy:masterful:0.5]"
@@ -42,6 +43,25 @@ WHITESPACE: /\s+/
 plain: /([^\\\[\]():|]|\\.)+/
 %import common.SIGNED_NUMBER -> NUMBER
 """)
+# unambiguous variant of schedule grammar for linear-time lalr parsing: square brackets are parsed generically and resolved into scheduled/alternate/emphasized nodes afterwards
+# anything lalr cannot resolve exactly as earley would (stray brackets, non-numeric schedule, etc.) falls back to earley parser
+schedule_grammar_lalr = r"""
+start: (item | COLON)*
+prompt: item*
+?item: emphasized | square | plain
+!emphasized: "(" prompt ")"
+        | "(" prompt COLON prompt ")"
+!square: "[" prompt (COLON prompt)* "]"
+        | "[" prompt ("|" prompt)+ "]"
+plain: /([^\\\[\]():|]|\\.)+/
+COLON: ":"
+"""
+schedule_parser_lalr = None
+re_number = re.compile(r"^(\s*)([+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)$")
+cache_size = 1024 # max entries per cache
+cache_trees = OrderedDict() # prompt -> parse tree
+cache_schedules = OrderedDict() # (prompt, steps) -> schedule
+cache_attention = OrderedDict() # (text, parser) -> attention
 re_clean = re.compile(r"^\W+", re.S)
 re_whitespace = re.compile(r"\s+", re.S)
 re_break = re.compile(r"\s*\bBREAK\b|##\s*", re.S)
@@ -103,51 +123,123 @@ def get_learned_conditioning_prompt_schedules(prompts, steps):
     [[1, 'a'], [2, '(b:1.1)'], [3, 'a'], [4, '(b:1.1)'], [5, 'a'], [6, '(b:1.1)'], [7, 'a'], [8, '(b:1.1)'], [9, 'a'], [10, '(b:1.1)']]
     """
 
-    def collect_steps(steps, tree):
-        res = [steps]
-        class CollectSteps(lark.Visitor):
-            def scheduled(self, tree):
-                tree.children[-1] = float(tree.children[-1])
-                if tree.children[-1] < 1:
-                    tree.children[-1] *= steps
-                tree.children[-1] = min(steps, int(tree.children[-1]))
-                res.append(tree.children[-1])
-            def alternate(self, tree): # pylint: disable=unused-argument
-                res.extend(range(1, steps+1))
-        CollectSteps().visit(tree)
-        return sorted(set(res))
-
-    def at_step(step, tree):
-        class AtStep(lark.Transformer):
-            def scheduled(self, args):
-                before, after, _, when = args
-                yield before or () if step <= when else after
-            def alternate(self, args):
-                yield next(args[(step - 1)%len(args)]) # pylint: disable=stop-iteration-return
-            def start(self, args):
-                def flatten(x):
-                    if type(x) == str:
-                        yield x
-                    else:
-                        for gen in x:
-                            yield from flatten(gen)
-                return ''.join(flatten(args))
-            def plain(self, args):
-                yield args[0].value
-            def __default__(self, data, children, meta):
-                for child in children:
-                    yield child
-        return AtStep().transform(tree)
-
-    def get_schedule(prompt):
+    return [get_schedule(prompt, steps) for prompt in prompts]
+
+
+def cache_get(cache, key, name):
+    value = cache.get(key, None)
+    if value is not None:
+        cache.move_to_end(key)
+    metrics.counter('sd_cache_requests_total', 'Cache lookups', cache=name, result='miss' if value is None else 'hit').inc()
+    return value
+
+
+def cache_put(cache, key, value):
+    cache[key] = value
+    while len(cache) > cache_size:
+        cache.popitem(last=False)
+    return value
+
+
+def cache_clear():
+    cache_trees.clear()
+    cache_schedules.clear()
+    cache_attention.clear()
+
+
+def resolve_step(when, steps):
+    when = float(when)
+    if when < 1:
+        when *= steps
+    return min(steps, int(when))
+
+
+class ResolveSquare(lark.Transformer):
+    """converts generic lalr square brackets into same nodes earley grammar produces"""
+    def square(self, children):
+        prompts = [c for c in children if isinstance(c, lark.Tree)]
+        separators = [c for c in children if isinstance(c, lark.Token) and c.value == '|']
+        if len(separators) > 0:
+            return lark.Tree('alternate', prompts)
+        if len(prompts) == 1:
+            return lark.Tree('emphasized', children)
+        if len(prompts) > 3 or len(prompts[-1].children) != 1 or prompts[-1].children[0].data != 'plain':
+            raise lark.exceptions.LarkError('ambiguous square bracket')
+        match = re_number.match(prompts[-1].children[0].children[0].value)
+        if match is None:
+            raise lark.exceptions.LarkError('non-numeric schedule')
+        ws = lark.Token('WHITESPACE', match.group(1)) if len(match.group(1)) > 0 else None
+        before = prompts[0] if len(prompts) == 3 else None
+        return lark.Tree('scheduled', [before, prompts[-2], ws, lark.Token('NUMBER', match.group(2))])
+
+
+def parse_schedule(prompt):
+    """returns cached parse tree for prompt using selected grammar, None if prompt cannot be parsed"""
+    global schedule_parser_lalr # pylint: disable=global-statement
+    tree = cache_get(cache_trees, prompt, 'prompt-tree')
+    if tree is not None:
+        return tree if isinstance(tree, lark.Tree) else None
+    tree = None
+    if opts.prompt_schedule_parser == 'LALR':
+        try:
+            if schedule_parser_lalr is None:
+                schedule_parser_lalr = lark.Lark(schedule_grammar_lalr, parser='lalr')
+            tree = ResolveSquare().transform(schedule_parser_lalr.parse(prompt))
+        except lark.exceptions.LarkError:
+            tree = None
+    if tree is None:
         try:
             tree = schedule_parser.parse(prompt)
         except lark.exceptions.LarkError:
-            return [[steps, prompt]]
-        return [[t, at_step(t, tree)] for t in collect_steps(steps, tree)]
+            tree = False # cache failed parse as well
+    cache_put(cache_trees, prompt, tree)
+    return tree if isinstance(tree, lark.Tree) else None
+
+
+def collect_steps(steps, tree):
+    res = [steps]
+    class CollectSteps(lark.Visitor):
+        def scheduled(self, tree):
+            res.append(resolve_step(tree.children[-1], steps))
+        def alternate(self, tree): # pylint: disable=unused-argument
+            res.extend(range(1, steps+1))
+    CollectSteps().visit(tree)
+    return sorted(set(res))
 
-    promptdict = {prompt: get_schedule(prompt) for prompt in set(prompts)}
-    return [promptdict[prompt] for prompt in prompts]
+
+def at_step(step, steps, tree):
+    class AtStep(lark.Transformer):
+        def scheduled(self, args):
+            before, after, _, when = args
+            yield before or () if step <= resolve_step(when, steps) else after
+        def alternate(self, args):
+            yield next(args[(step - 1)%len(args)]) # pylint: disable=stop-iteration-return
+        def start(self, args):
+            def flatten(x):
+                if type(x) == str:
+                    yield x
+                else:
+                    for gen in x:
+                        yield from flatten(gen)
+            return ''.join(flatten(args))
+        def plain(self, args):
+            yield args[0].value
+        def __default__(self, data, children, meta):
+            for child in children:
+                yield child
+    return AtStep().transform(tree)
+
+
+def get_schedule(prompt, steps):
+    schedule = cache_get(cache_schedules, (prompt, steps), 'prompt-schedule')
+    if schedule is None:
+        tree = parse_schedule(prompt)
+        if tree is None:
+            schedule = [[steps, prompt]]
+        else:
+            schedule = [[t, at_step(t, steps, tree)] for t in collect_steps(steps, tree)]
+        cache_put(cache_schedules, (prompt, steps), schedule)
+    return [list(x) for x in schedule] # callers receive copies so cached schedule cannot be modified
 
 
 def get_learned_conditioning(model, prompts, steps):
@@ -300,6 +392,14 @@ def parse_prompt_attention(text):
      ['sky', 1.4641000000000006],
      ['.', 1.1]]
     """
+    key = (text, opts.prompt_attention, backend)
+    res = cache_get(cache_attention, key, 'prompt-attention')
+    if res is None:
+        res = cache_put(cache_attention, key, parse_attention(text))
+    return [list(x) for x in res] # callers receive copies so cached result cannot be modified
+
+
+def parse_attention(text):
     res = []
     round_brackets = []
     square_brackets = []
@@ -1,10 +1,9 @@
 #!/bin/env python
 
-import _thread
 import os
 import time
-from queue import Queue
-import cv2
+import threading
+from queue import Queue, Full
 import numpy as np
 import torch
 from PIL import Image
@@ -32,86 +31,126 @@ def load(model_path: str = 'rife/flownet-v46.pkl'):
         model.device()
 
 
-def interpolate(images: list, count: int = 2, scale: float = 1.0, pad: int = 1, change: float = 0.3):
+def estimate(frames: int, count: int = 2, pad: int = 1):
+    """upper bound of output frames, actual count is lower if duplicate frames are skipped"""
+    return max(0, 2 * pad + frames + (frames - 1) * max(count - 1, 0))
+
+
+def interpolate_frames(images: list, count: int = 2, scale: float = 1.0, pad: int = 1, change: float = 0.3, batch: int = 4, maxsize: int = 32):
+    """generator yielding interpolated frames as rgb uint8 arrays, inference runs on a background thread and results are passed through a bounded queue
+    errors raised by the worker are re-raised to the consumer after the frames produced so far"""
     if images is None or len(images) < 2:
-        return []
+        return
     if model is None:
         load()
-    interpolated = []
     h = images[0].height
     w = images[0].width
-    t0 = time.time()
+    tmp = max(128, int(128 / scale))
+    ph = ((h - 1) // tmp + 1) * tmp
+    pw = ((w - 1) // tmp + 1) * tmp
+    padding = (0, pw - w, 0, ph - h)
+    batch = max(1, batch)
+    buffer = Queue(maxsize=maxsize)
+    stopped = threading.Event()
+    failed = []
+    stats = { 'input': len(images), 'frames': 0, 'pairs': 0, 'forwards': 0 }
 
-    def write(buffer):
-        item = buffer.get()
-        while item is not None:
-            img = item[:, :, ::-1]
-            # image = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-            image = Image.fromarray(img)
-            item = buffer.get()
-            interpolated.append(image)
+    def to_tensor(frames): # list of pil images to padded bgr device tensor in a single pass
+        arr = np.stack([np.asarray(frame.convert('RGB')) for frame in frames])
+        tensor = torch.from_numpy(arr).to(devices.device, non_blocking=True).permute(0, 3, 1, 2)[:, [2, 1, 0]]
+        return F.pad(tensor.to(devices.dtype) / 255., padding) # pylint: disable=not-callable
 
-    def execute(I0, I1, n):
+    def to_numpy(tensor): # padded bgr device tensor to list of rgb uint8 arrays with a single device transfer
+        tensor = (tensor[:, [2, 1, 0], :h, :w].float() * 255.).round().clamp(0, 255).byte()
+        return list(tensor.permute(0, 2, 3, 1).cpu().numpy())
+
+    def execute(I0, I1, n): # batched over pairs and timesteps
         if model.version >= 3.9:
+            b = I0.shape[0]
+            timesteps = torch.tensor([(i+1) * 1. / (n+1) for i in range(n)], device=I0.device, dtype=I0.dtype)
+            I0n = I0.repeat_interleave(n, dim=0)
+            I1n = I1.repeat_interleave(n, dim=0)
+            tn = timesteps.repeat(b).view(-1, 1, 1, 1)
             res = []
-            for i in range(n):
-                res.append(model.inference(I0, I1, (i+1) * 1. / (n+1), scale))
-            return res
+            for i in range(0, I0n.shape[0], batch * n):
+                res.append(model.inference(I0n[i:i + batch * n], I1n[i:i + batch * n], tn[i:i + batch * n], scale))
+                stats['forwards'] += 1
+            return torch.cat(res).view(b, n, *I0.shape[1:])
         else:
             middle = model.inference(I0, I1, scale)
+            stats['forwards'] += 1
             if n == 1:
-                return [middle]
+                return middle.unsqueeze(1)
             first_half = execute(I0, middle, n=n//2)
             second_half = execute(middle, I1, n=n//2)
             if n % 2:
-                return [*first_half, middle, *second_half]
+                return torch.cat([first_half, middle.unsqueeze(1), second_half], dim=1)
             else:
-                return [*first_half, *second_half]
+                return torch.cat([first_half, second_half], dim=1)
 
-    def f_pad(img):
-        return F.pad(img, padding).to(devices.dtype) # pylint: disable=not-callable
+    def put(items):
+        for item in items:
+            while not stopped.is_set():
+                try:
+                    buffer.put(item, timeout=0.1)
+                    break
+                except Full:
+                    pass
 
-    tmp = max(128, int(128 / scale))
-    ph = ((h - 1) // tmp + 1) * tmp
-    pw = ((w - 1) // tmp + 1) * tmp
-    padding = (0, pw - w, 0, ph - h)
-    buffer = Queue(maxsize=8192)
-    _thread.start_new_thread(write, (buffer,))
-
-    frame = cv2.cvtColor(np.array(images[0]), cv2.COLOR_RGB2BGR)
-    for _i in range(pad): # fill starting frames
-        buffer.put(frame)
-
-    I1 = f_pad(torch.from_numpy(np.transpose(frame, (2,0,1))).to(devices.device, non_blocking=True).unsqueeze(0).float() / 255.)
-    with torch.no_grad():
-        with tqdm(total=len(images), desc='Interpolate', unit='frame') as pbar:
-            for image in images:
-                frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                I0 = I1
-                I1 = f_pad(torch.from_numpy(np.transpose(frame, (2,0,1))).to(devices.device, non_blocking=True).unsqueeze(0).float() / 255.)
-                I0_small = F.interpolate(I0, (32, 32), mode='bilinear', align_corners=False).to(torch.float32)
-                I1_small = F.interpolate(I1, (32, 32), mode='bilinear', align_corners=False).to(torch.float32)
-                ssim = ssim_matlab(I0_small[:, :3], I1_small[:, :3])
-                if ssim > 0.99: # skip duplicate frames
-                    continue
-                if ssim < change:
-                    output = []
-                    for _i in range(pad): # fill frames if change rate is above threshold
-                        output.append(I0)
-                    for _i in range(pad):
-                        output.append(I1)
-                else:
-                    output = execute(I0, I1, count-1)
-                for mid in output:
-                    mid = (((mid[0] * 255.).byte().cpu().numpy().transpose(1, 2, 0)))
-                    buffer.put(mid[:h, :w])
-                buffer.put(frame)
-                pbar.update(1)
-
-    for _i in range(pad): # fill ending frames
-        buffer.put(frame)
-    while not buffer.empty():
-        time.sleep(0.1)
-    t1 = time.time()
-    shared.log.info(f'RIFE interpolate: input={len(images)} frames={len(interpolated)} resolution={w}x{h} interpolate={count} scale={scale} pad={pad} change={change} time={round(t1 - t0, 2)}')
-    return interpolated
+    def worker():
+        try:
+            with devices.inference_context():
+                first = images[0].convert('RGB')
+                put([np.asarray(first)] * pad) # fill starting frames
+                last = to_tensor([first])
+                with tqdm(total=len(images), desc='Interpolate', unit='frame') as pbar:
+                    for i in range(1, len(images), batch):
+                        window = to_tensor(images[i:i + batch])
+                        I0 = torch.cat([last, window[:-1]])
+                        I1 = window
+                        last = window[-1:]
+                        small = F.interpolate(torch.cat([I0, I1]), (32, 32), mode='bilinear', align_corners=False).to(torch.float32)
+                        similarity = [ssim_matlab(small[j:j+1, :3], small[len(I0)+j:len(I0)+j+1, :3]) for j in range(len(I0))]
+                        interpolate = [j for j in range(len(I0)) if change <= similarity[j] <= 0.99]
+                        mids = execute(I0[interpolate], I1[interpolate], count - 1) if len(interpolate) > 0 and count > 1 else None
+                        frames = to_numpy(I1)
+                        for j in range(len(I0)):
+                            if stopped.is_set():
+                                return
+                            if similarity[j] > 0.99: # skip duplicate frames
+                                continue
+                            if similarity[j] < change: # fill frames if change rate is above threshold
+                                put(to_numpy(torch.cat([I0[j:j+1]] * pad + [I1[j:j+1]] * pad)))
+                            elif mids is not None:
+                                put(to_numpy(mids[interpolate.index(j)]))
+                            put([frames[j]])
+                            stats['pairs'] += 1
+                        pbar.update(len(I1))
+                put([frames[-1]] * pad) # fill ending frames
+        except Exception as e:
+            failed.append(e)
+        put([None])
+
+    t0 = time.time()
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        frame = buffer.get()
+        while frame is not None:
+            stats['frames'] += 1
+            yield frame
+            frame = buffer.get()
+        if len(failed) > 0:
+            raise failed[0]
+    finally:
+        stopped.set()
+        thread.join()
+        t1 = time.time()
+        fps = stats['frames'] / (t1 - t0) if t1 > t0 else 0
+        shared.log.info(f'RIFE interpolate: input={stats["input"]} frames={stats["frames"]} pairs={stats["pairs"]} forwards={stats["forwards"]} batch={batch} resolution={w}x{h} interpolate={count} scale={scale} pad={pad} change={change} time={round(t1 - t0, 2)} fps={fps:.2f}')
+
+
+def interpolate(images: list, count: int = 2, scale: float = 1.0, pad: int = 1, change: float = 0.3, batch: int = 4):
+    if images is None or len(images) < 2:
+        return []
+    return [Image.fromarray(frame) for frame in interpolate_frames(images, count=count, scale=scale, pad=pad, change=change, batch=batch)]
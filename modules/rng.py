@@ -0,0 +1,94 @@
+import os
+import numpy as np
+import torch
+from modules import shared, devices
+
+
+debug = shared.log.trace if os.environ.get('SD_RNG_DEBUG', None) is not None else lambda *args, **kwargs: None
+philox_m = (np.uint64(0xD2511F53), np.uint64(0xCD9E8D57))
+philox_w = np.array([[0x9E3779B9], [0xBB67AE85]], dtype=np.uint32)
+philox_rounds = 10
+
+
+def philox4x32(counter: np.ndarray, key: np.ndarray) -> np.ndarray:
+    """counter-based philox 4x32-10, counter is (4, n) and key is (2, n) uint32, returns (4, n) uint32 random words"""
+    key = key.copy()
+    for _i in range(philox_rounds):
+        p0 = counter[0].astype(np.uint64) * philox_m[0]
+        p1 = counter[2].astype(np.uint64) * philox_m[1]
+        counter = np.stack([
+            (p1 >> np.uint64(32)).astype(np.uint32) ^ counter[1] ^ key[0],
+            (p1 & np.uint64(0xFFFFFFFF)).astype(np.uint32),
+            (p0 >> np.uint64(32)).astype(np.uint32) ^ counter[3] ^ key[1],
+            (p0 & np.uint64(0xFFFFFFFF)).astype(np.uint32),
+        ])
+        key += philox_w
+    return counter
+
+
+def philox_normal(seeds: list, n: int, stream: int = 0) -> np.ndarray:
+    """
+    normal distributed float32 values of shape (len(seeds), n) using box-muller over philox output
+    value at index i for seed s only depends on (s, stream, i) so noise does not depend on batch composition, device or thread
+    """
+    seeds = np.array([int(s) & 0xFFFFFFFFFFFFFFFF for s in seeds], dtype=np.uint64)
+    index = np.arange(n, dtype=np.uint64)
+    counter = np.zeros((4, len(seeds) * n), dtype=np.uint32)
+    counter[0] = np.tile(index & np.uint64(0xFFFFFFFF), len(seeds))
+    counter[1] = np.tile(index >> np.uint64(32), len(seeds))
+    counter[2] = np.uint32(stream & 0xFFFFFFFF)
+    key = np.stack([
+        np.repeat(seeds & np.uint64(0xFFFFFFFF), n).astype(np.uint32),
+        np.repeat(seeds >> np.uint64(32), n).astype(np.uint32),
+    ])
+    words = philox4x32(counter, key)
+    u1 = (words[0].astype(np.float64) + 0.5) / 4294967296.0 # open interval so log is always finite
+    u2 = (words[1].astype(np.float64) + 0.5) / 4294967296.0
+    z = np.sqrt(-2.0 * np.log(u1)) * np.cos(2.0 * np.pi * u2)
+    return z.astype(np.float32).reshape(len(seeds), n)
+
+
+def generator_device(source: str = None):
+    source = source or shared.opts.randn_source
+    if source != 'GPU' or devices.device.type == 'mps': # mps noise was always generated on cpu
+        return devices.cpu
+    return devices.device
+
+
+def generator(seed: int, device=None):
+    """local torch generator, unlike torch.manual_seed it does not touch global rng state shared by all threads"""
+    device = device or generator_device()
+    try:
+        return torch.Generator(device).manual_seed(int(seed))
+    except Exception as e: # some backends such as directml do not support device generators
+        debug(f'RNG: generator device={device} fallback=cpu {e}')
+        return torch.Generator(devices.cpu).manual_seed(int(seed))
+
+
+class ImageRNG:
+    """per-request noise source for a batch of seeds, each call to next returns one noise tensor per seed"""
+    def __init__(self, shape, seeds, source: str = None):
+        self.shape = tuple(shape)
+        self.seeds = [int(s) for s in seeds]
+        self.source = source or shared.opts.randn_source
+        self.draws = 0
+        self.generators = None if self.source == 'Philox' else [generator(s, generator_device(self.source)) for s in self.seeds]
+
+    def next(self, shape=None) -> torch.Tensor:
+        shape = tuple(shape or self.shape)
+        if self.generators is None:
+            n = int(np.prod(shape))
+            x = torch.from_numpy(philox_normal(self.seeds, n, stream=self.draws)).view(len(self.seeds), *shape)
+        else:
+            x = torch.stack([torch.randn(shape, generator=g, device=g.device) for g in self.generators])
+        self.draws += 1
+        return x.to(devices.device)
+
+
+def randn(seed: int, shape) -> torch.Tensor:
+    return ImageRNG(shape, [seed]).next()[0]
+
+
+def randn_batch(seeds: list, shape) -> torch.Tensor:
+    """noise for all seeds in single call, philox source generates whole batch in one vectorized pass"""
+    return ImageRNG(shape, seeds).next()
@@ -33,6 +33,7 @@ class Script:
     is_txt2img = False
     is_img2img = False
     api_info = None
+    api_defaults = None
     group = None
     infotext_fields = None
     paste_field_names = None
@@ -60,6 +61,13 @@ class Script:
          """
         return True
 
+    def is_active(self, p, *args): # pylint: disable=unused-argument
+        """
+        This function is called once per job before any processing hooks run.
+        Return False if the script is disabled by its args so that all of its per-job hooks are skipped.
+        """
+        return True
+
     def run(self, p, *args):
         """
         This function is called if the script has been selected in the script dropdown.
@@ -298,6 +306,10 @@ def wrap_call(func, filename, funcname, *args, default=None, **kwargs):
     return default
 
 
+def overrides(script: Script, hook: str):
+    return getattr(type(script), hook, None) is not getattr(Script, hook, None)
+
+
 class ScriptSummary:
     def __init__(self, op):
         self.start = time.time()
@@ -305,9 +317,11 @@ class ScriptSummary:
         self.op = op
         self.time = {}
 
-    def record(self, script):
-        self.update = time.time()
+    def record(self, script, filename: str = None):
+        if filename is not None:
+            script_callbacks.timer(self.update, filename, self.op)
         self.time[script] = round(time.time() - self.update, 2)
+        self.update = time.time()
 
     def report(self):
         total = sum(self.time.values())
@@ -317,6 +331,9 @@ class ScriptSummary:
         errors.log.debug(f'Script: op={self.op} total={total} scripts={scripts}')
 
 
+job_hooks = ['before_process', 'process', 'process_images', 'before_process_batch', 'process_batch', 'postprocess', 'postprocess_batch', 'postprocess_batch_list', 'postprocess_image']
+
+
 class ScriptRunner:
     def __init__(self):
         self.scripts = []
@@ -365,8 +382,50 @@ class ScriptRunner:
     def prepare_ui(self):
         self.inputs = [None]
 
-    def setup_ui(self, parent='unknown', accordion=True):
+    def create_script_api(self, script: Script, controls):
         import modules.api.models as api_models
+        script.name = wrap_call(script.title, script.filename, "title", default=script.filename).lower()
+        api_args = []
+        for control in controls:
+            debug(f'Script control: parent={script.parent} script="{script.name}" label="{control.label}" type={control} id={control.elem_id}')
+            if not isinstance(control, gr.components.IOComponent):
+                errors.log.error(f'Invalid script control: "{script.filename}" control={control}')
+                continue
+            control.custom_script_source = os.path.basename(script.filename)
+            arg_info = api_models.ScriptArg(label=control.label or "")
+            for field in ("value", "minimum", "maximum", "step", "choices"):
+                v = getattr(control, field, None)
+                if v is not None:
+                    setattr(arg_info, field, v)
+            api_args.append(arg_info)
+        script.api_info = api_models.ItemScript(
+            name=script.name,
+            is_img2img=script.is_img2img,
+            is_alwayson=script.alwayson,
+            args=api_args,
+        )
+        script.api_defaults = [getattr(control, 'value', None) for control in controls]
+
+    def setup_api(self, parent='unknown'):
+        """headless equivalent of setup_ui: assigns script arg ranges, api info and default values without building the full ui"""
+        t0 = time.time()
+        self.titles = [wrap_call(script.title, script.filename, "title") or f"{script.filename} [error]" for script in self.selectable_scripts]
+        args_count = 1 # position 0 is selected script index
+        ordered = [s for s in self.alwayson_scripts if s.standalone] + [s for s in self.alwayson_scripts if not s.standalone] + self.selectable_scripts # same order as setup_ui
+        with gr.Blocks(): # detached context, components are created for metadata only and never rendered
+            for script in ordered:
+                script.parent = parent
+                script.args_from = args_count
+                script.args_to = args_count
+                controls = wrap_call(script.ui, script.filename, "ui", script.is_img2img)
+                if controls is None:
+                    continue
+                self.create_script_api(script, controls)
+                args_count += len(controls)
+                script.args_to = args_count
+        errors.log.debug(f'Script setup: parent={parent} scripts={len(ordered)} args={args_count} time={time.time()-t0:.2f}')
+
+    def setup_ui(self, parent='unknown', accordion=True):
         self.titles = [wrap_call(script.title, script.filename, "title") or f"{script.filename} [error]" for script in self.selectable_scripts]
         inputs = []
         inputs_alwayson = [True]
@@ -378,27 +437,7 @@ class ScriptRunner:
             controls = wrap_call(script.ui, script.filename, "ui", script.is_img2img)
             if controls is None:
                 return
-            script.name = wrap_call(script.title, script.filename, "title", default=script.filename).lower()
-            api_args = []
-            for control in controls:
-                debug(f'Script control: parent={script.parent} script="{script.name}" label="{control.label}" type={control} id={control.elem_id}')
-                if not isinstance(control, gr.components.IOComponent):
-                    errors.log.error(f'Invalid script control: "{script.filename}" control={control}')
-                    continue
-                control.custom_script_source = os.path.basename(script.filename)
-                arg_info = api_models.ScriptArg(label=control.label or "")
-                for field in ("value", "minimum", "maximum", "step", "choices"):
-                    v = getattr(control, field, None)
-                    if v is not None:
-                        setattr(arg_info, field, v)
-                api_args.append(arg_info)
-
-            script.api_info = api_models.ItemScript(
-                name=script.name,
-                is_img2img=script.is_img2img,
-                is_alwayson=script.alwayson,
-                args=api_args,
-            )
+            self.create_script_api(script, controls)
             if script.infotext_fields is not None:
                 self.infotext_fields += script.infotext_fields
             if script.paste_field_names is not None:
@@ -468,6 +507,29 @@ class ScriptRunner:
         self.infotext_fields.extend( [(script.group, onload_script_visibility) for script in self.selectable_scripts] )
         return inputs
 
+    def build_dispatch(self, p):
+        """per-job table of alwayson scripts that override each hook and are active for this job's args"""
+        active = []
+        for script in self.alwayson_scripts:
+            if not any(overrides(script, hook) for hook in job_hooks):
+                continue
+            try:
+                args = p.per_script_args.get(script.title(), p.script_args[script.args_from:script.args_to])
+                if not script.is_active(p, *args):
+                    continue
+            except Exception as e:
+                errors.display(e, f'Running script is active: {script.filename}')
+            active.append(script)
+        p.script_dispatch = (self, { hook: [script for script in active if overrides(script, hook)] for hook in job_hooks })
+        debug(f'Script dispatch: alwayson={len(self.alwayson_scripts)} active={len(active)} hooks={ {k: len(v) for k, v in p.script_dispatch[1].items()} }')
+
+    def dispatch(self, p, hook):
+        table = getattr(p, 'script_dispatch', None)
+        if table is None or table[0] is not self:
+            self.build_dispatch(p)
+            table = p.script_dispatch
+        return table[1][hook]
+
     def run(self, p, *args):
         s = ScriptSummary('run')
         script_index = args[0]
@@ -484,103 +546,104 @@ class ScriptRunner:
 
     def before_process(self, p, **kwargs):
         s = ScriptSummary('before-process')
-        for script in self.alwayson_scripts:
+        self.build_dispatch(p) # job start
+        for script in self.dispatch(p, 'before_process'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
                 script.before_process(p, *script_args, **kwargs)
             except Exception as e:
                 errors.display(e, f"Error running before process: {script.filename}")
-            s.record(script.title())
+            s.record(script.title(), script.filename)
         s.report()
 
     def process(self, p, **kwargs):
         s = ScriptSummary('process')
-        for script in self.alwayson_scripts:
+        for script in self.dispatch(p, 'process'):
             try:
                 args = p.per_script_args.get(script.title(), p.script_args[script.args_from:script.args_to])
                 script.process(p, *args, **kwargs)
             except Exception as e:
                 errors.display(e, f'Running script process: {script.filename}')
-            s.record(script.title())
+            s.record(script.title(), script.filename)
         s.report()
 
     def process_images(self, p, **kwargs):
         s = ScriptSummary('process_images')
         processed = None
-        for script in self.alwayson_scripts:
+        for script in self.dispatch(p, 'process_images'):
             try:
                 args = p.per_script_args.get(script.title(), p.script_args[script.args_from:script.args_to])
                 processed = script.process_images(p, *args, **kwargs)
             except Exception as e:
                 errors.display(e, f'Running script process images: {script.filename}')
-            s.record(script.title())
+            s.record(script.title(), script.filename)
         s.report()
         return processed
 
     def before_process_batch(self, p, **kwargs):
         s = ScriptSummary('before-process-batch')
-        for script in self.alwayson_scripts:
+        for script in self.dispatch(p, 'before_process_batch'):
             try:
                 args = p.per_script_args.get(script.title(), p.script_args[script.args_from:script.args_to])
                 script.before_process_batch(p, *args, **kwargs)
             except Exception as e:
                 errors.display(e, f'Running script before process batch: {script.filename}')
-            s.record(script.title())
+            s.record(script.title(), script.filename)
         s.report()
 
     def process_batch(self, p, **kwargs):
         s = ScriptSummary('process-batch')
-        for script in self.alwayson_scripts:
+        for script in self.dispatch(p, 'process_batch'):
             try:
                 args = p.per_script_args.get(script.title(), p.script_args[script.args_from:script.args_to])
                 script.process_batch(p, *args, **kwargs)
             except Exception as e:
                 errors.display(e, f'Running script process batch: {script.filename}')
-            s.record(script.title())
+            s.record(script.title(), script.filename)
         s.report()
 
     def postprocess(self, p, processed):
         s = ScriptSummary('postprocess')
-        for script in self.alwayson_scripts:
+        for script in self.dispatch(p, 'postprocess'):
             try:
                 args = p.per_script_args.get(script.title(), p.script_args[script.args_from:script.args_to])
                 script.postprocess(p, processed, *args)
             except Exception as e:
                 errors.display(e, f'Running script postprocess: {script.filename}')
-            s.record(script.title())
+            s.record(script.title(), script.filename)
         s.report()
 
     def postprocess_batch(self, p, images, **kwargs):
         s = ScriptSummary('postprocess-batch')
-        for script in self.alwayson_scripts:
+        for script in self.dispatch(p, 'postprocess_batch'):
             try:
                 args = p.per_script_args.get(script.title(), p.script_args[script.args_from:script.args_to])
                 script.postprocess_batch(p, *args, images=images, **kwargs)
             except Exception as e:
                 errors.display(e, f'Running script before postprocess batch: {script.filename}')
-            s.record(script.title())
+            s.record(script.title(), script.filename)
         s.report()
 
     def postprocess_batch_list(self, p, pp: PostprocessBatchListArgs, **kwargs):
         s = ScriptSummary('postprocess-batch-list')
-        for script in self.alwayson_scripts:
+        for script in self.dispatch(p, 'postprocess_batch_list'):
             try:
                 args = p.per_script_args.get(script.title(), p.script_args[script.args_from:script.args_to])
                 script.postprocess_batch_list(p, pp, *args, **kwargs)
             except Exception as e:
                 errors.display(e, f'Running script before postprocess batch list: {script.filename}')
-            s.record(script.title())
+            s.record(script.title(), script.filename)
         s.report()
 
     def postprocess_image(self, p, pp: PostprocessImageArgs):
         s = ScriptSummary('postprocess-image')
-        for script in self.alwayson_scripts:
+        for script in self.dispatch(p, 'postprocess_image'):
             try:
                 args = p.per_script_args.get(script.title(), p.script_args[script.args_from:script.args_to])
                 script.postprocess_image(p, pp, *args)
             except Exception as e:
                 errors.display(e, f'Running script postprocess image: {script.filename}')
-            s.record(script.title())
+            s.record(script.title(), script.filename)
         s.report()
 
     def before_component(self, component, **kwargs):
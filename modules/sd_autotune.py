@@ -0,0 +1,179 @@
+import os
+import time
+from functools import cache
+import torch
+from modules import shared, devices, hashes
+
+
+debug = shared.log.trace if os.environ.get('SD_AUTOTUNE_DEBUG', None) is not None else lambda *args, **kwargs: None
+slice_rates = [0.25, 0.5, 1, 2, 4, 8, 16, 64] # GB, largest effectively disables slicing
+tile_sizes = [128, 192, 256, 320, 384, 512, 768]
+repeats = 3
+failed = set() # keys where tuning failed are not retried in current session
+
+
+@cache
+def device_name():
+    try:
+        if devices.device.type == 'cuda':
+            return torch.cuda.get_device_name(devices.device)
+    except Exception:
+        pass
+    return str(devices.device)
+
+
+def get_plans():
+    """tuned plans are persisted in shared cache.json next to model hashes"""
+    return hashes.cache('autotune')
+
+
+def synchronize(device):
+    if devices.backend != "directml" and hasattr(getattr(torch, device.type, None), 'synchronize'):
+        getattr(torch, device.type).synchronize()
+
+
+def measure(fn, device):
+    """average time of fn after warmup, returns none if candidate fails e.g. out of memory"""
+    try:
+        fn()
+        synchronize(device)
+        t0 = time.perf_counter()
+        for _i in range(repeats):
+            fn()
+        synchronize(device)
+        return (time.perf_counter() - t0) / repeats
+    except Exception as e:
+        debug(f'Autotune: candidate failed {e}')
+        devices.torch_gc(force=True)
+        return None
+
+
+def store(key: str, kind: str, results: dict, default):
+    """pick fastest candidate and persist plan with speedup over default heuristic"""
+    valid = {k: v for k, v in results.items() if v is not None}
+    if len(valid) == 0:
+        failed.add(key)
+        shared.log.warning(f'Autotune: {kind} key={key} no valid candidates')
+        return None
+    best = min(valid, key=valid.get)
+    baseline = valid.get(default, None)
+    plan = {
+        'kind': kind,
+        'value': best,
+        'default': default,
+        'time': round(valid[best], 6),
+        'baseline': round(baseline, 6) if baseline is not None else None,
+        'speedup': round(baseline / valid[best], 3) if baseline is not None and valid[best] > 0 else None,
+        'candidates': { str(k): round(v, 6) if v is not None else None for k, v in results.items() },
+    }
+    get_plans()[key] = plan
+    hashes.dump_cache()
+    shared.log.info(f'Autotune: {kind} value={best} default={default} speedup={plan["speedup"]} key={key}')
+    return plan
+
+
+def slice_rate(query, key, value) -> float:
+    """tuned dynamic attention slice rate for given shapes, falls back to configured rate"""
+    default = shared.opts.dynamic_attention_slice_rate
+    if not shared.opts.dynamic_attention_autotune:
+        return default
+    plan_key = f'slice:{device_name()}:{shared.opts.cross_attention_optimization}:{query.dtype}:{tuple(query.shape)}:{tuple(key.shape)}'
+    plan = get_plans().get(plan_key, None)
+    if plan is None and plan_key not in failed:
+        plan = tune_slice(plan_key, query, key, value, default)
+    return plan['value'] if plan is not None else default
+
+
+def tune_slice(plan_key: str, query, key, value, default: float):
+    from modules.sd_hijack_dynamic_atten import find_slice_sizes, sliced_scaled_dot_product_attention
+    q, k, v = torch.randn_like(query), torch.randn_like(key), torch.randn_like(value)
+    results = {}
+    seen = {}
+    for rate in sorted(set(slice_rates + [default])):
+        sizes = find_slice_sizes(q.shape, q.element_size(), slice_rate=rate)
+        if sizes in seen: # different rates resulting in same split do not need to be measured again
+            results[rate] = results[seen[sizes]]
+            continue
+        seen[sizes] = rate
+        results[rate] = measure(lambda r=rate: sliced_scaled_dot_product_attention(q, k, v, slice_rate=r), q.device)
+        debug(f'Autotune: slice rate={rate} sizes={sizes} time={results[rate]}')
+    del q, k, v
+    return store(plan_key, 'slice', results, default)
+
+
+def self_attention(unet):
+    for name, module in unet.named_modules():
+        if module.__class__.__qualname__ in ("Attention", "CrossAttention") and (name.endswith("attn1") or name.endswith("attn_1")) and hasattr(module, 'to_q'):
+            return module
+    return None
+
+
+def hypertile_key(module, width: int, height: int, batch: int):
+    return f'hypertile:{device_name()}:{shared.opts.cross_attention_optimization}:{next(module.parameters()).dtype}:{width}x{height}:{batch}'
+
+
+def hypertile_tile(unet, width: int, height: int, batch: int, default: int, force: bool = False) -> int:
+    """tuned hypertile unet tile size for resolution and batch, falls back to default heuristic"""
+    if not shared.opts.hypertile_autotune and not force:
+        return default
+    module = self_attention(unet)
+    if module is None or next(module.parameters()).device.type in {'cpu', 'meta'}: # offloaded models would measure transfers instead of attention
+        return default
+    plan_key = hypertile_key(module, width, height, batch)
+    plan = get_plans().get(plan_key, None)
+    if (plan is None and plan_key not in failed) or force:
+        plan = tune_hypertile(plan_key, module, width, height, batch, default)
+    return plan['value'] if plan is not None else default
+
+
+def tune_hypertile(plan_key: str, module, width: int, height: int, batch: int, default: int):
+    """measure first self-attention block of unet with each distinct tile split, the largest attention dominates unet time"""
+    from einops import rearrange
+    from modules.sd_hijack_hypertile import possible_tile_sizes
+    param = next(module.parameters())
+    h, w = height // 8, width // 8
+    x = torch.randn((2 * batch, h * w, module.to_q.in_features), device=param.device, dtype=param.dtype) # cfg doubles batch
+    def run(nh, nw):
+        y = rearrange(x, "b (nh h nw w) c -> (b nh nw) (h w) c", h=h // nh, w=w // nw, nh=nh, nw=nw) if nh * nw > 1 else x
+        out = module(y)
+        if nh * nw > 1:
+            out = rearrange(out, "(b nh nw) (h w) c -> b (nh h nw w) c", h=h // nh, w=w // nw, nh=nh, nw=nw)
+        return out
+    results = {}
+    seen = {}
+    with devices.inference_context():
+        for tile in sorted(set(tile_sizes + [default])):
+            nh = possible_tile_sizes(height, tile, 128, 1)[0]
+            nw = possible_tile_sizes(width, tile, 128, 1)[0]
+            if h % nh != 0 or w % nw != 0:
+                continue
+            if (nh, nw) in seen:
+                results[tile] = results[seen[(nh, nw)]]
+                continue
+            seen[(nh, nw)] = tile
+            results[tile] = measure(lambda nh=nh, nw=nw: run(nh, nw), param.device)
+            debug(f'Autotune: hypertile tile={tile} split={nh}x{nw} time={results[tile]}')
+    del x
+    return store(plan_key, 'hypertile', results, default)
+
+
+def sweep(resolutions: list, batch: int = 1):
+    """offline sweep over resolutions using loaded model, returns resulting plans"""
+    model = shared.sd_model
+    unet = getattr(model, "unet", None) if shared.backend == shared.Backend.DIFFUSERS else getattr(getattr(model, 'model', None), "diffusion_model", None)
+    module = self_attention(unet) if unet is not None else None
+    if module is None:
+        shared.log.warning('Autotune: model not loaded or has no self-attention')
+        return []
+    keys = []
+    for resolution in resolutions:
+        width, height = [int(v) for v in resolution.lower().split('x')]
+        if width % 8 != 0 or height % 8 != 0:
+            shared.log.warning(f'Autotune: resolution={resolution} not divisible by 8')
+            continue
+        default = max(128, 64 * min(width // 128, height // 128))
+        tile = hypertile_tile(unet, width, height, batch, default, force=True)
+        keys.append(hypertile_key(module, width, height, batch))
+        debug(f'Autotune: sweep resolution={resolution} tile={tile}')
+    plans = get_plans()
+    return [{'key': k, **plans[k]} for k in keys if k in plans]
@@ -103,6 +103,7 @@ class FrozenCLIPEmbedderWithCustomWordsBase(torch.nn.Module):
             if text == 'BREAK' and weight == -1:
                 next_chunk()
                 continue
+            embeddings = self.hijack.embedding_db.find_embeddings(tokens)
             position = 0
             while position < len(tokens):
                 token = tokens[position]
@@ -121,7 +122,7 @@ class FrozenCLIPEmbedderWithCustomWordsBase(torch.nn.Module):
                     chunk.multipliers = reloc_mults
                 if len(chunk.tokens) == self.chunk_length:
                     next_chunk()
-                embedding, embedding_length_in_tokens = self.hijack.embedding_db.find_embedding_at_position(tokens, position)
+                embedding, embedding_length_in_tokens = embeddings[position] or (None, None)
                 if embedding is None:
                     chunk.tokens.append(token)
                     chunk.multipliers.append(weight)
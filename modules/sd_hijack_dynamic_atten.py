@@ -3,7 +3,7 @@ from functools import cache
 import torch
 import torch.nn.functional as F
 from diffusers.utils import USE_PEFT_BACKEND
-from modules import shared, devices
+from modules import shared, devices, sd_autotune
 
 
 @cache
@@ -49,8 +49,10 @@ def find_slice_sizes(query_shape, query_element_size, slice_rate=4):
     return do_split, do_split_2, do_split_3, split_slice_size, split_2_slice_size, split_3_slice_size
 
 
-def sliced_scaled_dot_product_attention(query, key, value, attn_mask=None, dropout_p=0.0, is_causal=False, **kwargs):
-    do_split, do_split_2, do_split_3, split_slice_size, split_2_slice_size, split_3_slice_size = find_slice_sizes(query.shape, query.element_size(), slice_rate=shared.opts.dynamic_attention_slice_rate)
+def sliced_scaled_dot_product_attention(query, key, value, attn_mask=None, dropout_p=0.0, is_causal=False, slice_rate=None, **kwargs):
+    if slice_rate is None:
+        slice_rate = sd_autotune.slice_rate(query, key, value)
+    do_split, do_split_2, do_split_3, split_slice_size, split_2_slice_size, split_3_slice_size = find_slice_sizes(query.shape, query.element_size(), slice_rate=slice_rate)
 
     # Slice SDPA
     if do_split:
@@ -220,6 +220,9 @@ def context_hypertile_unet(p):
         return nullcontext()
     else:
         tile_size = shared.opts.hypertile_unet_tile if shared.opts.hypertile_unet_tile > 0 else max(128, 64 * min(p.width // 128, p.height // 128))
+        if shared.opts.hypertile_unet_tile == 0 and shared.opts.hypertile_autotune:
+            from modules import sd_autotune
+            tile_size = sd_autotune.hypertile_tile(unet, p.width, p.height, p.batch_size, tile_size)
         shared.log.info(f'Applying hypertile: unet={tile_size}')
         p.extra_generation_params['Hypertile UNet'] = tile_size
         return split_attention(unet, tile_size=tile_size, min_tile_size=128, swap_size=shared.opts.hypertile_unet_swap_size, depth=shared.opts.hypertile_unet_depth)
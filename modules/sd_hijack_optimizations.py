@@ -47,9 +47,10 @@ def split_cross_attention_forward_v1(self, x, context=None, mask=None): # pylint
     h = self.heads
 
     q_in = self.to_q(x)
+    cache = context is not None
     context = default(context, x)
 
-    context_k, context_v = hypernetwork.apply_hypernetworks(shared.loaded_hypernetworks, context)
+    context_k, context_v = hypernetwork.apply_hypernetworks(shared.loaded_hypernetworks, context, cache=cache)
     k_in = self.to_k(context_k)
     v_in = self.to_v(context_v)
     del context, context_k, context_v, x
@@ -85,9 +86,10 @@ def split_cross_attention_forward_v1(self, x, context=None, mask=None): # pylint
 def split_cross_attention_forward(self, x, context=None, mask=None): # pylint: disable=unused-argument
     h = self.heads
     q_in = self.to_q(x)
+    cache = context is not None
     context = default(context, x)
 
-    context_k, context_v = hypernetwork.apply_hypernetworks(shared.loaded_hypernetworks, context)
+    context_k, context_v = hypernetwork.apply_hypernetworks(shared.loaded_hypernetworks, context, cache=cache)
     k_in = self.to_k(context_k)
     v_in = self.to_v(context_v)
 
@@ -214,9 +216,10 @@ def split_cross_attention_forward_invokeAI(self, x, context=None, mask=None): #
     h = self.heads
 
     q = self.to_q(x)
+    cache = context is not None
     context = default(context, x)
 
-    context_k, context_v = hypernetwork.apply_hypernetworks(shared.loaded_hypernetworks, context)
+    context_k, context_v = hypernetwork.apply_hypernetworks(shared.loaded_hypernetworks, context, cache=cache)
     k = self.to_k(context_k)
     v = self.to_v(context_v)
     del context, context_k, context_v, x
@@ -243,9 +246,10 @@ def sub_quad_attention_forward(self, x, context=None, mask=None):
     h = self.heads
 
     q = self.to_q(x)
+    cache = context is not None
     context = default(context, x)
 
-    context_k, context_v = hypernetwork.apply_hypernetworks(shared.loaded_hypernetworks, context)
+    context_k, context_v = hypernetwork.apply_hypernetworks(shared.loaded_hypernetworks, context, cache=cache)
     k = self.to_k(context_k)
     v = self.to_v(context_v)
     del context, context_k, context_v, x
@@ -324,9 +328,10 @@ def get_xformers_flash_attention_op(q, k, v):
 def xformers_attention_forward(self, x, context=None, mask=None): # pylint: disable=unused-argument
     h = self.heads
     q_in = self.to_q(x)
+    cache = context is not None
     context = default(context, x)
 
-    context_k, context_v = hypernetwork.apply_hypernetworks(shared.loaded_hypernetworks, context)
+    context_k, context_v = hypernetwork.apply_hypernetworks(shared.loaded_hypernetworks, context, cache=cache)
     k_in = self.to_k(context_k)
     v_in = self.to_v(context_v)
 
@@ -355,9 +360,10 @@ def scaled_dot_product_attention_forward(self, x, context=None, mask=None):
 
     h = self.heads
     q_in = self.to_q(x)
+    cache = context is not None
     context = default(context, x)
 
-    context_k, context_v = hypernetwork.apply_hypernetworks(shared.loaded_hypernetworks, context)
+    context_k, context_v = hypernetwork.apply_hypernetworks(shared.loaded_hypernetworks, context, cache=cache)
     k_in = self.to_k(context_k)
     v_in = self.to_v(context_v)
 
@@ -20,7 +20,7 @@ from omegaconf import OmegaConf
 import tomesd
 from transformers import logging as transformers_logging
 from ldm.util import instantiate_from_config
-from modules import paths, shared, shared_items, shared_state, modelloader, devices, script_callbacks, sd_vae, errors, hashes, sd_models_config, sd_models_compile, sd_hijack_accelerate
+from modules import paths, shared, shared_items, shared_state, modelloader, devices, script_callbacks, sd_vae, errors, hashes, sd_models_config, sd_models_compile, sd_hijack_accelerate, metrics, sd_offload
 from modules.timer import Timer
 from modules.memstats import memory_stats
 from modules.modeldata import model_data
@@ -695,7 +695,8 @@ def set_diffuser_options(sd_model, vae = None, op: str = 'model'):
                 shared.opts.diffusers_move_unet = False
                 shared.opts.diffusers_move_refiner = False
                 shared.log.warning(f'Disabling {op} "Move model to CPU" since "Sequential CPU offload" is enabled')
-            sd_model.enable_sequential_cpu_offload()
+            if not (shared.opts.diffusers_offload_pinned and sd_offload.apply(sd_model, devices.device)):
+                sd_model.enable_sequential_cpu_offload()
             sd_model.has_accelerate = True
     if hasattr(sd_model, "enable_vae_slicing"):
         if shared.cmd_opts.lowvram or shared.opts.diffusers_vae_slicing:
@@ -775,6 +776,9 @@ def move_model(model, device=None, force=False):
                             shared.log.error(f'Model move execution device: device={device} {e}')
     if getattr(model, 'has_accelerate', False) and not force:
         return
+    if shared.backend == shared.Backend.DIFFUSERS and shared.opts.diffusers_offload_pinned and sd_offload.move(model, device):
+        devices.torch_gc()
+        return
     try:
         model.to(device)
     except Exception as e:
@@ -901,6 +905,7 @@ def load_diffuser(checkpoint_info=None, already_loaded_state_dict=None, timer=No
         if checkpoint_info is None:
             unload_model_weights(op=op)
             return
+        metrics.counter('sd_model_loads_total', 'Model loads and switches', op=op).inc()
 
         vae = None
         sd_vae.loaded_vae_file = None
@@ -1318,6 +1323,7 @@ def load_model(checkpoint_info=None, already_loaded_state_dict=None, timer=None,
     else:
         if model_data.sd_refiner is not None and (checkpoint_info.hash == model_data.sd_refiner.sd_checkpoint_info.hash): # trying to load the same model
             return
+    metrics.counter('sd_model_loads_total', 'Model loads and switches', op=op).inc()
     shared.log.debug(f'Load {op}: name={checkpoint_info.filename} dict={already_loaded_state_dict is not None}')
     if timer is None:
         timer = Timer()
@@ -0,0 +1,314 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import torch
+from modules import shared, devices, metrics
+
+
+debug = shared.log.trace if os.environ.get('SD_OFFLOAD_DEBUG', None) is not None else lambda *args, **kwargs: None
+simulate = os.environ.get('SD_OFFLOAD_SIMULATE', None) is not None # run engine on cpu with a worker thread standing in for the copy stream
+streams = {}
+containers = (torch.nn.ModuleList, torch.nn.Sequential)
+
+
+def normalize(device):
+    device = torch.device(device)
+    if device.type == 'cuda' and device.index is None and torch.cuda.is_available():
+        device = torch.device('cuda', torch.cuda.current_device())
+    return device
+
+
+def supported(device) -> bool:
+    device = torch.device(device)
+    return simulate or (device.type == 'cuda' and torch.cuda.is_available())
+
+
+class CopyStream:
+    """side stream used for host<->device copies, in simulated mode a single worker thread stands in for the stream"""
+    def __init__(self, device):
+        self.device = normalize(device)
+        self.cuda = self.device.type == 'cuda' and not simulate
+        self.stream = torch.cuda.Stream(device=self.device) if self.cuda else None
+        self.executor = None if self.cuda else ThreadPoolExecutor(max_workers=1, thread_name_prefix='offload')
+
+    def submit(self, fn, after_compute: bool = False):
+        """queue copy work and return handle, device to host copies must wait for pending compute that writes the source"""
+        if not self.cuda:
+            return self.executor.submit(fn)
+        if after_compute:
+            self.stream.wait_stream(torch.cuda.current_stream(self.device))
+        with torch.cuda.stream(self.stream):
+            result = fn()
+        event = torch.cuda.Event()
+        event.record(self.stream)
+        return (event, result)
+
+    def wait(self, handle, host: bool = False):
+        """make compute stream wait for handle, host wait is only needed when cpu reads the result"""
+        if handle is None:
+            return None
+        if not self.cuda:
+            return handle.result()
+        event, result = handle
+        if host:
+            event.synchronize()
+        else:
+            torch.cuda.current_stream(self.device).wait_event(event)
+        return result
+
+    def result(self, handle):
+        """result of copy without adding dependency to compute stream, stream order protects later copies"""
+        return handle[1] if self.cuda else handle.result()
+
+    def use(self, tensor):
+        """tensor is shared by copy and compute streams so allocator must not reuse it until both are done"""
+        if self.cuda:
+            tensor.record_stream(torch.cuda.current_stream(self.device))
+            tensor.record_stream(self.stream)
+
+
+def get_stream(device) -> CopyStream:
+    key = str(normalize(device))
+    if key not in streams:
+        streams[key] = CopyStream(device)
+    return streams[key]
+
+
+class Block:
+    """group of parameters and buffers moved together, host copies are pinned once and reused for every transfer"""
+    def __init__(self, name: str, modules: list, device, stream: CopyStream, recurse: bool = True):
+        self.name = name
+        self.device = normalize(device)
+        self.stream = stream
+        self.slots = [] # (owner module, collection, name) resolved on every transfer since networks may replace parameters
+        for module in modules:
+            for m in (module.modules() if recurse else [module]):
+                self.slots += [(m, '_parameters', n) for n, t in m._parameters.items() if t is not None] # pylint: disable=protected-access
+                self.slots += [(m, '_buffers', n) for n, t in m._buffers.items() if t is not None] # pylint: disable=protected-access
+        self.host = [None] * len(self.slots)
+        self.uploaded = [None] * len(self.slots) # (tensor object, version) at upload, used to detect in-place updates
+        self.pending = None
+        self.size = sum(t.numel() * t.element_size() for t in self.tensors())
+
+    def tensors(self):
+        return [getattr(m, collection)[n] for m, collection, n in self.slots]
+
+    def on_host(self, i: int, t: torch.Tensor):
+        """location is tracked by identity with host copy so simulated mode works when host and device are both cpu"""
+        host = self.host[i]
+        if host is not None and host.data_ptr() == t.data.data_ptr():
+            return True
+        return t.device != self.device
+
+    def resident(self):
+        return not any(self.on_host(i, t) for i, t in enumerate(self.tensors()))
+
+    def pin(self, i: int, t: torch.Tensor):
+        """host copy of tensor currently on cpu, pinning is skipped in simulated mode where cuda is not available"""
+        host = self.host[i]
+        if host is not None and host.data_ptr() == t.data.data_ptr():
+            return host
+        host = t.data.pin_memory() if self.stream.cuda else t.data
+        self.host[i] = host
+        t.data = host
+        return host
+
+    @torch.inference_mode(False) # copies must stay normal tensors so in-place updates by networks bump version counters
+    def upload(self):
+        """start async host to device copy of all tensors not yet on device"""
+        if self.pending is not None:
+            return
+        sources = [(i, self.pin(i, t)) for i, t in enumerate(self.tensors()) if self.on_host(i, t)]
+        if len(sources) == 0:
+            return
+        def copy():
+            if self.stream.cuda:
+                return [(i, host.to(self.device, non_blocking=True)) for i, host in sources]
+            return [(i, host.clone()) for i, host in sources] # distinct storage emulates device memory
+        self.pending = self.stream.submit(copy)
+        metrics.counter('sd_offload_bytes_total', 'Bytes copied by overlapped offload', direction='h2d').inc(sum(host.numel() * host.element_size() for _i, host in sources))
+
+    @torch.inference_mode(False)
+    def wait(self):
+        """complete pending upload and swap device tensors into module"""
+        if self.pending is None:
+            self.upload()
+        if self.pending is None:
+            return
+        copies = self.stream.wait(self.pending)
+        self.pending = None
+        tensors = self.tensors()
+        for i, data in copies:
+            self.stream.use(data)
+            tensors[i].data = data
+            self.uploaded[i] = (tensors[i], tensors[i]._version) # pylint: disable=protected-access
+
+    def buffer(self, i: int, data: torch.Tensor):
+        host = self.host[i]
+        if host is None or host.shape != data.shape or host.dtype != data.dtype:
+            host = torch.empty(data.shape, dtype=data.dtype, device='cpu', pin_memory=True)
+        return host.copy_(data, non_blocking=True)
+
+    @torch.inference_mode(False)
+    def release(self, sync: bool = False):
+        """drop device tensors, unchanged tensors reuse existing host copy and modified ones are copied back"""
+        if self.pending is not None:
+            self.wait()
+        writeback = []
+        for i, t in enumerate(self.tensors()):
+            if self.on_host(i, t):
+                continue
+            host = self.host[i]
+            unchanged = self.uploaded[i] is not None and self.uploaded[i][0] is t and self.uploaded[i][1] == t._version # pylint: disable=protected-access
+            if unchanged and host is not None and host.shape == t.shape and host.dtype == t.dtype:
+                t.data = host
+            else:
+                writeback.append((i, t, t.data))
+            self.uploaded[i] = None
+        if len(writeback) == 0:
+            return
+        def copy():
+            if self.stream.cuda:
+                return [(i, self.buffer(i, data)) for i, _t, data in writeback]
+            return [(i, data.clone()) for i, _t, data in writeback]
+        handle = self.stream.submit(copy, after_compute=True)
+        copies = self.stream.wait(handle, host=True) if sync else self.stream.result(handle)
+        for (i, host), (_i, t, data) in zip(copies, writeback):
+            self.stream.use(data)
+            self.host[i] = host
+            t.data = host
+        metrics.counter('sd_offload_bytes_total', 'Bytes copied by overlapped offload', direction='d2h').inc(sum(data.numel() * data.element_size() for _i, _t, data in writeback))
+
+
+def split(module: torch.nn.Module, limit: int, prefix: str = ''):
+    """split module into blocks no larger than limit bytes where possible, returns list of (name, [modules]) and modules kept resident
+    root is always split since pipelines call methods such as vae.decode which do not trigger forward hooks"""
+    size = sum(t.numel() * t.element_size() for t in module.parameters())
+    children = list(module.named_children())
+    if len(children) == 0 or (size <= limit and len(prefix) > 0 and not isinstance(module, containers)):
+        return [(prefix or module.__class__.__name__, [module])], []
+    blocks, resident = [], [module] # tensors owned directly by split module stay on device
+    for name, child in children:
+        b, r = split(child, limit, f'{prefix}.{name}' if prefix else name)
+        blocks += b
+        resident += r
+    return blocks, resident
+
+
+class OffloadHook:
+    """attached as module._hf_hook so pipelines resolve execution device and accelerate remove_hook_from_module can detach engine"""
+    def __init__(self, engine, device):
+        self.engine = engine
+        self.execution_device = device
+
+    def detach_hook(self, module):
+        self.engine.detach(remove_hook=False) # accelerate deletes module._hf_hook itself after calling detach_hook
+        return module
+
+
+class OffloadEngine:
+    """streams module blocks to device as they execute: block n+1 is prefetched on copy stream while block n computes and released after use"""
+    def __init__(self, module: torch.nn.Module, device, limit: int):
+        self.module = module
+        self.device = normalize(device)
+        self.stream = get_stream(self.device)
+        blocks, resident = split(module, limit)
+        self.blocks = [Block(name, modules, self.device, self.stream) for name, modules in blocks]
+        self.resident = Block('resident', resident, self.device, self.stream, recurse=False)
+        self.successor = {} # execution order is learned as blocks run so prefetch follows actual call order
+        self.last = None
+        self.handles = []
+        for i, (_name, modules) in enumerate(blocks):
+            for m in modules:
+                self.handles.append(m.register_forward_pre_hook(self.pre_hook(i)))
+                self.handles.append(m.register_forward_hook(self.post_hook(i)))
+        for block in self.blocks:
+            block.release(sync=True)
+        self.resident.wait()
+        module._hf_hook = OffloadHook(self, self.device) # pylint: disable=protected-access
+        debug(f'Offload: attach module={module.__class__.__name__} device={self.device} blocks={len(self.blocks)} resident={self.resident.size} largest={max([b.size for b in self.blocks] or [0])}')
+
+    def pre_hook(self, i: int):
+        def fn(_module, _args):
+            if self.last is not None and self.last != i:
+                self.successor[self.last] = i
+            self.last = i
+            self.blocks[i].wait()
+            following = self.successor.get(i, None)
+            if following is not None and following != i:
+                self.blocks[following].upload()
+        return fn
+
+    def post_hook(self, i: int):
+        def fn(_module, _args, _output):
+            if self.successor.get(i, None) != i:
+                self.blocks[i].release()
+        return fn
+
+    def detach(self, remove_hook: bool = True):
+        """remove hooks and leave all weights on host, same as accelerate leaves modules after removing sequential offload"""
+        for handle in self.handles:
+            handle.remove()
+        self.handles.clear()
+        for block in self.blocks + [self.resident]:
+            block.release(sync=True)
+        hook = getattr(self.module, '_hf_hook', None)
+        if remove_hook and isinstance(hook, OffloadHook) and hook.engine is self:
+            del self.module._hf_hook # pylint: disable=protected-access
+        self.module._sd_offload = None # pylint: disable=protected-access
+        debug(f'Offload: detach module={self.module.__class__.__name__}')
+
+
+def components(model):
+    if hasattr(model, 'components'):
+        exclude = getattr(model, '_exclude_from_cpu_offload', [])
+        return [m for name, m in model.components.items() if isinstance(m, torch.nn.Module) and name not in exclude]
+    return [model] if isinstance(model, torch.nn.Module) else []
+
+
+def apply(model, device=None):
+    """replace sequential cpu offload with overlapped block streaming for all pipeline components"""
+    device = device or devices.device
+    if not supported(device):
+        return False
+    t0 = time.time()
+    limit = int(shared.opts.diffusers_offload_block * 1024 * 1024)
+    for m in components(model):
+        if getattr(m, '_sd_offload', None) is None:
+            m._sd_offload = OffloadEngine(m, device, limit) # pylint: disable=protected-access
+    shared.log.debug(f'Offload: overlapped device={device} components={len(components(model))} block={shared.opts.diffusers_offload_block} time={time.time() - t0:.2f}')
+    return True
+
+
+def detach(model):
+    for m in components(model):
+        engine = getattr(m, '_sd_offload', None)
+        if engine is not None:
+            engine.detach()
+
+
+def move(model, device) -> bool:
+    """whole-module move reusing pinned host copies, returns false if move should be done by regular to()"""
+    device = torch.device(device)
+    if device.type not in {'cpu', torch.device(devices.device).type}:
+        for m in components(model): # e.g. unload to meta device, drop pinned host copies with the module
+            m._sd_offload_block = None # pylint: disable=protected-access
+        return False
+    target = device if device.type != 'cpu' else torch.device(devices.device)
+    if not supported(target):
+        return False
+    stream = get_stream(target)
+    for m in components(model):
+        if getattr(m, '_sd_offload', None) is not None: # streamed modules manage their own placement
+            continue
+        block = getattr(m, '_sd_offload_block', None)
+        if block is None or block.device != normalize(target):
+            block = Block(m.__class__.__name__, [m], target, stream)
+            m._sd_offload_block = block # pylint: disable=protected-access
+        if device.type == 'cpu':
+            block.release(sync=True)
+        else:
+            block.upload()
+            block.wait() # compute stream waits on copy event so host returns before transfer completes
+        debug(f'Offload: move module={m.__class__.__name__} device={device} size={block.size}')
+    return True
@@ -1,12 +1,15 @@
 import math
 import ldm.models.diffusion.ddim
 import ldm.models.diffusion.plms
+import ldm.modules.diffusionmodules.util
 import numpy as np
 import torch
-from modules import sd_samplers_common, prompt_parser, shared
+from modules import sd_samplers_common, prompt_parser, shared, tracing
 import modules.unipc
 
 
+ldm_noise_like = ldm.modules.diffusionmodules.util.noise_like
+
 samplers_data_compvis = [
     sd_samplers_common.SamplerData('UniPC', lambda model: VanillaStableDiffusionSampler(modules.unipc.UniPCSampler, model), [], {}),
     sd_samplers_common.SamplerData('DDIM', lambda model: VanillaStableDiffusionSampler(ldm.models.diffusion.ddim.DDIMSampler, model), [], {"default_eta_is_0": True}),
@@ -29,6 +32,7 @@ class VanillaStableDiffusionSampler:
         self.nmask = None
         self.init_latent = None
         self.sampler_noises = None
+        self.sampler_rng = None
         self.step = 0
         self.stop_at = None
         self.eta = None
@@ -39,6 +43,11 @@ class VanillaStableDiffusionSampler:
     def number_of_needed_noises(self, p): # pylint: disable=unused-argument
         return 0
 
+    def noise_like(self, shape, device, repeat=False):
+        if self.sampler_rng is not None and not repeat and shape[0] == len(self.sampler_rng.seeds):
+            return self.sampler_rng.next(shape[1:]).to(device)
+        return ldm_noise_like(shape, device, repeat)
+
     def launch_sampling(self, steps, func):
         shared.state.sampling_steps = steps
         shared.state.sampling_step = 0
@@ -118,6 +127,7 @@ class VanillaStableDiffusionSampler:
         sd_samplers_common.store_latent(self.last_latent)
         self.step += 1
         shared.state.sampling_step = self.step
+        tracing.step()
 
     def after_sample(self, x, ts, cond, uncond, res):
         if not self.is_unipc:
@@ -146,6 +156,7 @@ class VanillaStableDiffusionSampler:
                     v = getattr(shared.opts, key)
                     if v != shared.opts.get_default(key):
                         p.extra_generation_params[name] = v
+        ldm.models.diffusion.ddim.noise_like = self.noise_like # ddim with eta draws noise every step
         for fieldname in ['p_sample_ddim', 'p_sample_plms']:
             if hasattr(self.sampler, fieldname):
                 setattr(self.sampler, fieldname, self.p_sample_ddim_hook)
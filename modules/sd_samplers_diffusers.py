@@ -1,12 +1,25 @@
 import os
+import copy
+import json
+import types
 import inspect
-from modules import shared
+import threading
+from functools import wraps, cache
+from collections import OrderedDict
+import torch
+from modules import shared, metrics
 from modules import sd_samplers_common
 from modules.tcd import TCDScheduler
 
 
 debug = shared.log.trace if os.environ.get('SD_SAMPLER_DEBUG', None) is not None else lambda *args, **kwargs: None
 debug('Trace: SAMPLER')
+schedulers = OrderedDict() # constructed schedulers by class and effective config, handed out as clones
+timesteps = OrderedDict() # scheduler state after set_timesteps by class, effective config, steps and device
+cache_size = 64
+cache_lock = threading.Lock()
+missing = object() # sentinel for attributes created by set_timesteps
+tracked = {} # scheduler class -> subclass recording attribute assignments
 
 try:
     from diffusers import (
@@ -85,6 +98,106 @@ except Exception:
     pass
 
 
+@cache
+def scheduler_params(constructor):
+    return inspect.signature(constructor, follow_wrapped=True).parameters.keys()
+
+
+def cache_get(store: OrderedDict, key, name: str):
+    with cache_lock:
+        item = store.get(key, None)
+        if item is not None:
+            store.move_to_end(key)
+    metrics.counter('sd_cache_requests_total', 'Cache lookups', cache=name, result='hit' if item is not None else 'miss').inc()
+    return item
+
+
+def cache_put(store: OrderedDict, key, item):
+    with cache_lock:
+        store[key] = item
+        while len(store) > cache_size:
+            store.popitem(last=False)
+
+
+def clone_state(state: dict):
+    """copy mutable containers such as model_outputs, tensors are shared since schedulers replace them instead of modifying in place"""
+    return {k: v.copy() if type(v) in {list, dict} else v for k, v in state.items()}
+
+
+def changed(before, after):
+    """identity based comparison since values are often tensors, containers are compared by items as they can be modified in place"""
+    if before is after:
+        return False
+    if type(before) in {list, dict} and type(after) is type(before) and len(before) == len(after):
+        if isinstance(before, dict):
+            return before.keys() != after.keys() or any(before[k] is not after[k] for k in before)
+        return any(a is not b for a, b in zip(before, after))
+    return True
+
+
+def tracking(cls):
+    """subclass of scheduler class that records names of assigned attributes"""
+    if cls not in tracked:
+        def __setattr__(self, name, value):
+            self.__dict__.setdefault('_assigned', set()).add(name)
+            super(tracked[cls], self).__setattr__(name, value)
+        tracked[cls] = type(cls.__name__, (cls,), { '__setattr__': __setattr__ })
+    return tracked[cls]
+
+
+def clone(scheduler):
+    res = copy.copy(scheduler)
+    res.__dict__.update(clone_state(scheduler.__dict__))
+    return res
+
+
+def create_scheduler(constructor, scheduler_config: dict):
+    """construct scheduler once per class and effective config and hand out cheap clones with cached set_timesteps"""
+    if not shared.opts.schedulers_cache:
+        return constructor(**scheduler_config)
+    try:
+        key = f'{constructor.__name__}:{json.dumps(scheduler_config, sort_keys=True, default=str)}'
+    except Exception:
+        return constructor(**scheduler_config)
+    scheduler = cache_get(schedulers, key, 'scheduler')
+    if scheduler is None:
+        scheduler = constructor(**scheduler_config)
+        cache_put(schedulers, key, scheduler)
+    scheduler = clone(scheduler)
+    scheduler.set_timesteps = cached_set_timesteps(scheduler, key)
+    return scheduler
+
+
+def cached_set_timesteps(scheduler, key: str):
+    """timestep and sigma tables depend only on scheduler config, steps and device so state after set_timesteps can be reused"""
+    original = type(scheduler).set_timesteps
+
+    @wraps(original)
+    def set_timesteps(self, *args, **kwargs):
+        values = list(args) + list(kwargs.values())
+        if not shared.opts.schedulers_cache or not all(v is None or isinstance(v, (int, float, str, torch.device)) for v in values): # custom timesteps or sigmas are not cached
+            return original(self, *args, **kwargs)
+        timesteps_key = (key, tuple(str(v) for v in args), tuple(sorted((k, str(v)) for k, v in kwargs.items())))
+        state = cache_get(timesteps, timesteps_key, 'timesteps')
+        if state is None:
+            before = clone_state(self.__dict__)
+            cls = self.__class__
+            self.__class__ = tracking(cls) # record assignments so attributes reset to their current value are restored as well
+            try:
+                res = original(self, *args, **kwargs)
+            finally:
+                self.__class__ = cls
+                assigned = self.__dict__.pop('_assigned', set())
+            # only restore what set_timesteps modified, attributes such as noise_sampler_seed are set by caller and must not come from cache
+            state = {k: v for k, v in self.__dict__.items() if k != 'set_timesteps' and (k in assigned or changed(before.get(k, missing), v))}
+            cache_put(timesteps, timesteps_key, clone_state(state))
+            return res
+        self.__dict__.update(clone_state(state))
+        return None
+
+    return types.MethodType(set_timesteps, scheduler) # bound method so deepcopy of scheduler rebinds to the copy
+
+
 class DiffusionSampler:
     def __init__(self, name, constructor, model, **kwargs):
         if name == 'Default':
@@ -143,14 +256,13 @@ class DiffusionSampler:
             del self.config['beta_end']
             del self.config['beta_schedule']
         # validate all config params
-        signature = inspect.signature(constructor, follow_wrapped=True)
-        possible = signature.parameters.keys()
+        possible = scheduler_params(constructor)
         debug(f'Sampler: sampler="{name}" config={self.config} signature={possible}')
         for key in self.config.copy().keys():
             if key not in possible:
                 shared.log.warning(f'Sampler: sampler="{name}" config={self.config} invalid={key}')
                 del self.config[key]
         # shared.log.debug(f'Sampler: sampler="{name}" config={self.config}')
-        self.sampler = constructor(**self.config)
+        self.sampler = create_scheduler(constructor, self.config)
         # shared.log.debug(f'Sampler: class="{self.sampler.__class__.__name__}" config={self.sampler.config}')
         self.sampler.name = name
@@ -6,6 +6,7 @@ import torch
 from modules import prompt_parser
 from modules import devices
 from modules import sd_samplers_common
+from modules import tracing
 import modules.shared as shared
 from modules.script_callbacks import CFGDenoiserParams, cfg_denoiser_callback
 from modules.script_callbacks import CFGDenoisedParams, cfg_denoised_callback
@@ -206,10 +207,11 @@ class CFGDenoiser(torch.nn.Module):
 
 
 class TorchHijack:
-    def __init__(self, sampler_noises):
+    def __init__(self, sampler_noises, sampler_rng=None):
         # Using a deque to efficiently receive the sampler_noises in the same order as the previous index-based
         # implementation.
         self.sampler_noises = deque(sampler_noises)
+        self.sampler_rng = sampler_rng
 
     def __getattr__(self, item):
         if item == 'randn_like':
@@ -223,6 +225,8 @@ class TorchHijack:
             noise = self.sampler_noises.popleft()
             if noise.shape == x.shape:
                 return noise
+        if self.sampler_rng is not None and x.shape[0] == len(self.sampler_rng.seeds):
+            return self.sampler_rng.next(x.shape[1:]).to(device=x.device, dtype=x.dtype)
         if x.device.type == 'mps':
             return torch.randn_like(x, device=devices.cpu).to(x.device)
         else:
@@ -238,6 +242,7 @@ class KDiffusionSampler:
         self.extra_params = sampler_extra_params.get(funcname, [])
         self.model_wrap_cfg = CFGDenoiser(self.model_wrap)
         self.sampler_noises = None
+        self.sampler_rng = None
         self.stop_at = None
         self.eta = None
         self.config = None  # set by the function calling the constructor
@@ -254,6 +259,7 @@ class KDiffusionSampler:
         if self.stop_at is not None and step > self.stop_at:
             raise sd_samplers_common.InterruptedException
         shared.state.sampling_step = step
+        tracing.step()
 
     def launch_sampling(self, steps, func):
         shared.state.sampling_steps = steps
@@ -278,7 +284,7 @@ class KDiffusionSampler:
         self.model_wrap_cfg.image_cfg_scale = getattr(p, 'image_cfg_scale', None)
         self.eta = p.eta if p.eta is not None else shared.opts.scheduler_eta
         self.s_min_uncond = getattr(p, 's_min_uncond', 0.0)
-        k_sampling.torch = TorchHijack(self.sampler_noises if self.sampler_noises is not None else [])
+        k_sampling.torch = TorchHijack(self.sampler_noises if self.sampler_noises is not None else [], self.sampler_rng)
         extra_params_kwargs = {}
         for param_name in self.extra_params:
             if hasattr(p, param_name) and param_name in inspect.signature(self.func).parameters:
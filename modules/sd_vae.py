@@ -1,8 +1,10 @@
 import os
 import glob
+import time
 from copy import deepcopy
+from collections import OrderedDict
 import torch
-from modules import shared, paths, devices, script_callbacks, sd_models
+from modules import shared, paths, devices, script_callbacks, sd_models, metrics
 
 
 vae_ignore_keys = {"model_ema.decay", "model_ema.num_updates"}
@@ -10,6 +12,8 @@ vae_dict = {}
 base_vae = None
 loaded_vae_file = None
 checkpoint_info = None
+vae_pool = OrderedDict() # inactive converted diffusers vae modules kept on cpu for fast switching
+vae_pool_stats = { 'hit': 0, 'miss': 0 }
 vae_path = os.path.abspath(os.path.join(paths.models_path, 'VAE'))
 
 
@@ -205,7 +209,8 @@ def load_vae_diffusers(model_file, vae_file=None, vae_source="unknown-source"):
             else:
                 vae = diffusers.AutoencoderKL.from_pretrained(vae_file, **diffusers_load_config)
         global loaded_vae_file # pylint: disable=global-statement
-        loaded_vae_file = os.path.basename(vae_file)
+        loaded_vae_file = vae_file # full path same as resolve_vae so reload_vae_weights can detect unchanged vae
+        vae._sd_vae_key = pool_key(vae_file, model_file) # pylint: disable=protected-access
         # shared.log.debug(f'Diffusers VAE config: {vae.config}')
         return vae
     except Exception as e:
@@ -213,6 +218,68 @@ def load_vae_diffusers(model_file, vae_file=None, vae_source="unknown-source"):
     return None
 
 
+def pool_key(vae_file, model_file):
+    """converted module depends on load options and model type used for conversion config in addition to file"""
+    _pipeline, model_type = sd_models.detect_pipeline(model_file, 'vae', warning=False)
+    return f'{vae_file}:{model_type}:{devices.dtype_vae}:{shared.opts.diffusers_vae_load_variant}:{shared.opts.diffusers_vae_upcast}'
+
+
+def pool_size():
+    return sum(sum(t.numel() * t.element_size() for t in vae.state_dict().values()) for vae in vae_pool.values())
+
+
+def pool_get(key):
+    vae = vae_pool.pop(key, None) # active vae is owned by pipeline, pool only holds inactive ones
+    result = 'hit' if vae is not None else 'miss'
+    vae_pool_stats[result] += 1
+    metrics.counter('sd_cache_requests_total', 'Cache lookups', cache='vae', result=result).inc()
+    return vae
+
+
+def pool_put(vae):
+    """move outgoing vae to cpu and keep it within configured count and size budget"""
+    key = getattr(vae, '_sd_vae_key', None)
+    if key is None or shared.opts.sd_vae_checkpoint_cache <= 0:
+        return
+    if any(p.device.type == 'meta' for p in vae.parameters()): # weights owned by sequential offload hooks cannot be kept
+        return
+    engine = getattr(vae, '_sd_offload', None)
+    if engine is not None: # overlapped offload leaves weights on host after detach and is re-applied to incoming vae by set_diffuser_options
+        engine.detach()
+    elif hasattr(vae, '_hf_hook'):
+        from accelerate.hooks import remove_hook_from_module
+        remove_hook_from_module(vae, recurse=True)
+    if not (shared.opts.diffusers_offload_pinned and sd_models.sd_offload.move(vae, devices.cpu)):
+        vae.to(devices.cpu)
+    vae_pool[key] = vae
+    budget = shared.opts.sd_vae_cache_size * 1024 * 1024
+    while len(vae_pool) > shared.opts.sd_vae_checkpoint_cache or (len(vae_pool) > 0 and pool_size() > budget):
+        vae_pool.popitem(last=False)
+    devices.torch_gc()
+
+
+def load_vae_pooled(sd_model, vae_file=None, vae_source="unknown-source"):
+    """swap vae using pool of previously loaded modules, falls back to loading from disk on miss"""
+    global loaded_vae_file # pylint: disable=global-statement
+    if shared.opts.sd_vae_checkpoint_cache <= 0 or len(getattr(sd_model, '_all_hooks', [])) > 0: # model cpu offload hooks hold outgoing vae and are rebuilt for whole pipeline
+        return load_vae_diffusers(sd_model.sd_checkpoint_info.filename, vae_file, vae_source)
+    t0 = time.time()
+    model_file = sd_model.sd_checkpoint_info.filename
+    outgoing = getattr(sd_model, 'vae', None)
+    if outgoing is not None and getattr(outgoing, '_sd_vae_key', None) is None and loaded_vae_file is None: # vae baked into checkpoint
+        outgoing._sd_vae_key = pool_key(f'checkpoint:{model_file}', model_file) # pylint: disable=protected-access
+    vae = pool_get(pool_key(vae_file if vae_file is not None else f'checkpoint:{model_file}', model_file))
+    if vae is not None:
+        loaded_vae_file = vae_file
+        shared.log.info(f'Loading VAE: model={vae_file or "baked"} source={vae_source} pool=hit time={time.time() - t0:.2f}')
+    else:
+        vae = load_vae_diffusers(model_file, vae_file, vae_source)
+    if vae is not None and outgoing is not None and outgoing is not vae:
+        pool_put(outgoing)
+    shared.log.debug(f'VAE pool: items={len(vae_pool)} size={pool_size() // 1024 // 1024} hit={vae_pool_stats["hit"]} miss={vae_pool_stats["miss"]}')
+    return vae
+
+
 # don't call this from outside
 def _load_vae_dict(model, vae_dict_1):
     model.first_stage_model.load_state_dict(vae_dict_1)
@@ -258,7 +325,7 @@ def reload_vae_weights(sd_model=None, vae_file=unspecified):
             shared.log.info(f"VAE weights loaded: {vae_file}")
     else:
         if hasattr(shared.sd_model, "vae") and hasattr(shared.sd_model, "sd_checkpoint_info"):
-            vae = load_vae_diffusers(shared.sd_model.sd_checkpoint_info.filename, vae_file, vae_source)
+            vae = load_vae_pooled(shared.sd_model, vae_file, vae_source)
             if vae is not None:
                 sd_models.set_diffuser_options(sd_model, vae=vae, op='vae')
 
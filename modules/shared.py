@@ -171,11 +171,11 @@ def writefile(data, filename, mode='w', silent=False, atomic=False):
         locked = False
     try:
         if atomic:
-            with tempfile.NamedTemporaryFile(mode=mode, encoding="utf8", delete=False, dir=os.path.dirname(filename)) as f:
+            with tempfile.NamedTemporaryFile(mode=mode, encoding="utf8", delete=False, dir=os.path.dirname(filename) or '.') as f:
                 f.write(output)
                 f.flush()
                 os.fsync(f.fileno())
-                os.replace(f.name, filename)
+            os.replace(f.name, filename) # replace after close as open files cannot be replaced on windows
         else:
             with open(filename, mode=mode, encoding="utf8") as file:
                 file.write(output)
@@ -212,6 +212,8 @@ class OptionInfo:
         self.component = component
         self.component_args = component_args
         self.onchange = onchange
+        self.onchange_order = 0 # order in which callbacks of batched updates run
+        self.onchange_covers = () # keys whose callbacks are redundant once this callback ran in same batched update
         self.section = section
         self.refresh = refresh
         self.folder = folder
@@ -343,10 +345,13 @@ options_templates.update(options_section(('sd', "Execution & Models"), {
     "stream_load": OptionInfo(False, "Load models using stream loading method", gr.Checkbox, {"visible": backend == Backend.ORIGINAL }),
     "model_reuse_dict": OptionInfo(False, "Reuse loaded model dictionary", gr.Checkbox, {"visible": False}),
     "prompt_attention": OptionInfo("Full parser", "Prompt attention parser", gr.Radio, {"choices": ["Full parser", "Compel parser", "A1111 parser", "Fixed attention"] }),
+    "prompt_schedule_parser": OptionInfo("LALR", "Prompt schedule parser", gr.Radio, {"choices": ["LALR", "Earley"] }),
     "prompt_mean_norm": OptionInfo(True, "Prompt attention normalization", gr.Checkbox, {"visible": backend == Backend.ORIGINAL }),
     "comma_padding_backtrack": OptionInfo(20, "Prompt padding", gr.Slider, {"minimum": 0, "maximum": 74, "step": 1, "visible": backend == Backend.ORIGINAL }),
     "sd_checkpoint_cache": OptionInfo(0, "Cached models", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1, "visible": backend == Backend.ORIGINAL }),
-    "sd_vae_checkpoint_cache": OptionInfo(0, "Cached VAEs", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1, "visible": False}),
+    "sd_vae_checkpoint_cache": OptionInfo(2, "Cached VAEs", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1, "visible": backend == Backend.DIFFUSERS }),
+    "sd_vae_cache_size": OptionInfo(2048, "Cached VAEs size in MB", gr.Slider, {"minimum": 256, "maximum": 16384, "step": 256, "visible": backend == Backend.DIFFUSERS }),
+    "api_image_cache_size": OptionInfo(256, "API decoded image cache size in MB", gr.Slider, {"minimum": 0, "maximum": 4096, "step": 64}),
     "sd_disable_ckpt": OptionInfo(False, "Disallow models in ckpt format", gr.Checkbox, {"visible": False}),
 }))
 
@@ -368,6 +373,7 @@ options_templates.update(options_section(('cuda', "Compute Settings"), {
     "sdp_options": OptionInfo(sdp_options_default, "SDP options", gr.CheckboxGroup, {"choices": ['Flash attention', 'Memory attention', 'Math attention'] }),
     "xformers_options": OptionInfo(['Flash attention'], "xFormers options", gr.CheckboxGroup, {"choices": ['Flash attention'] }),
     "dynamic_attention_slice_rate": OptionInfo(4, "Dynamic Attention slicing rate in GB", gr.Slider, {"minimum": 0.1, "maximum": 16, "step": 0.1, "visible": backend == Backend.DIFFUSERS}),
+    "dynamic_attention_autotune": OptionInfo(False, "Dynamic Attention tune slicing rate per shape on first use", gr.Checkbox, {"visible": backend == Backend.DIFFUSERS}),
     "sub_quad_sep": OptionInfo("<h3>Sub-quadratic options</h3>", "", gr.HTML, {"visible": backend == Backend.ORIGINAL}),
     "sub_quad_q_chunk_size": OptionInfo(512, "Attention query chunk size", gr.Slider, {"minimum": 16, "maximum": 8192, "step": 8, "visible": backend == Backend.ORIGINAL}),
     "sub_quad_kv_chunk_size": OptionInfo(512, "Attention kv chunk size", gr.Slider, {"minimum": 0, "maximum": 8192, "step": 8, "visible": backend == Backend.ORIGINAL}),
@@ -434,6 +440,7 @@ options_templates.update(options_section(('advanced', "Inference Settings"), {
     "hypertile_unet_enabled": OptionInfo(False, "HyperTile UNet"),
     "hypertile_unet_tile": OptionInfo(0, "HyperTile UNet tile size", gr.Slider, {"minimum": 0, "maximum": 1024, "step": 8}),
     "hypertile_unet_swap_size": OptionInfo(1, "HyperTile UNet swap size", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}),
+    "hypertile_autotune": OptionInfo(False, "HyperTile UNet tune tile size on first use when tile size is 0"),
     "hypertile_unet_depth": OptionInfo(0, "HyperTile UNet depth", gr.Slider, {"minimum": 0, "maximum": 4, "step": 1}),
     "hypertile_vae_enabled": OptionInfo(False, "HyperTile VAE", gr.Checkbox),
     "hypertile_vae_tile": OptionInfo(128, "HyperTile VAE tile size", gr.Slider, {"minimum": 0, "maximum": 1024, "step": 8}),
@@ -454,9 +461,12 @@ options_templates.update(options_section(('diffusers', "Diffusers Settings"), {
     "diffusers_generator_device": OptionInfo("GPU", "Generator device", gr.Radio, {"choices": ["GPU", "CPU", "Unset"]}),
     "diffusers_model_cpu_offload": OptionInfo(False, "Model CPU offload (--medvram)"),
     "diffusers_seq_cpu_offload": OptionInfo(False, "Sequential CPU offload (--lowvram)"),
+    "diffusers_offload_pinned": OptionInfo(False, "Overlapped CPU offload using pinned memory"),
+    "diffusers_offload_block": OptionInfo(256, "Overlapped offload block size (MB)", gr.Slider, {"minimum": 16, "maximum": 2048, "step": 16}),
     "diffusers_vae_upcast": OptionInfo("default", "VAE upcasting", gr.Radio, {"choices": ['default', 'true', 'false']}),
     "diffusers_vae_slicing": OptionInfo(True, "VAE slicing"),
     "diffusers_vae_tiling": OptionInfo(False, "VAE tiling"),
+    "hires_latent_resident": OptionInfo(True, "Latent upscale keeps hires input in latent space without VAE decode and encode"),
     "diffusers_model_load_variant": OptionInfo("default", "Preferred Model variant", gr.Radio, {"choices": ['default', 'fp32', 'fp16']}),
     "diffusers_vae_load_variant": OptionInfo("default", "Preferred VAE variant", gr.Radio, {"choices": ['default', 'fp32', 'fp16']}),
     "custom_diffusers_pipeline": OptionInfo('', 'Load custom Diffusers pipeline'),
@@ -613,7 +623,9 @@ options_templates.update(options_section(('live-preview', "Live Previews"), {
 options_templates.update(options_section(('sampler-params', "Sampler Settings"), {
     "show_samplers": OptionInfo([], "Show samplers in user interface", gr.CheckboxGroup, lambda: {"choices": [x.name for x in list_samplers()]}),
     'eta_noise_seed_delta': OptionInfo(0, "Noise seed delta (eta)", gr.Number, {"precision": 0}),
+    "randn_source": OptionInfo("GPU", "Random number generator source", gr.Radio, {"choices": ["GPU", "CPU", "Philox"]}),
     "scheduler_eta": OptionInfo(1.0, "Noise multiplier (eta)", gr.Slider, {"minimum": 0.0, "maximum": 1.0, "step": 0.01}),
+    "schedulers_cache": OptionInfo(True, "Cache scheduler instances and timestep tables"),
     "schedulers_solver_order": OptionInfo(2, "Solver order (where applicable)", gr.Slider, {"minimum": 1, "maximum": 5, "step": 1}),
 
     # managed from ui.py for backend original
@@ -685,6 +697,8 @@ options_templates.update(options_section(('control', "Control Options"), {
     "control_max_units": OptionInfo(4, "Maximum number of units", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}),
     "control_move_processor": OptionInfo(False, "Processor move to CPU after use"),
     "control_unload_processor": OptionInfo(False, "Processor unload after use"),
+    "control_cache_size": OptionInfo(256, "Processor results cache size in MB", gr.Slider, {"minimum": 0, "maximum": 4096, "step": 64}),
+    "control_video_window": OptionInfo(4, "Video frames decoded ahead per window", gr.Slider, {"minimum": 1, "maximum": 64, "step": 1}),
 }))
 
 options_templates.update(options_section(('training', "Training"), {
@@ -715,6 +729,7 @@ options_templates.update(options_section(('interrogate', "Interrogate"), {
     "deepbooru_use_spaces": OptionInfo(False, "Use spaces for tags in deepbooru"),
     "deepbooru_escape": OptionInfo(True, "Escape brackets in deepbooru"),
     "deepbooru_filter_tags": OptionInfo("", "Filter out tags from deepbooru output"),
+    "deepbooru_batch_size": OptionInfo(16, "Interrogate: deepbooru batch size", gr.Slider, {"minimum": 1, "maximum": 64, "step": 1}),
 }))
 
 options_templates.update(options_section(('extra_networks', "Extra Networks"), {
@@ -740,6 +755,7 @@ options_templates.update(options_section(('extra_networks', "Extra Networks"), {
     "lora_fuse_diffusers": OptionInfo(False if not cmd_opts.use_openvino else True, "LoRA use merge when using alternative method"),
     "lora_in_memory_limit": OptionInfo(1 if not cmd_opts.use_openvino else 0, "LoRA memory cache", gr.Slider, {"minimum": 0, "maximum": 24, "step": 1}),
     "lora_functional": OptionInfo(False, "Use Kohya method for handling multiple LoRA", gr.Checkbox, { "visible": False }),
+    "hypernetwork_in_memory_limit": OptionInfo(1, "Hypernetwork memory cache", gr.Slider, {"minimum": 0, "maximum": 24, "step": 1, "visible": backend == Backend.ORIGINAL}),
     "sd_hypernetwork": OptionInfo("None", "Add hypernetwork to prompt", gr.Dropdown, { "choices": ["None"], "visible": False }),
 }))
 
@@ -757,6 +773,9 @@ class Options:
     data_labels = options_templates
     filename = None
     typemap = {int: float}
+    lock = threading.RLock()
+    save_timer = None
+    save_delay = 0.5 # seconds, consecutive saves within delay are coalesced into single write
 
     def __init__(self):
         self.data = {k: v.default for k, v in self.data_labels.items()}
@@ -803,6 +822,62 @@ class Options:
                 return False
         return True
 
+    def validate(self, key, value):
+        """returns reason why value cannot be set for key or none if value is valid"""
+        if key not in self.data_labels:
+            return 'unknown setting'
+        if cmd_opts.freeze:
+            return 'settings are frozen'
+        if cmd_opts.hide_ui_dir_config and key in restricted_opts:
+            return 'setting is restricted'
+        if not self.same_type(value, self.data_labels[key].default):
+            return f'bad value type={type(value).__name__} expecting={type(self.data_labels[key].default).__name__}'
+        return None
+
+    def set_many(self, values: dict):
+        """
+        transactional update: all values are validated before any is applied and all values are applied before any onchange callback runs
+        callbacks are called once even if shared by multiple changed options, in onchange order
+        callbacks of keys covered by an already executed callback are skipped, e.g. model reload also loads new vae and dict
+        returns list of changed keys and dict of failed keys with reasons, nothing is applied if any value is invalid
+        """
+        failed = {}
+        for key, value in values.items():
+            reason = self.validate(key, value)
+            if reason is not None:
+                failed[key] = reason
+        if len(failed) > 0:
+            return [], failed
+        changed = {}
+        with self.lock:
+            for key, value in values.items():
+                oldval = self.data.get(key, None)
+                if oldval is None:
+                    oldval = self.data_labels[key].default
+                if oldval != value:
+                    changed[key] = oldval
+                    self.data[key] = value
+        callbacks = {}
+        for key in changed:
+            if self.data_labels[key].onchange is not None:
+                callbacks.setdefault(self.data_labels[key].onchange, []).append(key)
+        covered = set()
+        for func, keys in sorted(callbacks.items(), key=lambda item: min(self.data_labels[k].onchange_order for k in item[1])):
+            if all(key in covered for key in keys):
+                continue
+            try:
+                func()
+                for key in keys:
+                    covered.update(self.data_labels[key].onchange_covers)
+            except Exception as e:
+                log.error(f'Error in onchange callback: {keys} {e}')
+                errors.display(e, 'Error in onchange callback')
+                with self.lock:
+                    for key in keys:
+                        self.data[key] = changed.pop(key)
+                        failed[key] = str(e)
+        return list(changed), failed
+
     def get_default(self, key):
         """returns the default value for the key"""
         data_label = self.data_labels.get(key)
@@ -827,7 +902,9 @@ class Options:
                 for k in self.data_labels.keys():
                     log.trace(f'  Config: item={k} default={self.data_labels[k].default}')
 
-            for k, v in self.data.items():
+            with self.lock:
+                data = self.data.copy()
+            for k, v in data.items():
                 if k in self.data_labels:
                     if type(v) is list:
                         diff[k] = v
@@ -837,14 +914,32 @@ class Options:
                     if k not in compatibility_opts:
                         unused_settings.append(k)
                     diff[k] = v
-            writefile(diff, filename, silent=silent)
+            writefile(diff, filename, silent=silent, atomic=True)
             if len(unused_settings) > 0:
                 log.debug(f"Unused settings: {unused_settings}")
         except Exception as e:
             log.error(f'Saving settings failed: {filename} {e}')
 
     def save(self, filename=None, silent=False):
-        threading.Thread(target=self.save_atomic, args=(filename, silent)).start()
+        """debounced background save, multiple changes in quick succession result in single write"""
+        with self.lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+            self.save_timer = threading.Timer(self.save_delay, self.save_atomic, args=(filename, silent))
+            self.save_timer.start()
+
+    def flush(self, write=True):
+        """complete or discard pending debounced save, must be called before config file is removed or server shuts down"""
+        with self.lock:
+            timer = self.save_timer
+            self.save_timer = None
+        if timer is None:
+            return
+        pending = not timer.finished.is_set()
+        timer.cancel()
+        timer.join() # save may already be running
+        if write and pending:
+            self.save_atomic(*timer.args)
 
     def same_type(self, x, y):
         if x is None or y is None:
@@ -873,9 +968,11 @@ class Options:
         if len(unknown_settings) > 0:
             log.debug(f"Unknown settings: {unknown_settings}")
 
-    def onchange(self, key, func, call=True):
+    def onchange(self, key, func, call=True, order=0, covers=()):
         item = self.data_labels.get(key)
         item.onchange = func
+        item.onchange_order = order
+        item.onchange_covers = tuple(covers)
         if call:
             func()
 
@@ -968,6 +1065,7 @@ total_tqdm = TotalTQDM()
 
 
 def restart_server(restart=True):
+    opts.flush()
     if demo is None:
         return
     log.warning('Server shutdown requested')
@@ -992,6 +1090,7 @@ def restart_server(restart=True):
 
 
 def restore_defaults(restart=True):
+    opts.flush(write=False) # pending save would recreate config file after it is removed
     if os.path.exists(cmd_opts.config):
         log.info('Restoring server defaults')
         os.remove(cmd_opts.config)
@@ -107,9 +107,44 @@ def convert_embedding(tensor, text_encoder, text_encoder_2):
     return output
 
 
+class EmbeddingTrie:
+    """prefix tree over embedding token ids built incrementally on registration
+    longest sequence wins and between identical sequences the first registered wins, same as sorted ids_lookup scan"""
+    def __init__(self):
+        self.root = {}
+
+    def add(self, ids: list, embedding):
+        node = self.root
+        for token in ids:
+            node = node.setdefault(token, {})
+        if None not in node: # terminal is stored under None key since token ids are ints
+            node[None] = (embedding, len(ids))
+
+    def clear(self):
+        self.root.clear()
+
+    def match(self, tokens, offset: int):
+        node = self.root.get(tokens[offset], None)
+        found = None
+        i = offset + 1
+        while node is not None:
+            found = node.get(None, found)
+            if i >= len(tokens):
+                break
+            node = node.get(tokens[i], None)
+            i += 1
+        return found
+
+    def search(self, tokens):
+        """single pass over token array, returns list with (embedding, length) where an embedding starts and None elsewhere"""
+        root = self.root
+        return [self.match(tokens, i) if token in root else None for i, token in enumerate(tokens)]
+
+
 class EmbeddingDatabase:
     def __init__(self):
         self.ids_lookup = {}
+        self.trie = EmbeddingTrie()
         self.word_embeddings = {}
         self.skipped_embeddings = {}
         self.expected_shape = -1
@@ -134,7 +169,10 @@ class EmbeddingDatabase:
         first_id = ids[0]
         if first_id not in self.ids_lookup:
             self.ids_lookup[first_id] = []
-        self.ids_lookup[first_id] = sorted(self.ids_lookup[first_id] + [(ids, embedding)], key=lambda x: len(x[0]), reverse=True)
+        candidates = self.ids_lookup[first_id] # kept longest-first for compatibility, insert after entries of same length instead of re-sorting
+        index = next((i for i, (other, _embedding) in enumerate(candidates) if len(other) < len(ids)), len(candidates))
+        candidates.insert(index, (ids, embedding))
+        self.trie.add(ids, embedding)
         return embedding
 
     def get_expected_shape(self):
@@ -348,6 +386,7 @@ class EmbeddingDatabase:
             if not need_reload:
                 return
         self.ids_lookup.clear()
+        self.trie.clear()
         self.word_embeddings.clear()
         self.skipped_embeddings.clear()
         self.embeddings_used.clear()
@@ -370,11 +409,7 @@ class EmbeddingDatabase:
 
 
     def find_embedding_at_position(self, tokens, offset):
-        token = tokens[offset]
-        possible_matches = self.ids_lookup.get(token, None)
-        if possible_matches is None:
-            return None, None
-        for ids, embedding in possible_matches:
-            if tokens[offset:offset + len(ids)] == ids:
-                return embedding, len(ids)
-        return None, None
+        return self.trie.match(tokens, offset) or (None, None)
+
+    def find_embeddings(self, tokens):
+        return self.trie.search(tokens)
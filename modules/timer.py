@@ -21,6 +21,11 @@ class Timer:
         self.records[category] += e + extra_time
         self.total += e + extra_time
 
+    def add(self, category, value):
+        # record externally measured time without moving the start marker, used for imports that happen outside the startup sequence
+        self.records[category] = self.records.get(category, 0) + value
+        self.total += value
+
     def summary(self, min_time=0.05):
         res = f"{self.total:.2f} "
         additions = [x for x in self.records.items() if x[1] >= min_time]
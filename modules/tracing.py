@@ -0,0 +1,194 @@
+import os
+import time
+import json
+import threading
+from functools import wraps
+from contextlib import contextmanager
+import torch
+from modules import shared, metrics
+
+
+debug = shared.log.trace if os.environ.get('SD_TRACE_DEBUG', None) is not None else lambda *args, **kwargs: None
+local = threading.local()
+waiting = 0 # number of requests waiting for queue lock
+waiting_lock = threading.Lock()
+metrics.gauge('sd_queue_depth', 'Requests waiting for queue lock', lambda: waiting)
+
+
+def vram_peak():
+    try:
+        return torch.cuda.max_memory_allocated() if torch.cuda.is_available() else 0
+    except Exception:
+        return 0
+
+
+def vram_reset():
+    try:
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+    except Exception:
+        pass
+
+
+class Stage:
+    def __init__(self, name: str, vram: bool = True):
+        self.name = name
+        self.track = vram # stages outside of queue lock must not touch process-wide peak counters
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.elapsed = 0
+        self.vram = 0
+        self.steps = []
+
+    def dict(self):
+        res = { 'name': self.name, 'time': round(self.elapsed, 4), 'vram': round(self.vram / 1024 / 1024) }
+        if len(self.steps) > 0:
+            res['steps'] = [round(s, 4) for s in self.steps]
+        return res
+
+
+class Trace:
+    """per-request list of timed stages with peak vram, stages can be nested and denoise stages record per-step timings"""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = []
+        self.active = []
+        self.vram = 0 # request peak, stages reset torch peak counters so this is the only complete value
+
+    def begin(self, name: str, vram: bool = True):
+        if vram:
+            if len(self.active) > 0 and self.active[-1].track: # keep parent peak before resetting counters for child
+                self.active[-1].vram = max(self.active[-1].vram, vram_peak())
+            vram_reset()
+        stage = Stage(name, vram=vram)
+        self.active.append(stage)
+        return stage
+
+    def end(self, stage: Stage):
+        stage.elapsed = time.perf_counter() - stage.start
+        if stage.track:
+            stage.vram = max(stage.vram, vram_peak())
+        if stage in self.active:
+            self.active.remove(stage)
+        if len(self.active) > 0 and self.active[-1].track:
+            self.active[-1].vram = max(self.active[-1].vram, stage.vram)
+        self.vram = max(self.vram, stage.vram)
+        self.stages.append(stage)
+        debug(f'Trace: stage={stage.name} time={stage.elapsed:.3f} vram={stage.vram} steps={len(stage.steps)}')
+
+    def step(self):
+        if len(self.active) == 0:
+            return
+        stage = self.active[-1]
+        t = time.perf_counter()
+        stage.steps.append(t - stage.last)
+        stage.last = t
+
+    def dict(self):
+        return {
+            'time': round(time.perf_counter() - self.start, 4),
+            'stages': [s.dict() for s in sorted(self.stages, key=lambda s: s.start)],
+        }
+
+
+def begin():
+    local.trace = Trace()
+    return local.trace
+
+
+def current():
+    return getattr(local, 'trace', None)
+
+
+def finish():
+    """detach trace from current thread and aggregate its stages into histograms"""
+    trace = current()
+    local.trace = None
+    local.last = trace
+    if trace is None:
+        return None
+    for s in trace.stages:
+        metrics.histogram('sd_stage_seconds', 'Processing stage wall time', stage=s.name).observe(s.elapsed)
+        if s.vram > 0:
+            metrics.histogram('sd_stage_vram_mb', 'Processing stage peak VRAM', buckets=metrics.memory_buckets, stage=s.name).observe(s.vram / 1024 / 1024)
+        if len(s.steps) > 0:
+            steps = metrics.histogram('sd_step_seconds', 'Denoise step wall time', stage=s.name)
+            for t in s.steps:
+                steps.observe(t)
+    metrics.histogram('sd_request_seconds', 'Request wall time').observe(time.perf_counter() - trace.start)
+    return trace
+
+
+@contextmanager
+def stage(name: str, vram: bool = True):
+    trace = current()
+    if trace is None:
+        yield None
+        return
+    s = trace.begin(name, vram=vram)
+    try:
+        yield s
+    finally:
+        trace.end(s)
+
+
+def traced(name: str):
+    """decorator that records function call as stage of current trace, no overhead if no trace is active"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if current() is None:
+                return fn(*args, **kwargs)
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def last_peak():
+    """peak vram in MB of last finished trace on current thread"""
+    trace = getattr(local, 'last', None)
+    return trace.vram // (1024 * 1024) if trace is not None else 0
+
+
+def step():
+    trace = current()
+    if trace is not None:
+        trace.step()
+
+
+@contextmanager
+def queued(lock):
+    """acquire queue lock and record time spent waiting for it, trace is detached if queued work fails
+    vram is not sampled while waiting since peak counters are process-wide and belong to the request holding the lock"""
+    global waiting # pylint: disable=global-statement
+    metrics.counter('sd_requests_total', 'Queued generate requests').inc()
+    with waiting_lock:
+        waiting += 1
+    try:
+        with stage('queue', vram=False):
+            lock.acquire()
+    finally:
+        with waiting_lock:
+            waiting -= 1
+    if current() is not None:
+        vram_reset()
+    try:
+        yield
+    except BaseException:
+        finish()
+        raise
+    finally:
+        lock.release()
+
+
+def attach(info: str, trace: Trace):
+    """add trace to json infotext returned by processing"""
+    if trace is None:
+        return info
+    try:
+        data = json.loads(info)
+        data['trace'] = trace.dict()
+        return json.dumps(data)
+    except Exception:
+        return info
@@ -230,15 +230,16 @@ def create_ui(startup_timer = None):
     opts.reorder()
 
     def run_settings(*args):
-        changed = []
+        values = {}
         for key, value, comp in zip(opts.data_labels.keys(), args, components):
-            if comp == dummy_component or value=='dummy':
+            if comp == dummy_component or value=='dummy' or getattr(opts, key) == value:
                 continue
-            if not opts.same_type(value, opts.data_labels[key].default):
-                log.error(f'Setting bad value: {key}={value} expecting={type(opts.data_labels[key].default).__name__}')
+            reason = opts.validate(key, value)
+            if reason is not None:
+                log.error(f'Setting bad value: {key}={value} {reason}')
                 continue
-            if opts.set(key, value):
-                changed.append(key)
+            values[key] = value
+        changed, _failed = opts.set_many(values) # applied together so dependent changes such as model and vae trigger single reload
         if shared.opts.cuda_compile_backend == "olive-ai":
             install_olive()
         if cmd_opts.use_directml:
@@ -68,8 +68,8 @@ def create_ui():
                     with gr.Row():
                         batch = gr.Text(label="Prompts", lines=10)
                     with gr.Row():
-                        clip_model = gr.Dropdown([], value='ViT-L-14/openai', label='CLIP Model')
-                        ui_common.create_refresh_button(clip_model, interrogate.get_clip_models, lambda: {"choices": interrogate.get_clip_models()}, 'refresh_interrogate_models')
+                        clip_model = gr.Dropdown(['DeepBooru'], value='ViT-L-14/openai', label='CLIP Model')
+                        ui_common.create_refresh_button(clip_model, interrogate.get_clip_models, lambda: {"choices": interrogate.get_clip_models() + ['DeepBooru']}, 'refresh_interrogate_models')
                     with gr.Row(elem_id='interrogate_buttons_batch'):
                         btn_interrogate_batch = gr.Button("Interrogate", elem_id="interrogate_btn_interrogate", variant='primary')
                 with gr.Tab("Visual Query"):
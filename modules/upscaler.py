@@ -4,7 +4,7 @@ import time
 import logging
 from abc import abstractmethod
 from PIL import Image
-from modules import devices, modelloader, shared
+from modules import devices, modelloader, shared, tracing
 from installer import setup_logging
 
 
@@ -93,6 +93,7 @@ class Upscaler:
     def do_upscale(self, img: Image, selected_model: str):
         return img
 
+    @tracing.traced('upscale')
     def upscale(self, img: Image, scale, selected_model: str = None):
         orig_state = copy.deepcopy(shared.state)
         shared.state.begin('upscale')
@@ -67,6 +67,9 @@ class Script(scripts.Script):
             num_adapters.change(fn=self.display_units, inputs=[num_adapters], outputs=units)
         return [num_adapters] + adapters + scales + files + starts + ends
 
+    def is_active(self, p: processing.StableDiffusionProcessing, *args): # pylint: disable=arguments-differ
+        return shared.backend == shared.Backend.DIFFUSERS and len(args) > 0 and args[0] > 0
+
     def process(self, p: processing.StableDiffusionProcessing, *args): # pylint: disable=arguments-differ
         if shared.backend != shared.Backend.DIFFUSERS:
             return
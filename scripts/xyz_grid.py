@@ -15,6 +15,9 @@ from modules.ui_components import ToolButton
 import modules.ui_symbols as symbols
 
 
+switches = { 'model': 0, 'refiner': 0, 'vae': 0, 'dict': 0 } # actual expensive switches performed during current grid
+
+
 def apply_field(field):
     def fun(p, x, xs):
         setattr(p, field, x)
@@ -79,6 +82,7 @@ def apply_checkpoint(p, x, xs):
     if info is None:
         shared.log.warning(f"XYZ grid: apply checkpoint unknown checkpoint: {x}")
     else:
+        switches['model'] += 1
         sd_models.reload_model_weights(shared.sd_model, info)
         p.override_settings['sd_model_checkpoint'] = info.name
 
@@ -92,6 +96,7 @@ def apply_refiner(p, x, xs):
     if info is None:
         shared.log.warning(f"XYZ grid: apply refiner unknown checkpoint: {x}")
     else:
+        switches['refiner'] += 1
         sd_models.reload_model_weights(shared.sd_refiner, info)
         p.override_settings['sd_model_refiner'] = info.name
 
@@ -104,6 +109,7 @@ def apply_dict(p, x, xs):
     if info_dict is None or info_ckpt is None:
         shared.log.warning(f"XYZ grid: apply dict unknown checkpoint: {x}")
     else:
+        switches['dict'] += 1
         shared.opts.sd_model_dict = info_dict.name # this will trigger reload_model_weights via onchange handler
         p.override_settings['sd_model_checkpoint'] = info_ckpt.name
         p.override_settings['sd_model_dict'] = info_dict.name
@@ -129,7 +135,10 @@ def find_vae(name: str):
 
 
 def apply_vae(p, x, xs):
-    sd_vae.reload_vae_weights(shared.sd_model, vae_file=find_vae(x))
+    vae_file = find_vae(x)
+    if vae_file != sd_vae.loaded_vae_file:
+        switches['vae'] += 1
+    sd_vae.reload_vae_weights(shared.sd_model, vae_file=vae_file)
 
 
 def apply_styles(p: processing.StableDiffusionProcessingTxt2Img, x: str, _):
@@ -198,14 +207,15 @@ def list_to_csv_string(data_list):
 
 
 class AxisOption:
-    def __init__(self, label, tipe, apply, fmt=format_value_add_label, confirm=None, cost=0.0, choices=None):
+    def __init__(self, label, tipe, apply, fmt=format_value_add_label, confirm=None, cost=0.0, choices=None, batch=False):
         self.label = label
         self.type = tipe
         self.apply = apply
         self.format_value = fmt
         self.confirm = confirm
-        self.cost = cost
+        self.cost = cost # relative cost of switching value: model reload > vae > lora > sampler > per-sample params
         self.choices = choices
+        self.batch = batch # axis only modifies prompt, negative prompt, seed or subseed so cells can be merged into a single batch
 
 
 class AxisOptionImg2Img(AxisOption):
@@ -221,21 +231,21 @@ class AxisOptionTxt2Img(AxisOption):
 
 axis_options = [
     AxisOption("Nothing", str, do_nothing, fmt=format_nothing),
-    AxisOption("Prompt S/R", str, apply_prompt, fmt=format_value),
+    AxisOption("Prompt S/R", str, apply_prompt, fmt=format_value, batch=True),
     AxisOption("Model", str, apply_checkpoint, fmt=format_value, cost=1.0, choices=lambda: sorted(sd_models.checkpoints_list)),
     AxisOption("VAE", str, apply_vae, cost=0.7, choices=lambda: ['None'] + list(sd_vae.vae_dict)),
-    AxisOption("Styles", str, apply_styles, choices=lambda: [s.name for s in shared.prompt_styles.styles.values()]),
-    AxisOptionTxt2Img("Sampler", str, apply_sampler, fmt=format_value, confirm=confirm_samplers, choices=lambda: [x.name for x in sd_samplers.samplers]),
-    AxisOptionImg2Img("Sampler", str, apply_sampler, fmt=format_value, confirm=confirm_samplers, choices=lambda: [x.name for x in sd_samplers.samplers_for_img2img]),
-    AxisOption("Seed", int, apply_field("seed")),
+    AxisOption("Styles", str, apply_styles, cost=0.3, choices=lambda: [s.name for s in shared.prompt_styles.styles.values()]),
+    AxisOptionTxt2Img("Sampler", str, apply_sampler, fmt=format_value, confirm=confirm_samplers, cost=0.2, choices=lambda: [x.name for x in sd_samplers.samplers]),
+    AxisOptionImg2Img("Sampler", str, apply_sampler, fmt=format_value, confirm=confirm_samplers, cost=0.2, choices=lambda: [x.name for x in sd_samplers.samplers_for_img2img]),
+    AxisOption("Seed", int, apply_field("seed"), batch=True),
     AxisOption("Steps", int, apply_field("steps")),
     AxisOption("CFG Scale", float, apply_field("cfg_scale")),
     AxisOption("CFG End", float, apply_field("cfg_end")),
-    AxisOption("Variation seed", int, apply_field("subseed")),
+    AxisOption("Variation seed", int, apply_field("subseed"), batch=True),
     AxisOption("Variation strength", float, apply_field("subseed_strength")),
     AxisOption("Clip skip", float, apply_clip_skip),
     AxisOption("Denoising strength", float, apply_field("denoising_strength")),
-    AxisOption("Prompt order", str_permutations, apply_order, fmt=format_value_join_list),
+    AxisOption("Prompt order", str_permutations, apply_order, fmt=format_value_join_list, batch=True),
     AxisOption("Model dictionary", str, apply_dict, fmt=format_value, cost=1.0, choices=lambda: ['None'] + list(sd_models.checkpoints_list)),
     AxisOptionImg2Img("Image mask weight", float, apply_field("inpainting_mask_weight")),
     AxisOption("[Postprocess] Upscaler", str, apply_upscaler, choices=lambda: [x.name for x in shared.sd_upscalers][1:]),
@@ -249,7 +259,7 @@ axis_options = [
     AxisOption("[Sampler] ETA", float, apply_setting("scheduler_eta")),
     AxisOption("[Sampler] Solver order", int, apply_setting("schedulers_solver_order")),
     AxisOption("[Second pass] Upscaler", str, apply_field("hr_upscaler"), choices=lambda: [*shared.latent_upscale_modes, *[x.name for x in shared.sd_upscalers]]),
-    AxisOption("[Second pass] Sampler", str, apply_hr_sampler_name, fmt=format_value, confirm=confirm_samplers, choices=lambda: [x.name for x in sd_samplers.samplers]),
+    AxisOption("[Second pass] Sampler", str, apply_hr_sampler_name, fmt=format_value, confirm=confirm_samplers, cost=0.2, choices=lambda: [x.name for x in sd_samplers.samplers]),
     AxisOption("[Second pass] Denoising Strength", float, apply_field("denoising_strength")),
     AxisOption("[Second pass] Hires steps", int, apply_field("hr_second_pass_steps")),
     AxisOption("[Second pass] CFG scale", float, apply_field("image_cfg_scale")),
@@ -280,7 +290,67 @@ axis_options = [
 ]
 
 
-def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend, include_lone_images, include_sub_grids, first_axes_processed, second_axes_processed, margin_size, no_grid):
+class GridPlanner:
+    """orders grid cells to minimize expensive switches and merges cells that differ only in batchable params"""
+    max_batch = 8
+
+    def __init__(self, axes, batch: bool = False):
+        self.axes = axes # list of (opt, values) in x, y, z order
+        self.batch = batch
+        self.costs = [self.axis_cost(opt, values) for opt, values in axes]
+        # most expensive axis is outermost, batchable axes are innermost so merged cells are consecutive
+        self.nesting = sorted(range(len(axes)), key=lambda i: (self.costs[i], not self.batchable(i)), reverse=True)
+
+    @staticmethod
+    def axis_cost(opt, values):
+        if opt.batch and any('<' in str(v) for v in values): # prompt values with extra networks trigger lora switches
+            return 0.3
+        return opt.cost
+
+    def batchable(self, i):
+        opt, values = self.axes[i]
+        return opt.batch and len(values) > 1 and self.axis_cost(opt, values) == opt.cost
+
+    def order(self, serpentine: bool = True):
+        """cell indices in execution order, inner axes reverse direction on alternate passes so expensive axes do not jump back to their first value"""
+        cells = [[]]
+        for level, i in enumerate(self.nesting):
+            count = len(self.axes[i][1])
+            expanded = []
+            for n, cell in enumerate(cells):
+                indices = range(count - 1, -1, -1) if serpentine and level > 0 and n % 2 == 1 else range(count)
+                expanded += [cell + [(i, j)] for j in indices]
+            cells = expanded
+        return [tuple(dict(cell)[i] for i in range(len(self.axes))) for cell in cells]
+
+    def groups(self):
+        order = self.order()
+        if not self.batch:
+            return [[cell] for cell in order]
+        fixed = [i for i in range(len(self.axes)) if not self.batchable(i)]
+        groups = []
+        for cell in order:
+            key = tuple(cell[i] for i in fixed)
+            if len(groups) > 0 and len(groups[-1]) < self.max_batch and tuple(groups[-1][0][i] for i in fixed) == key:
+                groups[-1].append(cell)
+            else:
+                groups.append([cell])
+        return groups
+
+    def switches(self, order):
+        """estimated number of value changes for each axis with a switch cost"""
+        res = {}
+        for i, (opt, _values) in enumerate(self.axes):
+            if self.costs[i] > 0:
+                res[opt.label] = sum(1 for a, b in zip(order, order[1:]) if a[i] != b[i]) + 1
+        return res
+
+    def report(self):
+        default = self.order(serpentine=False)
+        return f'nesting={[self.axes[i][0].label for i in self.nesting]} default={self.switches(default)} planned={self.switches(self.order())} batches={len(self.groups())}'
+
+
+def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend, include_lone_images, include_sub_grids, plan, margin_size, no_grid):
     hor_texts = [[images.GridAnnotation(x)] for x in x_labels]
     ver_texts = [[images.GridAnnotation(y)] for y in y_labels]
     title_texts = [[images.GridAnnotation(z)] for z in z_labels]
@@ -288,14 +358,12 @@ def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend
     processed_result = None
     shared.state.job_count = list_size * p.n_iter
 
-    def process_cell(x, y, z, ix, iy, iz):
+    def process_cell(processed: processing.Processed, ix, iy, iz):
         nonlocal processed_result
 
         def index(ix, iy, iz):
             return ix + iy * len(xs) + iz * len(xs) * len(ys)
 
-        shared.state.job = 'grid'
-        processed: processing.Processed = cell(x, y, z, ix, iy, iz)
         if processed_result is None:
             processed_result = copy(processed)
             if processed_result is None:
@@ -320,36 +388,11 @@ def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend
                 cell_size = processed_result.images[0].size
             processed_result.images[idx] = Image.new(cell_mode, cell_size)
 
-    if first_axes_processed == 'x':
-        for ix, x in enumerate(xs):
-            if second_axes_processed == 'y':
-                for iy, y in enumerate(ys):
-                    for iz, z in enumerate(zs):
-                        process_cell(x, y, z, ix, iy, iz)
-            else:
-                for iz, z in enumerate(zs):
-                    for iy, y in enumerate(ys):
-                        process_cell(x, y, z, ix, iy, iz)
-    elif first_axes_processed == 'y':
-        for iy, y in enumerate(ys):
-            if second_axes_processed == 'x':
-                for ix, x in enumerate(xs):
-                    for iz, z in enumerate(zs):
-                        process_cell(x, y, z, ix, iy, iz)
-            else:
-                for iz, z in enumerate(zs):
-                    for ix, x in enumerate(xs):
-                        process_cell(x, y, z, ix, iy, iz)
-    elif first_axes_processed == 'z':
-        for iz, z in enumerate(zs):
-            if second_axes_processed == 'x':
-                for ix, x in enumerate(xs):
-                    for iy, y in enumerate(ys):
-                        process_cell(x, y, z, ix, iy, iz)
-            else:
-                for iy, y in enumerate(ys):
-                    for ix, x in enumerate(xs):
-                        process_cell(x, y, z, ix, iy, iz)
+    for group in plan:
+        shared.state.job = 'grid'
+        results = cell([(xs[ix], ys[iy], zs[iz], ix, iy, iz) for ix, iy, iz in group])
+        for (ix, iy, iz), processed in zip(group, results):
+            process_cell(processed, ix, iy, iz)
 
     if not processed_result:
         shared.log.error("XYZ grid: Failed to initialize processing")
@@ -455,6 +498,7 @@ class Script(scripts.Script):
                 no_grid = gr.Checkbox(label='Skip grid', value=False, elem_id=self.elem_id("no_xyz_grid"), container=False)
                 include_lone_images = gr.Checkbox(label='Sub-images', value=False, elem_id=self.elem_id("include_lone_images"), container=False)
                 include_sub_grids = gr.Checkbox(label='Sub-grids', value=False, elem_id=self.elem_id("include_sub_grids"), container=False)
+                batch_cells = gr.Checkbox(label='Batch cells', value=False, elem_id=self.elem_id("batch_cells"), container=False)
         with gr.Row():
             margin_size = gr.Slider(label="Grid margins", minimum=0, maximum=500, value=0, step=2, elem_id=self.elem_id("margin_size"))
         with gr.Row():
@@ -533,10 +577,10 @@ class Script(scripts.Script):
             (z_values_dropdown, lambda params:get_dropdown_update_from_params("Z",params)),
         )
 
-        return [x_type, x_values, x_values_dropdown, y_type, y_values, y_values_dropdown, z_type, z_values, z_values_dropdown, csv_mode, draw_legend, no_fixed_seeds, no_grid, include_lone_images, include_sub_grids, margin_size]
+        return [x_type, x_values, x_values_dropdown, y_type, y_values, y_values_dropdown, z_type, z_values, z_values_dropdown, csv_mode, draw_legend, no_fixed_seeds, no_grid, include_lone_images, include_sub_grids, margin_size, batch_cells]
 
-    def run(self, p, x_type, x_values, x_values_dropdown, y_type, y_values, y_values_dropdown, z_type, z_values, z_values_dropdown, csv_mode, draw_legend, no_fixed_seeds, no_grid, include_lone_images, include_sub_grids, margin_size): # pylint: disable=W0221
-        shared.log.debug(f'xyzgrid: x_type={x_type}|x_values={x_values}|x_values_dropdown={x_values_dropdown}|y_type={y_type}|{y_values}={y_values}|{y_values_dropdown}={y_values_dropdown}|z_type={z_type}|z_values={z_values}|z_values_dropdown={z_values_dropdown}|draw_legend={draw_legend}|include_lone_images={include_lone_images}|include_sub_grids={include_sub_grids}|no_grid={no_grid}|margin_size={margin_size}')
+    def run(self, p, x_type, x_values, x_values_dropdown, y_type, y_values, y_values_dropdown, z_type, z_values, z_values_dropdown, csv_mode, draw_legend, no_fixed_seeds, no_grid, include_lone_images, include_sub_grids, margin_size, batch_cells=False): # pylint: disable=W0221
+        shared.log.debug(f'xyzgrid: x_type={x_type}|x_values={x_values}|x_values_dropdown={x_values_dropdown}|y_type={y_type}|{y_values}={y_values}|{y_values_dropdown}={y_values_dropdown}|z_type={z_type}|z_values={z_values}|z_values_dropdown={z_values_dropdown}|draw_legend={draw_legend}|include_lone_images={include_lone_images}|include_sub_grids={include_sub_grids}|no_grid={no_grid}|margin_size={margin_size}|batch_cells={batch_cells}')
         if not no_fixed_seeds:
             processing.fix_seed(p)
         if not shared.opts.return_grid:
@@ -635,44 +679,69 @@ class Script(scripts.Script):
         shared.state.xyz_plot_x = AxisInfo(x_opt, xs)
         shared.state.xyz_plot_y = AxisInfo(y_opt, ys)
         shared.state.xyz_plot_z = AxisInfo(z_opt, zs)
-        # If one of the axes is very slow to change between (like SD model checkpoint), then make sure it is in the outer iteration of the nested `for` loop.
-        first_axes_processed = 'z'
-        second_axes_processed = 'y'
-        if x_opt.cost > y_opt.cost and x_opt.cost > z_opt.cost:
-            first_axes_processed = 'x'
-            if y_opt.cost > z_opt.cost:
-                second_axes_processed = 'y'
-            else:
-                second_axes_processed = 'z'
-        elif y_opt.cost > x_opt.cost and y_opt.cost > z_opt.cost:
-            first_axes_processed = 'y'
-            if x_opt.cost > z_opt.cost:
-                second_axes_processed = 'x'
-            else:
-                second_axes_processed = 'z'
-        elif z_opt.cost > x_opt.cost and z_opt.cost > y_opt.cost:
-            first_axes_processed = 'z'
-            if x_opt.cost > y_opt.cost:
-                second_axes_processed = 'x'
-            else:
-                second_axes_processed = 'y'
+        # expensive axes are processed in the outer loops and cells that differ only in batchable params are merged
+        batch_cells = batch_cells and p.n_iter == 1 and p.batch_size == 1 and isinstance(p.prompt, str) and isinstance(p.negative_prompt, str)
+        planner = GridPlanner([(x_opt, xs), (y_opt, ys), (z_opt, zs)], batch=batch_cells)
+        plan = planner.groups()
+        for k in switches:
+            switches[k] = 0
+        shared.log.debug(f'XYZ grid plan: {planner.report()}')
         grid_infotext = [None] * (1 + len(zs))
 
-        def cell(x, y, z, ix, iy, iz):
+        def cell(group):
             if shared.state.interrupted:
-                return processing.Processed(p, [], p.seed, "")
+                return [processing.Processed(p, [], p.seed, "")] * len(group)
             pc = copy(p)
             pc.override_settings_restore_afterwards = False
             pc.styles = pc.styles[:]
-            x_opt.apply(pc, x, xs)
-            y_opt.apply(pc, y, ys)
-            z_opt.apply(pc, z, zs)
+            if len(group) == 1:
+                x, y, z, ix, iy, iz = group[0]
+                x_opt.apply(pc, x, xs)
+                y_opt.apply(pc, y, ys)
+                z_opt.apply(pc, z, zs)
+            else: # merged cells: non-batchable axes are identical within group so they are applied once
+                x, y, z, ix, iy, iz = group[0]
+                for opt, val, vals in [(x_opt, x, xs), (y_opt, y, ys), (z_opt, z, zs)]:
+                    if not opt.batch:
+                        opt.apply(pc, val, vals)
+                prompts, negatives, seeds, subseeds = [], [], [], []
+                for x, y, z, _ix, _iy, _iz in group:
+                    pcc = copy(pc)
+                    for opt, val, vals in [(x_opt, x, xs), (y_opt, y, ys), (z_opt, z, zs)]:
+                        if opt.batch:
+                            opt.apply(pcc, val, vals)
+                    prompts.append(pcc.prompt)
+                    negatives.append(pcc.negative_prompt)
+                    seeds.append(processing.get_fixed_seed(pcc.seed))
+                    subseeds.append(processing.get_fixed_seed(pcc.subseed))
+                pc.prompt, pc.negative_prompt, pc.seed, pc.subseed = prompts, negatives, seeds, subseeds
+                pc.batch_size = len(group)
+                pc.do_not_save_grid = True
             try:
                 res = processing.process_images(pc)
             except Exception as e:
                 shared.log.error(f"XYZ grid: Failed to process image: {e}")
                 errors.display(e, 'XYZ grid')
                 res = None
+            results = [res] if len(group) == 1 else split_batch(res, len(group))
+            for n, (_x, _y, _z, ix, iy, iz) in enumerate(group):
+                grid_info(pc, n, ix, iy, iz)
+            return results
+
+        def split_batch(res, count):
+            if res is None or len(res.images) < count:
+                return [None] * count
+            results = []
+            for n in range(count):
+                r = copy(res)
+                r.images = [res.images[n]]
+                r.prompt = res.all_prompts[n]
+                r.seed = res.all_seeds[n]
+                r.infotexts = [res.infotexts[n]]
+                results.append(r)
+            return results
+
+        def grid_info(pc, n, ix, iy, iz):
             subgrid_index = 1 + iz # Sets subgrid infotexts
             if grid_infotext[subgrid_index] is None and ix == 0 and iy == 0:
                 pc.extra_generation_params = copy(pc.extra_generation_params)
@@ -687,7 +756,7 @@ class Script(scripts.Script):
                     pc.extra_generation_params["Y Values"] = y_values
                     if y_opt.label in ["Seed", "Var. seed"] and not no_fixed_seeds:
                         pc.extra_generation_params["Fixed Y Values"] = ", ".join([str(y) for y in ys])
-                grid_infotext[subgrid_index] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds)
+                grid_infotext[subgrid_index] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds, position_in_batch=n)
             if grid_infotext[0] is None and ix == 0 and iy == 0 and iz == 0: # Sets main grid infotext
                 pc.extra_generation_params = copy(pc.extra_generation_params)
                 if z_opt.label != 'Nothing':
@@ -695,8 +764,7 @@ class Script(scripts.Script):
                     pc.extra_generation_params["Z Values"] = z_values
                     if z_opt.label in ["Seed", "Var. seed"] and not no_fixed_seeds:
                         pc.extra_generation_params["Fixed Z Values"] = ", ".join([str(z) for z in zs])
-                grid_infotext[0] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds)
-            return res
+                grid_infotext[0] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds, position_in_batch=n)
 
         with SharedSettingsStackHelper():
             processed = draw_xyz_grid(
@@ -711,12 +779,12 @@ class Script(scripts.Script):
                 draw_legend=draw_legend,
                 include_lone_images=include_lone_images,
                 include_sub_grids=include_sub_grids,
-                first_axes_processed=first_axes_processed,
-                second_axes_processed=second_axes_processed,
+                plan=plan,
                 margin_size=margin_size,
                 no_grid=no_grid,
             )
 
+        shared.log.info(f'XYZ grid: batches={len(plan)} switches={ {k: v for k, v in switches.items() if v > 0} } estimated={planner.switches(planner.order())}')
         if not processed.images:
             return processed # It broke, no further handling needed.
         z_count = len(zs)
@@ -24,9 +24,6 @@ import modules.scripts
 import modules.sd_models
 import modules.sd_vae
 import modules.progress
-import modules.ui
-import modules.txt2img
-import modules.img2img
 import modules.upscaler
 import modules.textual_inversion.textual_inversion
 import modules.hypernetworks.hypernetwork
@@ -61,6 +58,8 @@ fastapi_args = {
 import modules.sd_hijack
 timer.startup.record("ldm")
 
+ui = modules.loader.lazy_import('modules.ui', 'ui-import') # ui modules are only imported when ui is created so api-only server never loads them
+
 modules.loader.initialized = True
 
 
@@ -162,11 +161,12 @@ def load_model():
         shared.state.end()
         thread_model.join()
         thread_refiner.join()
-    shared.opts.onchange("sd_model_checkpoint", wrap_queued_call(lambda: modules.sd_models.reload_model_weights(op='model')), call=False)
-    shared.opts.onchange("sd_model_refiner", wrap_queued_call(lambda: modules.sd_models.reload_model_weights(op='refiner')), call=False)
-    shared.opts.onchange("sd_model_dict", wrap_queued_call(lambda: modules.sd_models.reload_model_weights(op='dict')), call=False)
-    shared.opts.onchange("sd_vae", wrap_queued_call(lambda: modules.sd_vae.reload_vae_weights()), call=False)
-    shared.opts.onchange("sd_backend", wrap_queued_call(lambda: modules.sd_models.change_backend()), call=False)
+    # when changed together: backend switch runs first, then single model reload which also applies new dict and vae
+    shared.opts.onchange("sd_model_checkpoint", wrap_queued_call(lambda: modules.sd_models.reload_model_weights(op='model')), call=False, order=1, covers=['sd_model_dict', 'sd_vae'])
+    shared.opts.onchange("sd_model_refiner", wrap_queued_call(lambda: modules.sd_models.reload_model_weights(op='refiner')), call=False, order=1)
+    shared.opts.onchange("sd_model_dict", wrap_queued_call(lambda: modules.sd_models.reload_model_weights(op='dict')), call=False, order=1, covers=['sd_model_checkpoint', 'sd_vae'])
+    shared.opts.onchange("sd_vae", wrap_queued_call(lambda: modules.sd_vae.reload_vae_weights()), call=False, order=2)
+    shared.opts.onchange("sd_backend", wrap_queued_call(lambda: modules.sd_models.change_backend()), call=False, order=0)
     timer.startup.record("checkpoint")
 
 
@@ -220,7 +220,7 @@ def start_ui():
     log.debug('Creating UI')
     modules.script_callbacks.before_ui_callback()
     timer.startup.record("before-ui")
-    shared.demo = modules.ui.create_ui(timer.startup)
+    shared.demo = ui.create_ui(timer.startup)
     timer.startup.record("ui")
     if cmd_opts.disable_queue:
         log.info('Server queues disabled')